@@ -0,0 +1,125 @@
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import AnalysisCacheEntry
+
+ANALYSIS_CACHE_TTL_SECONDS = int(os.environ.get("ANALYSIS_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "5000"))
+
+class AnalysisCache:
+    """Content-addressed store of vision analysis results.
+
+    Entries are keyed on the hash of the normalized JPEG sent to the model,
+    the analysis type and the prompt version. Reads and writes use their own
+    connection so they never touch the caller's ORM session.
+    """
+
+    def __init__(self, ttl_seconds: int = ANALYSIS_CACHE_TTL_SECONDS, max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._table = AnalysisCacheEntry.__table__
+
+    @staticmethod
+    def image_hash(image_bytes) -> str:
+        """Hash of the normalized image bytes"""
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    @staticmethod
+    def make_key(image_hash: str, analysis_type: str, prompt_version: str) -> str:
+        """Cache key for an image analysed with a given prompt"""
+        return hashlib.sha256(f"{image_hash}:{analysis_type}:{prompt_version}".encode('utf-8')).hexdigest()
+
+    def get(self, image_hash: str, analysis_type: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+        """Return a cached analysis result, or None on a miss"""
+        key = self.make_key(image_hash, analysis_type, prompt_version)
+        now = datetime.utcnow()
+        table = self._table
+
+        try:
+            with db.engine.begin() as conn:
+                row = conn.execute(
+                    select(table.c.analysis_result, table.c.created_at).where(table.c.cache_key == key)
+                ).first()
+
+                if row is not None and now - row.created_at <= self.ttl:
+                    conn.execute(
+                        update(table)
+                        .where(table.c.cache_key == key)
+                        .values(hit_count=table.c.hit_count + 1, last_used_at=now)
+                    )
+                    self._count('hits')
+                    return row.analysis_result
+        except Exception as e:
+            logging.error(f"Analysis cache lookup failed: {str(e)}")
+
+        self._count('misses')
+        return None
+
+    def put(self, image_hash: str, analysis_type: str, prompt_version: str, analysis_result: Dict[str, Any]):
+        """Store an analysis result and apply TTL and size eviction"""
+        key = self.make_key(image_hash, analysis_type, prompt_version)
+        now = datetime.utcnow()
+        table = self._table
+
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(delete(table).where(table.c.cache_key == key))
+                conn.execute(table.insert().values(
+                    cache_key=key,
+                    image_hash=image_hash,
+                    analysis_type=analysis_type,
+                    prompt_version=prompt_version,
+                    analysis_result=analysis_result,
+                    hit_count=0,
+                    created_at=now,
+                    last_used_at=now
+                ))
+            self._count('stores')
+        except IntegrityError:
+            # Another worker stored the same analysis first
+            return
+        except Exception as e:
+            logging.error(f"Analysis cache store failed: {str(e)}")
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries and the least recently used ones above the size cap"""
+        table = self._table
+        cutoff = datetime.utcnow() - self.ttl
+
+        try:
+            with db.engine.begin() as conn:
+                evicted = conn.execute(delete(table).where(table.c.created_at < cutoff)).rowcount or 0
+
+                overflow = conn.execute(select(func.count()).select_from(table)).scalar() - self.max_entries
+                if overflow > 0:
+                    oldest = select(table.c.id).order_by(table.c.last_used_at).limit(overflow)
+                    evicted += conn.execute(delete(table).where(table.c.id.in_(oldest))).rowcount or 0
+        except Exception as e:
+            logging.error(f"Analysis cache eviction failed: {str(e)}")
+            return
+
+        if evicted:
+            self._count('evictions', evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process"""
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] += amount
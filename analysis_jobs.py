@@ -0,0 +1,180 @@
+import os
+import uuid
+import asyncio
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Tuple
+from sqlalchemy import update, or_, and_
+from app import db
+from models import AnalysisJob
+from metrics import chat_stage_latency
+
+# Number of background threads per process running image analyses
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "4"))
+
+# Seconds after which a queued or running job is presumed lost with its worker;
+# above the worst case of three vision attempts at OPENAI_READ_TIMEOUT plus backoff
+ANALYSIS_JOB_TIMEOUT = float(os.environ.get("ANALYSIS_JOB_TIMEOUT", "240"))
+
+STALE_JOB_ERROR = 'Analysis did not finish; its worker stopped or timed out'
+
+class AnalysisJobQueue:
+    """Local worker pool that runs image analysis jobs outside the request"""
+
+    def __init__(self, app, max_workers: int = ANALYSIS_WORKERS):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+
+    def create_job(self, session_id: int, message_id: int) -> AnalysisJob:
+        """Add a queued job row to the current DB session (caller commits)"""
+        job = AnalysisJob()
+        job.job_token = str(uuid.uuid4())
+        job.session_id = session_id
+        job.message_id = message_id
+        job.status = 'queued'
+        db.session.add(job)
+        return job
+
+    def submit(self, job_token: str, handler: Callable[[AnalysisJob], dict]) -> Future:
+        """Run a handler for a committed job on the worker pool
+        
+        The returned future resolves to the job result, or None if the job failed
+        """
+        return self.executor.submit(self._run, job_token, handler)
+
+    async def run_async(self, job_token: str, prepare: Callable[[AnalysisJob], Any],
+                        analyze: Callable[[Any], Awaitable[Any]],
+                        handler: Callable[[AnalysisJob, Any], dict]) -> Optional[dict]:
+        """Run a committed job on the event loop (ASGI mode)
+        
+        prepare(job) and handler(job, analysis) are short database and CPU
+        steps run on the worker pool inside an app context; analyze(prepared)
+        is awaited on the loop, so a job waiting on the vision model holds
+        no thread. Resolves to the job result, or None if the job failed.
+        A cancelled job (e.g. on worker shutdown) is marked failed before
+        the cancellation propagates.
+        """
+        loop = asyncio.get_running_loop()
+        preparing = loop.run_in_executor(self.executor, self._prepare, job_token, prepare)
+        try:
+            started, prepared = await asyncio.shield(preparing)
+            if not started:
+                return None
+            analysis = await analyze(prepared)
+        except asyncio.CancelledError:
+            await asyncio.shield(self._fail_cancelled(loop, job_token, preparing))
+            raise
+        except Exception as e:
+            error = e
+            return await loop.run_in_executor(self.executor, self._finish, job_token, lambda job: self._raise(error))
+        return await loop.run_in_executor(self.executor, self._finish, job_token, lambda job: handler(job, analysis))
+
+    async def _fail_cancelled(self, loop, job_token: str, preparing: asyncio.Future):
+        """Record a cancelled job as failed once its prepare step, still running on a thread, is done"""
+        try:
+            started, _ = await preparing
+        except Exception:
+            started = False
+        if started:
+            cancelled = RuntimeError("Analysis cancelled")
+            await loop.run_in_executor(self.executor, self._finish, job_token, lambda job: self._raise(cancelled))
+
+    def _run(self, job_token: str, handler: Callable[[AnalysisJob], dict]) -> Optional[dict]:
+        """Execute a job inside an app context and record its outcome"""
+        with self.app.app_context():
+            job = self._start(job_token)
+            if not job:
+                return None
+            return self._complete(job_token, job, handler)
+
+    def _prepare(self, job_token: str, prepare: Callable[[AnalysisJob], Any]) -> Tuple[bool, Any]:
+        """Mark a job running and run its prepare step; (False, None) if it is gone or failed"""
+        with self.app.app_context():
+            job = self._start(job_token)
+            if not job:
+                return False, None
+            try:
+                prepared = prepare(job)
+                db.session.commit()
+                return True, prepared
+            except Exception as e:
+                self._complete(job_token, job, lambda job: self._raise(e))
+                return False, None
+
+    def _finish(self, job_token: str, handler: Callable[[AnalysisJob], dict]) -> Optional[dict]:
+        with self.app.app_context():
+            return self._complete(job_token, self.get_job(job_token), handler)
+
+    def _start(self, job_token: str) -> Optional[AnalysisJob]:
+        """Claim a queued job; None if it is gone or was already taken or expired"""
+        claimed = db.session.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.job_token == job_token, AnalysisJob.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            logging.error(f"Analysis job {job_token} not found or no longer queued")
+            return None
+        return self.get_job(job_token)
+
+    def _complete(self, job_token: str, job: AnalysisJob, handler: Callable[[AnalysisJob], dict]) -> Optional[dict]:
+        """Run a job's handler and record its outcome, unless the job stopped running meanwhile"""
+        try:
+            result = handler(job)
+            status, error = 'completed', None
+        except Exception as e:
+            logging.error(f"Analysis job {job_token} failed: {str(e)}")
+            db.session.rollback()
+            result, status, error = None, 'failed', str(e)
+
+        recorded = db.session.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.job_token == job_token, AnalysisJob.status == 'running')
+            .values(status=status, result=result, error=error, completed_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not recorded:
+            # Expired as stale while it ran; keep the recorded failure and drop this turn
+            logging.error(f"Analysis job {job_token} is no longer running, discarding its outcome")
+            db.session.rollback()
+            return None
+        with chat_stage_latency.time(stage='db_commit'):
+            db.session.commit()  # Bot message, session state and job outcome together
+        return result if status == 'completed' else None
+
+    @staticmethod
+    def _raise(error: Exception):
+        raise error
+
+    def get_job(self, job_token: str) -> Optional[AnalysisJob]:
+        """Look up a job by token"""
+        return AnalysisJob.query.filter_by(job_token=job_token).first()
+
+    def is_stale(self, job: AnalysisJob, max_age: float = ANALYSIS_JOB_TIMEOUT) -> bool:
+        """Whether an unfinished job is older than any live worker would leave it"""
+        if job.status not in ('queued', 'running'):
+            return False
+        return (job.started_at or job.created_at) < datetime.utcnow() - timedelta(seconds=max_age)
+
+    def expire_stale_jobs(self, max_age: float = ANALYSIS_JOB_TIMEOUT) -> int:
+        """Mark jobs failed that were left queued or running by a worker that died or was recycled
+
+        Run at startup and from the status route; returns how many jobs were expired.
+        """
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=max_age)
+        result = db.session.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.status.in_(('queued', 'running')))
+            .where(or_(AnalysisJob.started_at < cutoff,
+                       and_(AnalysisJob.started_at.is_(None), AnalysisJob.created_at < cutoff)))
+            .values(status='failed', error=STALE_JOB_ERROR, completed_at=now)
+            .execution_options(synchronize_session='fetch')
+        )
+        db.session.commit()
+        if result.rowcount:
+            logging.error(f"Expired {result.rowcount} analysis jobs older than {max_age:.0f}s")
+        return result.rowcount
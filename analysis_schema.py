@@ -0,0 +1,112 @@
+from dataclasses import dataclass, field, fields, asdict
+from typing import Dict, List, Any, Optional, Type, Union
+
+# Bump whenever a schema below changes; stored with every parsed analysis
+SCHEMA_VERSION = 1
+
+class SchemaError(ValueError):
+    """A vision response that does not match the expected analysis schema"""
+
+def describe(text: str) -> Any:
+    """Dataclass field carrying the description the model sees in the JSON schema"""
+    return field(metadata={'description': text})
+
+@dataclass
+class InspirationAnalysis:
+    """How to recreate an inspiration photo; only the fields the response renders"""
+    lighting_setup: str = describe("Lighting equipment and positioning to recreate the look")
+    primary_light_source: str = describe("Direction and character of the main light")
+    light_quality: str = describe("Hard or soft, warm or cool")
+    camera_angle: str = describe("Camera height and angle relative to the subject")
+    focal_length: str = describe("Estimated lens focal length, e.g. 85mm")
+    aperture: str = describe("Estimated f-stop, e.g. f/2.8")
+    shutter_speed: str = describe("Estimated shutter speed, e.g. 1/200s")
+    iso: str = describe("Estimated ISO as a number, e.g. 100")
+    focus_point: str = describe("Where focus was placed")
+    steps: List[str] = describe("Ordered steps to recreate the look, up to 4")
+    measurements: Optional[Dict[str, Any]] = None
+
+@dataclass
+class TechniqueAnalysis:
+    """Feedback on the user's own photo; only the fields the response renders"""
+    overall_rating: str = describe("Score out of 10 with a one-line summary")
+    strengths: List[str] = describe("What works well, up to 3 items")
+    exposure: str = describe("Exposure assessment")
+    focus: str = describe("Focus accuracy and sharpness")
+    composition: str = describe("Composition strengths and weaknesses")
+    immediate_improvements: List[str] = describe("Simple adjustments for the next shot, up to 3")
+    technique_improvements: List[str] = describe("Skills to practice, up to 3")
+    camera_settings: str = describe("Suggested camera setting changes")
+    measurements: Optional[Dict[str, Any]] = None
+
+Analysis = Union[InspirationAnalysis, TechniqueAnalysis]
+
+SCHEMAS: Dict[str, Type] = {
+    'inspiration': InspirationAnalysis,
+    'technique': TechniqueAnalysis,
+}
+
+def _model_fields(schema: Type) -> List[Any]:
+    """Fields the model fills in; measurements are attached locally"""
+    return [schema_field for schema_field in fields(schema) if 'description' in schema_field.metadata]
+
+def json_schema(analysis_type: str) -> Dict[str, Any]:
+    """Strict structured-output response_format for an analysis type"""
+    properties = {}
+    for schema_field in _model_fields(SCHEMAS[analysis_type]):
+        if schema_field.type == List[str]:
+            properties[schema_field.name] = {'type': 'array', 'items': {'type': 'string'},
+                                             'description': schema_field.metadata['description']}
+        else:
+            properties[schema_field.name] = {'type': 'string', 'description': schema_field.metadata['description']}
+
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': f"{analysis_type}_analysis_v{SCHEMA_VERSION}",
+            'strict': True,
+            'schema': {
+                'type': 'object',
+                'properties': properties,
+                'required': list(properties),
+                'additionalProperties': False,
+            },
+        },
+    }
+
+def parse_analysis(analysis_type: str, data: Any) -> Analysis:
+    """Validate a decoded vision response and build its typed analysis
+
+    Raises SchemaError on missing fields or wrong types. Numbers are
+    accepted for string fields since models often send ISO as one.
+    """
+    if analysis_type not in SCHEMAS:
+        raise SchemaError(f"Unknown analysis type: {analysis_type}")
+    if not isinstance(data, dict):
+        raise SchemaError(f"Expected a JSON object, got {type(data).__name__}")
+
+    values: Dict[str, Any] = {}
+    for schema_field in _model_fields(SCHEMAS[analysis_type]):
+        if schema_field.name not in data:
+            raise SchemaError(f"Missing field: {schema_field.name}")
+        value = data[schema_field.name]
+        if schema_field.type == List[str]:
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                raise SchemaError(f"Field {schema_field.name} must be a list of strings")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        elif not isinstance(value, str):
+            raise SchemaError(f"Field {schema_field.name} must be a string")
+        values[schema_field.name] = value
+
+    analysis = SCHEMAS[analysis_type](**values)
+    analysis.measurements = data.get('measurements')
+    return analysis
+
+def analysis_to_dict(analysis: Analysis) -> Dict[str, Any]:
+    """JSON-ready form stored on UploadedImage.analysis_result and in the analysis cache"""
+    analysis_type = next(name for name, schema in SCHEMAS.items() if isinstance(analysis, schema))
+    data = asdict(analysis)
+    if data['measurements'] is None:
+        del data['measurements']
+    return dict(data, analysis_type=analysis_type, schema_version=SCHEMA_VERSION)
@@ -33,6 +33,10 @@ with app.app_context():
     # Import models to ensure tables are created
     import models
     db.create_all()
+    
+    # Apply schema changes to existing tables
+    from migrations import run_migrations
+    run_migrations(db.engine)
 
 # Import routes after app initialization
 import routes
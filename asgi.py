@@ -0,0 +1,274 @@
+"""ASGI entry point: chat turns and analysis jobs on an event loop
+
+    gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:5000 asgi:application
+
+POST /chat/send, POST /chat/stream and GET /chat/jobs/<token> are served
+natively. Their short validation and database steps run on threads,
+while image analyses run as asyncio tasks with the async OpenAI client.
+A slow vision call therefore holds no worker thread, and one process can
+carry thousands of them. Every other route is the Flask app, served
+through uvicorn's WSGI adapter.
+"""
+import io
+import sys
+import json
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from app import app as flask_app, db
+from metrics import registry as metrics_registry, request_latency
+import routes
+
+# Longest a status request may wait for a job running in this process
+JOB_STATUS_MAX_WAIT = 25.0
+
+JOB_STATUS_PATH = re.compile(r'^/chat/jobs/([^/]+)$')
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+def wsgi_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    """WSGI environ for an ASGI HTTP request, so Flask request handling can be reused"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+class Reply:
+    """A complete HTTP response produced on a worker thread"""
+
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @classmethod
+    def from_flask(cls, result: Any) -> 'Reply':
+        """Convert a view's return value; needs the request context it was made in"""
+        response = flask_app.make_response(result)
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+        return cls(response.status_code, headers, response.get_data())
+
+    @classmethod
+    def json(cls, payload: Dict[str, Any], status: int = 200) -> 'Reply':
+        return cls(status, [(b'content-type', b'application/json')], json.dumps(payload).encode('utf-8'))
+
+    async def send(self, send):
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': self.headers})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+class ChatASGI:
+    """Serves the chat turn and job routes natively and everything else through Flask"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.max_body = flask_app.config['MAX_CONTENT_LENGTH']
+        self.jobs: Dict[str, asyncio.Task] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if scope['type'] == 'http':
+            path, method = scope['path'], scope['method']
+            if method == 'POST' and path in ('/chat/send', '/chat/stream'):
+                return await self.timed(path, method, send, lambda send: self.chat_turn(
+                    scope, receive, send, stream=path == '/chat/stream'))
+            job_match = JOB_STATUS_PATH.match(path)
+            if method == 'GET' and job_match:
+                return await self.timed('/chat/jobs/<job_token>', method, send,
+                                        lambda send: self.job_status(scope, send, job_match.group(1)))
+
+        await self.fallback(scope, receive, send)
+
+    async def timed(self, route: str, method: str, send, handler):
+        """Run a native route, recording its latency like the Flask routes' after_request hook does"""
+        started = time.perf_counter()
+        status = []
+
+        async def send_and_record(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            await send(message)
+
+        try:
+            await handler(send_and_record)
+        finally:
+            request_latency.observe(time.perf_counter() - started, route=route, method=method,
+                                    status=status[0] if status else 500)
+            metrics_registry.ensure_flushing()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.jobs:
+                    await asyncio.wait(list(self.jobs.values()))
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def chat_turn(self, scope, receive, send, stream: bool):
+        """Accept a turn on a thread; text turns answer at once, image turns start an analysis task"""
+        body = await self.read_body(receive)
+        if body is None:
+            return await Reply.json({'error': 'File size exceeds 16MB limit'}, 413).send(send)
+
+        loop = asyncio.get_running_loop()
+        kind, result = await loop.run_in_executor(None, self.accept_turn, wsgi_environ(scope, body))
+        if kind == 'reply':
+            return await result.send(send)
+
+        if kind == 'text':
+            if not stream:
+                return await Reply.json(result).send(send)
+            return await self.send_events(send, routes.stream_chat_response(result))
+
+        job_token, accepted = result
+        deltas: Optional[asyncio.Queue] = asyncio.Queue() if stream else None
+        task = self.start_job(job_token, deltas.put_nowait if stream else None)
+        if not stream:
+            return await Reply.json(accepted, 202).send(send)
+        await self.send_events(send, self.job_events(job_token, task, deltas))
+
+    def accept_turn(self, environ: Dict[str, Any]) -> Tuple[str, Any]:
+        """Validate and persist a turn in a Flask request context (runs on a thread)"""
+        with flask_app.request_context(environ):
+            try:
+                turn, error_response = routes.receive_chat_message()
+                if error_response:
+                    return 'reply', Reply.from_flask(error_response)
+                if turn['upload_rows']:
+                    job_token = routes.queue_analysis_job(turn)
+                    return 'job', (job_token, routes.job_accepted_payload(job_token, len(turn['upload_rows'])))
+                return 'text', routes.generate_chat_response(turn)
+            except Exception as e:
+                logging.error(f"Chat turn failed: {str(e)}")
+                db.session.rollback()
+                return 'reply', Reply.json({'error': 'Internal server error'}, 500)
+
+    def start_job(self, job_token: str, on_delta=None) -> asyncio.Task:
+        """Run an analysis job as a task on this process's event loop"""
+        service = routes.chat_engine.image_analysis_service
+
+        async def analyze(plan):
+            analysis_type, image_paths, exif_paths, local_only = plan
+            return await service.analyze_photography_images_async(image_paths, analysis_type, on_delta,
+                                                                  local_only, flask_app, exif_paths)
+
+        task = asyncio.create_task(routes.analysis_queue.run_async(
+            job_token,
+            routes.prepare_analysis_job,
+            analyze,
+            lambda job, analysis_results: routes.process_analysis_job(job, analysis_results=analysis_results)
+        ))
+        self.jobs[job_token] = task
+        task.add_done_callback(lambda _: self.jobs.pop(job_token, None))
+        return task
+
+    async def job_events(self, job_token: str, task: asyncio.Task, deltas: asyncio.Queue):
+        """Async twin of routes.stream_analysis_job"""
+        yield routes.sse_event('status', {'job_id': job_token, 'status': 'queued'})
+
+        while not (task.done() and deltas.empty()):
+            getter = asyncio.ensure_future(deltas.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield routes.sse_event('analysis_delta', {'text': getter.result()})
+            else:
+                getter.cancel()
+
+        payload = task.result()
+        if not payload:
+            yield routes.sse_event('error', {'job_id': job_token, 'error': 'Image analysis failed. Please try again.'})
+            return
+
+        for section in routes.split_response_sections(payload['response']):
+            yield routes.sse_event('section', {'content': section})
+
+        payload = dict(payload, job_id=job_token)
+        del payload['response']
+        yield routes.sse_event('done', payload)
+
+    async def job_status(self, scope, send, job_token: str):
+        """The Flask status view; with ?wait=<seconds> it first waits for a job running here"""
+        query = parse_qs(scope['query_string'].decode('latin-1'))
+        try:
+            wait = min(float(query.get('wait', ['0'])[0]), JOB_STATUS_MAX_WAIT)
+        except ValueError:
+            wait = 0.0
+        task = self.jobs.get(job_token)
+        if task is not None and wait > 0:
+            await asyncio.wait({task}, timeout=wait)
+
+        loop = asyncio.get_running_loop()
+        reply = await loop.run_in_executor(None, self.status_reply, wsgi_environ(scope, b''), job_token)
+        await reply.send(send)
+
+    def status_reply(self, environ: Dict[str, Any], job_token: str) -> Reply:
+        with flask_app.request_context(environ):
+            return Reply.from_flask(routes.analysis_job_status(job_token))
+
+    async def read_body(self, receive) -> Optional[bytes]:
+        """Request body, or None once it grows past MAX_CONTENT_LENGTH"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def send_events(self, send, events):
+        """Stream Server-Sent Events from a sync or async iterator"""
+        await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+        if hasattr(events, '__aiter__'):
+            async for event in events:
+                await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        else:
+            for event in events:
+                await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+application = ChatASGI(WSGIMiddleware(flask_app))
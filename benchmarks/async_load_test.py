@@ -0,0 +1,194 @@
+"""Concurrency ceiling load test: sync vs ASGI serving
+
+Starts the local mock vision server with a fixed latency, then for each
+serving mode boots the app on a scratch database and fires waves of
+simultaneous clients. Each client sends one streamed image turn
+(POST /chat/stream with an upload) and reads the events until done.
+Per wave it reports successes, p50/p95 turn latency and wall time. A
+mode's ceiling is the largest wave in which at least 99% of turns
+succeed and p95 stays within --slo seconds.
+
+    python benchmarks/async_load_test.py --latency 2 --waves 25 50 100 200 400 800
+    python benchmarks/async_load_test.py --modes async --workers 2 --waves 1000 2000
+
+Modes are server command templates ({port} and {workers} are filled in):
+    sync   gunicorn -w {workers} --threads 8 main:app
+    async  gunicorn -w {workers} -k uvicorn.workers.UvicornWorker asgi:application
+Override them with --sync-command / --async-command.
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import uuid
+import subprocess
+import statistics
+from typing import Dict, List, Any, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from mock_vision_server import start_mock_server
+
+MODES = {
+    'sync': "gunicorn -w {workers} --threads 8 --timeout 300 --bind 127.0.0.1:{port} main:app",
+    'async': "gunicorn -w {workers} -k uvicorn.workers.UvicornWorker --timeout 300 --bind 127.0.0.1:{port} asgi:application",
+}
+
+SESSION_TOKEN_PATTERN = re.compile(r'id="sessionToken" value="([^"]+)"')
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def test_image(seed: int) -> bytes:
+    """A small JPEG, different per client so the analysis cache never answers"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), (seed % 256, (seed // 256) % 256, 90)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+def start_server(command: str, port: int, workers: int, workdir: str, env: Dict[str, str]) -> subprocess.Popen:
+    """Boot the app and wait until it answers"""
+    process = subprocess.Popen(command.format(port=port, workers=workers), shell=True, cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}: {command}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"Server did not start: {command}")
+
+async def sign_up(client: httpx.AsyncClient, index: int) -> str:
+    """Create a user for one virtual client and return its chat session token"""
+    await client.post('/onboarding', data={'username': f'load{index}_{uuid.uuid4().hex[:8]}',
+                                           'skill_level': 'Intermediate', 'main_specialization': 'Portrait'})
+    response = await client.get('/chat')
+    match = SESSION_TOKEN_PATTERN.search(response.text)
+    if not match:
+        raise RuntimeError(f"Sign-up failed for client {index}: HTTP {response.status_code}")
+    return match.group(1)
+
+async def image_turn(client: httpx.AsyncClient, token: str, seed: int, timeout: float) -> Tuple[bool, float]:
+    """One streamed image turn; (succeeded, seconds until the done event)"""
+    started = time.perf_counter()
+    try:
+        async with client.stream('POST', '/chat/stream', timeout=timeout,
+                                 data={'message': 'How was this lit?', 'session_token': token},
+                                 files={'images': (f'{seed}.jpg', test_image(seed), 'image/jpeg')}) as response:
+            if response.status_code != 200:
+                return False, time.perf_counter() - started
+            async for line in response.aiter_lines():
+                if line.startswith('event: done'):
+                    return True, time.perf_counter() - started
+                if line.startswith('event: error'):
+                    break
+    except httpx.HTTPError:
+        pass
+    return False, time.perf_counter() - started
+
+async def run_wave(base_url: str, size: int, offset: int, timeout: float) -> Dict[str, Any]:
+    """Sign up `size` clients, then start all their turns at once"""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    clients = [
+        # Each client gets its own address so the per-IP chat rate limit does not apply across clients
+        httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout, follow_redirects=True,
+                          headers={'X-Forwarded-For': f'10.{(offset + i) // 65536 % 256}.{(offset + i) // 256 % 256}.{(offset + i) % 256}'})
+        for i in range(size)
+    ]
+    try:
+        tokens = []
+        for start in range(0, size, 50):
+            tokens += await asyncio.gather(*(sign_up(clients[i], offset + i) for i in range(start, min(size, start + 50))))
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(image_turn(client, token, offset + i, timeout)
+                                         for i, (client, token) in enumerate(zip(clients, tokens))))
+        wall = time.perf_counter() - started
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    return {
+        'size': size,
+        'ok': len(latencies),
+        'p50': statistics.median(latencies) if latencies else None,
+        'p95': latencies[max(0, int(len(latencies) * 0.95) - 1)] if latencies else None,
+        'wall': wall,
+    }
+
+def run_mode(name: str, command: str, args: argparse.Namespace, mock_url: str) -> List[Dict[str, Any]]:
+    workdir = tempfile.mkdtemp(prefix=f'shutter_synth_load_{name}_')
+    port = free_port()
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])),
+               DATABASE_URL=args.database_url or f"sqlite:///{os.path.join(workdir, 'load.db')}",
+               OPENAI_BASE_URL=mock_url,
+               OPENAI_API_KEY='load-test',
+               RATE_LIMIT_BACKEND='memory',
+               TRUSTED_PROXIES='1')
+    process = start_server(command, port, args.workers, workdir, env)
+    try:
+        waves = []
+        offset = 0
+        for size in args.waves:
+            wave = asyncio.run(run_wave(f"http://127.0.0.1:{port}", size, offset, args.timeout))
+            offset += size
+            waves.append(wave)
+            p50 = f"{wave['p50']:.2f}s" if wave['p50'] is not None else '-'
+            p95 = f"{wave['p95']:.2f}s" if wave['p95'] is not None else '-'
+            print(f"{name:<8}{size:>8}{wave['ok']:>8}{p50:>10}{p95:>10}{wave['wall']:>9.1f}s")
+        return waves
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def ceiling(waves: List[Dict[str, Any]], slo: float) -> Optional[int]:
+    passing = [wave['size'] for wave in waves
+               if wave['ok'] >= 0.99 * wave['size'] and wave['p95'] is not None and wave['p95'] <= slo]
+    return max(passing) if passing else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['sync', 'async'], choices=sorted(MODES))
+    parser.add_argument('--waves', type=int, nargs='+', default=[25, 50, 100, 200, 400])
+    parser.add_argument('--workers', type=int, default=2, help='server worker processes')
+    parser.add_argument('--latency', type=float, default=2.0, help='mock vision latency in seconds')
+    parser.add_argument('--slo', type=float, default=None, help='p95 bound in seconds (default 3x latency + 2)')
+    parser.add_argument('--timeout', type=float, default=120.0, help='per-turn client timeout in seconds')
+    parser.add_argument('--database-url', help='use this database instead of a scratch SQLite file')
+    parser.add_argument('--sync-command', default=MODES['sync'])
+    parser.add_argument('--async-command', default=MODES['async'])
+    args = parser.parse_args()
+    slo = args.slo if args.slo is not None else 3 * args.latency + 2
+
+    mock = start_mock_server(latency=args.latency)
+    commands = {'sync': args.sync_command, 'async': args.async_command}
+
+    print(f"Mock vision latency {args.latency}s, {args.workers} workers, SLO p95 <= {slo:.1f}s")
+    print(f"{'mode':<8}{'clients':>8}{'ok':>8}{'p50':>10}{'p95':>10}{'wall':>10}")
+    ceilings = {}
+    for name in args.modes:
+        ceilings[name] = ceiling(run_mode(name, commands[name], args, mock.base_url), slo)
+
+    print()
+    for name, value in ceilings.items():
+        print(f"{name} ceiling: {value if value is not None else 'below the smallest wave'} concurrent streamed image turns")
+    print(json.dumps({'vision_requests': len(mock.requests)}))
+
+if __name__ == '__main__':
+    main()
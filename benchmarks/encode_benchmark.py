@@ -0,0 +1,130 @@
+"""Vision upload encode micro-benchmark
+
+Encodes a corpus of synthetic photos at common sensor sizes the way the
+analysis path does, once per encode profile plus the original
+full-decode + LANCZOS encoder, and reports encode time and peak RSS.
+Every measurement runs in a fresh process so peak RSS is not polluted
+by earlier cases.
+
+    python benchmarks/encode_benchmark.py --runs 5
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+import tempfile
+from typing import Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from image_ingest import ANALYSIS_MAX_SIZE, ENCODE_PROFILES, encode_profile, is_compliant_jpeg, reduce_image, encode_jpeg, read_jpeg_without_metadata
+
+# (name, width, height, format)
+CORPUS = [
+    ('800x600 jpeg', 800, 600, 'JPEG'),
+    ('2MP jpeg', 1920, 1080, 'JPEG'),
+    ('12MP jpeg', 4000, 3000, 'JPEG'),
+    ('24MP jpeg', 6000, 4000, 'JPEG'),
+    ('45MP jpeg', 8256, 5504, 'JPEG'),
+    ('12MP png', 4000, 3000, 'PNG'),
+]
+
+ENCODERS = ['legacy'] + list(ENCODE_PROFILES)
+
+def make_sample(path: str, width: int, height: int, image_format: str):
+    """Write a photo-like test image: smooth gradients with sensor noise"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 24)
+    img = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    img.save(path, format=image_format, quality=92)
+
+def sample_path(corpus_dir: str, name: str, image_format: str) -> str:
+    return os.path.join(corpus_dir, f"{name.replace(' ', '_')}.{image_format.lower()}")
+
+def legacy_encode(image_path: str) -> bytes:
+    """The original encoder: full decode, LANCZOS thumbnail, re-encode at q85"""
+    with Image.open(image_path) as img:
+        if max(img.size) > ANALYSIS_MAX_SIZE:
+            img.thumbnail((ANALYSIS_MAX_SIZE, ANALYSIS_MAX_SIZE), Image.Resampling.LANCZOS)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=85)
+        return output.getvalue()
+
+def fast_path_encode(image_path: str, profile_name: str) -> memoryview:
+    """Mirror of ImageAnalysisService._encode_image_to_jpeg"""
+    profile = encode_profile(profile_name)
+    with Image.open(image_path) as img:
+        if is_compliant_jpeg(img, os.path.getsize(image_path)):
+            stripped = read_jpeg_without_metadata(image_path)
+            if stripped is not None:
+                return stripped
+        return encode_jpeg(reduce_image(img, ANALYSIS_MAX_SIZE, profile), profile['jpeg_quality'])
+
+def run_case(image_path: str, encoder: str, runs: int) -> Dict[str, Any]:
+    """Time one encoder on one image inside the current (fresh) process"""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = legacy_encode(image_path) if encoder == 'legacy' else fast_path_encode(image_path, encoder)
+        timings.append((time.perf_counter() - started) * 1000)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        'median_ms': statistics.median(timings),
+        'peak_rss_mb': rss_after / 1024,
+        'rss_growth_mb': (rss_after - rss_before) / 1024,
+        'output_kb': len(output) / 1024,
+    }
+
+def measure(image_path: str, encoder: str, runs: int) -> Dict[str, Any]:
+    """Run a case in a child process and collect its result"""
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--case', image_path, encoder, str(runs)],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='encodes per case')
+    parser.add_argument('--case', nargs=3, metavar=('PATH', 'ENCODER', 'RUNS'), help=argparse.SUPPRESS)
+    parser.add_argument('--make-corpus', metavar='DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        image_path, encoder, runs = args.case
+        print(json.dumps(run_case(image_path, encoder, int(runs))))
+        return
+    if args.make_corpus:
+        for name, width, height, image_format in CORPUS:
+            make_sample(sample_path(args.make_corpus, name, image_format), width, height, image_format)
+        return
+
+    # Linux children inherit the parent's peak RSS, so the large samples
+    # are generated in a child too and this process stays small
+    corpus_dir = tempfile.mkdtemp(prefix='shutter_synth_encode_')
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--make-corpus', corpus_dir], check=True)
+
+    results: List[Dict[str, Any]] = []
+    for name, _, _, image_format in CORPUS:
+        path = sample_path(corpus_dir, name, image_format)
+        for encoder in ENCODERS:
+            results.append(dict(measure(path, encoder, args.runs), sample=name, encoder=encoder))
+
+    print(f"{'sample':<16}{'encoder':<10}{'encode':>12}{'peak RSS':>12}{'RSS growth':>12}{'output':>10}")
+    for result in results:
+        print(f"{result['sample']:<16}{result['encoder']:<10}{result['median_ms']:>10.1f}ms"
+              f"{result['peak_rss_mb']:>10.1f}MB{result['rss_growth_mb']:>10.1f}MB{result['output_kb']:>8.0f}KB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Knowledge base load benchmark
+
+Grows the real knowledge base to N scenarios by cloning its styles, then
+reports, per size, the time and RSS growth of loading it the old way
+(json.load of the whole file) and from the compiled artifact (index
+only, text left in the mapped file). Each load runs in a fresh process.
+
+With --workers, it instead mimics gunicorn: a master loads the knowledge
+base, forks workers that each serve lookups from every style, and
+reports the average private (unshared) memory per worker. The "json"
+case is the old layout, where every worker parsed its own dict.
+
+    python benchmarks/knowledge_benchmark.py --sizes 9 1000 5000
+    python benchmarks/knowledge_benchmark.py --sizes 5000 --workers 4
+"""
+import os
+import sys
+import json
+import time
+import gc
+import argparse
+import resource
+import subprocess
+import tempfile
+from typing import Dict, Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import KNOWLEDGE_SOURCE, KnowledgeBase, compile_knowledge_base
+
+# Fields a response reads
+SERVED_FIELDS = [('comprehensive', 'setup'), ('comprehensive', 'gear'), ('beginner_steps', 'step2', 'lighting_setup')]
+
+def make_source(path: str, scenarios: int):
+    """Write a knowledge base with the given number of scenarios"""
+    with open(KNOWLEDGE_SOURCE) as f:
+        base = json.load(f)
+    styles = list(base.items())
+    grown = {}
+    for i in range(scenarios):
+        name, data = styles[i % len(styles)]
+        grown[name if i < len(styles) else f"{name}_{i}"] = data
+    with open(path, 'w') as f:
+        json.dump(grown, f)
+
+def run_case(source: str, artifact: str, loader: str) -> Dict[str, Any]:
+    """Load once in the current (fresh) process and touch one style"""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if loader == 'json':
+        with open(source) as f:
+            knowledge = json.load(f)
+        style = next(iter(knowledge))
+        knowledge.get(style)
+    else:
+        knowledge = KnowledgeBase(source, artifact)
+        knowledge.get(knowledge.styles()[0])
+    elapsed = (time.perf_counter() - started) * 1000
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'load_ms': elapsed, 'rss_growth_mb': (rss_after - rss_before) / 1024}
+
+def private_memory_mb() -> float:
+    """Private_Clean + Private_Dirty of this process, i.e. what it does not share"""
+    private_kb = 0
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                private_kb += int(line.split()[1])
+    return private_kb / 1024
+
+def run_workers(source: str, artifact: str, loader: str, workers: int) -> Dict[str, Any]:
+    """Load in this (master) process, fork workers that serve lookups, average their private memory"""
+    if loader == 'kb':
+        knowledge = KnowledgeBase(source, artifact).load()
+        styles = knowledge.styles()
+        lookup = lambda style, path: knowledge.text(style, *path)
+    gc.freeze()
+
+    readers = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            if loader == 'json':
+                # Old layout: each worker imports the app and parses its own copy
+                with open(source) as f:
+                    knowledge = json.load(f)
+                styles = list(knowledge)
+
+                def lookup(style, path):
+                    node = knowledge[style]
+                    for key in path:
+                        node = node.get(key, {})
+                    return node
+            for style in styles:
+                for path in SERVED_FIELDS:
+                    lookup(style, path)
+            os.write(write_fd, json.dumps(private_memory_mb()).encode())
+            os._exit(0)
+        os.close(write_fd)
+        readers.append((pid, read_fd))
+
+    private = []
+    for pid, read_fd in readers:
+        with os.fdopen(read_fd) as f:
+            private.append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    return {'private_mb': sum(private) / len(private)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[9, 1000, 5000])
+    parser.add_argument('--case', nargs=3, metavar=('SOURCE', 'ARTIFACT', 'LOADER'), help=argparse.SUPPRESS)
+    parser.add_argument('--make-source', nargs=3, metavar=('SOURCE', 'ARTIFACT', 'SIZE'), help=argparse.SUPPRESS)
+    parser.add_argument('--workers', type=int, default=0, help='fork this many workers and report their private memory')
+    parser.add_argument('--worker-case', nargs=4, metavar=('SOURCE', 'ARTIFACT', 'LOADER', 'WORKERS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(*args.case)))
+        return
+    if args.worker_case:
+        source, artifact, loader, workers = args.worker_case
+        print(json.dumps(run_workers(source, artifact, loader, int(workers))))
+        return
+    if args.make_source:
+        source, artifact, size = args.make_source
+        make_source(source, int(size))
+        compile_knowledge_base(source, artifact)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='shutter_synth_kb_')
+    if args.workers:
+        print(f"{'scenarios':>10}{'workers':>10}{'json private/worker':>22}{'kb private/worker':>20}")
+    else:
+        print(f"{'scenarios':>10}{'source':>10}{'artifact':>10}{'json load':>12}{'json RSS':>10}{'kb load':>10}{'kb RSS':>10}")
+    for size in args.sizes:
+        source = os.path.join(workdir, f"knowledge_{size}.json")
+        artifact = os.path.join(workdir, f"knowledge_{size}.kb")
+        # Linux children inherit the parent's peak RSS, so large sources are built in a child too
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--make-source', source, artifact, str(size)], check=True)
+
+        if args.workers:
+            results = {}
+            for loader in ('json', 'kb'):
+                completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker-case',
+                                            source, artifact, loader, str(args.workers)],
+                                           capture_output=True, text=True, check=True)
+                results[loader] = json.loads(completed.stdout)
+            print(f"{size:>10}{args.workers:>10}{results['json']['private_mb']:>20.1f}MB{results['kb']['private_mb']:>18.1f}MB")
+            continue
+
+        results = {}
+        for loader in ('json', 'kb'):
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', source, artifact, loader],
+                                       capture_output=True, text=True, check=True)
+            results[loader] = json.loads(completed.stdout)
+
+        print(f"{size:>10}{os.path.getsize(source) / 1024:>8.0f}KB{os.path.getsize(artifact) / 1024:>8.0f}KB"
+              f"{results['json']['load_ms']:>10.1f}ms{results['json']['rss_growth_mb']:>8.1f}MB"
+              f"{results['kb']['load_ms']:>8.1f}ms{results['kb']['rss_growth_mb']:>8.1f}MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Chat turn persistence benchmark
+
+Replays chat turns against a database and reports messages per second
+and commits per turn for the old persistence path (commit the user
+message to get its id, add the uploads, commit again with the bot
+message and session state) and the current one (flush for ids, bulk
+insert the uploads, one commit per turn). Only the database work of a
+turn is timed; no response is generated.
+
+SQLite always runs; pass --postgres-url (or set BENCHMARK_POSTGRES_URL)
+to also run against a local PostgreSQL. Each database runs in a fresh
+process because the app binds DATABASE_URL at import.
+
+    python benchmarks/persistence_benchmark.py --turns 2000 --image-every 5 --images 3
+    python benchmarks/persistence_benchmark.py --postgres-url postgresql://localhost/shutter_synth_bench
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import uuid
+from typing import Dict, List, Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOT_CONTENT = "**Setup:** Large softbox camera left, white seamless lit two stops over. " * 8
+
+def upload_rows(turn: int, images: int) -> List[Dict[str, Any]]:
+    return [{'filename': f'{turn}_{n}.jpg', 'original_filename': 'photo.jpg', 'file_path': f'uploads/{turn}_{n}.jpg',
+             'file_size': 1024, 'mime_type': 'image/jpeg'} for n in range(images)]
+
+def old_turn(db, models, chat_session, turn: int, rows: List[Dict[str, Any]]):
+    """The previous send_message: two commits, one INSERT per upload"""
+    user_message = models.ChatMessage()
+    user_message.session_id = chat_session.id
+    user_message.message_type = 'user'
+    user_message.content = 'How should I light a high key portrait?'
+    db.session.add(user_message)
+    db.session.commit()  # Commit to get message ID
+
+    for row in rows:
+        uploaded_image = models.UploadedImage(**row)
+        uploaded_image.message_id = user_message.id
+        db.session.add(uploaded_image)
+
+    if rows:
+        job = models.AnalysisJob(job_token=str(uuid.uuid4()), session_id=chat_session.id,
+                                 message_id=user_message.id, status='queued')
+        db.session.add(job)
+    else:
+        bot_message = models.ChatMessage(session_id=chat_session.id, message_type='bot', content=BOT_CONTENT)
+        db.session.add(bot_message)
+        chat_session.current_step = turn % 4
+        chat_session.conversation_context = dict(chat_session.conversation_context or {}, current_scenario=f'style_{turn % 7}')
+    db.session.commit()
+
+def new_turn(db, routes, chat_session, turn: int, rows: List[Dict[str, Any]]):
+    """The current send_message: ids by flush, bulk uploads, one commit"""
+    user_message = routes.add_user_message(chat_session, 'How should I light a high key portrait?', rows)
+    if rows:
+        routes.analysis_queue.create_job(chat_session.id, user_message.id)
+    else:
+        routes.save_bot_response(chat_session, {'content': BOT_CONTENT, 'next_step': turn % 4,
+                                                'context': {'current_scenario': f'style_{turn % 7}'}})
+    db.session.commit()
+
+def run_case(database_url: str, turns: int, image_every: int, images: int) -> Dict[str, Any]:
+    """Replay turns through both paths on one database, each on a fresh session row"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'memory')
+
+    import logging
+    logging.disable(logging.INFO)
+
+    from sqlalchemy import event
+    from app import app, db
+    import models
+    import routes
+
+    results = {}
+    with app.app_context():
+        commits = []
+        event.listen(db.engine, 'commit', lambda conn: commits.append(1))
+
+        user = models.User(username=f'bench_{uuid.uuid4().hex[:8]}', skill_level='Beginner')
+        db.session.add(user)
+        db.session.commit()
+
+        for path in ('old', 'new'):
+            chat_session = models.ChatSession(user_id=user.id, session_token=str(uuid.uuid4()), conversation_context={})
+            db.session.add(chat_session)
+            db.session.commit()
+            commits.clear()
+
+            started = time.perf_counter()
+            for turn in range(turns):
+                rows = upload_rows(turn, images) if image_every and turn % image_every == 0 else []
+                if path == 'old':
+                    old_turn(db, models, chat_session, turn, rows)
+                else:
+                    new_turn(db, routes, chat_session, turn, rows)
+            elapsed = time.perf_counter() - started
+
+            results[path] = {'messages_per_sec': turns / elapsed, 'commits_per_turn': len(commits) / turns}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=2000)
+    parser.add_argument('--image-every', type=int, default=5, help='attach uploads to every Nth turn (0 for none)')
+    parser.add_argument('--images', type=int, default=3, help='uploads per image turn')
+    parser.add_argument('--postgres-url', default=os.environ.get('BENCHMARK_POSTGRES_URL'))
+    parser.add_argument('--case', metavar='DATABASE_URL', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.turns, args.image_every, args.images)))
+        return
+
+    workdir = tempfile.mkdtemp(prefix='shutter_synth_persist_')
+    databases = [('sqlite', f"sqlite:///{os.path.join(workdir, 'app.db')}")]
+    if args.postgres_url:
+        databases.append(('postgresql', args.postgres_url))
+    else:
+        print("PostgreSQL skipped: pass --postgres-url or set BENCHMARK_POSTGRES_URL")
+
+    print(f"{'database':<12}{'old msg/s':>12}{'old commits':>13}{'new msg/s':>12}{'new commits':>13}{'speedup':>10}")
+    for name, url in databases:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', url, '--turns', str(args.turns),
+                                    '--image-every', str(args.image_every), '--images', str(args.images)],
+                                   capture_output=True, text=True, check=True)
+        results = json.loads(completed.stdout.strip().splitlines()[-1])
+        old, new = results['old'], results['new']
+        print(f"{name:<12}{old['messages_per_sec']:>12.0f}{old['commits_per_turn']:>13.2f}"
+              f"{new['messages_per_sec']:>12.0f}{new['commits_per_turn']:>13.2f}"
+              f"{new['messages_per_sec'] / old['messages_per_sec']:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
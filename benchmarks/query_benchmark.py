@@ -0,0 +1,199 @@
+"""Chat hot path query benchmark
+
+Seeds a synthetic SQLite database, times the queries behind /chat, chat
+turns and gear lookups without the hot path indexes, then applies the
+migrations and times them again.
+
+    python benchmarks/query_benchmark.py --users 2000 --messages 100
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing models initializes the app against a throwaway database; the
+# benchmark itself never calls the vision API.
+BENCHMARK_DIR = tempfile.mkdtemp(prefix='shutter_synth_bench_')
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(BENCHMARK_DIR, 'app.db')}"
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+
+import logging
+logging.disable(logging.INFO)
+
+from sqlalchemy import create_engine, insert, select, text
+from app import db
+from models import User, GearItem, ChatSession, ChatMessage, UploadedImage
+from migrations import run_migrations
+
+HOT_PATH_INDEXES = [
+    'ix_chat_sessions_user_active',
+    'ix_chat_messages_session_timestamp',
+    'ix_gear_items_user_category',
+    'ix_uploaded_images_message_id',
+]
+
+GEAR_CATEGORIES = ['camera_body', 'lens', 'lighting', 'backdrop', 'accessory']
+BATCH_SIZE = 10000
+
+def seed(engine, users: int, sessions: int, messages: int, gear: int, image_every: int):
+    """Insert synthetic users, sessions, messages, uploads and gear"""
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1)
+
+    def flush(conn, table, rows: List[Dict[str, Any]]):
+        if rows:
+            conn.execute(insert(table), rows)
+            rows.clear()
+
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [
+            {'id': user_id, 'username': f'user{user_id}', 'skill_level': 'Beginner', 'gear_version': 0,
+             'created_at': start, 'updated_at': start}
+            for user_id in range(1, users + 1)
+        ])
+
+        gear_rows = []
+        for user_id in range(1, users + 1):
+            for _ in range(gear):
+                gear_rows.append({'user_id': user_id, 'category': rng.choice(GEAR_CATEGORIES),
+                                  'brand': 'Brand', 'model': 'Model', 'created_at': start})
+            if len(gear_rows) >= BATCH_SIZE:
+                flush(conn, GearItem.__table__, gear_rows)
+        flush(conn, GearItem.__table__, gear_rows)
+
+        # Only each user's newest session is active
+        session_rows = []
+        session_id = 0
+        for user_id in range(1, users + 1):
+            for n in range(sessions):
+                session_id += 1
+                session_rows.append({'id': session_id, 'user_id': user_id, 'session_token': f'token{session_id}',
+                                     'current_step': 0, 'is_active': n == sessions - 1,
+                                     'created_at': start, 'updated_at': start})
+            if len(session_rows) >= BATCH_SIZE:
+                flush(conn, ChatSession.__table__, session_rows)
+        flush(conn, ChatSession.__table__, session_rows)
+
+        # Sessions interleave in time, as they do with many concurrent users
+        message_rows, image_rows = [], []
+        message_id = 0
+        for n in range(messages):
+            for sid in range(1, session_id + 1):
+                message_id += 1
+                message_rows.append({'id': message_id, 'session_id': sid, 'message_type': 'user' if n % 2 == 0 else 'bot',
+                                     'content': 'How should I light a high key portrait?',
+                                     'timestamp': start + timedelta(seconds=n * 60 + rng.random())})
+                if image_every and message_id % image_every == 0:
+                    image_rows.append({'message_id': message_id, 'filename': f'{message_id}.jpg',
+                                       'original_filename': 'photo.jpg', 'file_path': f'uploads/{message_id}.jpg',
+                                       'file_size': 1024, 'mime_type': 'image/jpeg', 'uploaded_at': start})
+                if len(message_rows) >= BATCH_SIZE:
+                    flush(conn, ChatMessage.__table__, message_rows)
+                    flush(conn, UploadedImage.__table__, image_rows)
+        flush(conn, ChatMessage.__table__, message_rows)
+        flush(conn, UploadedImage.__table__, image_rows)
+
+    return session_id, message_id
+
+def hot_path_queries(users: int, sessions: int, messages: int) -> Dict[str, Callable[[random.Random], Any]]:
+    """The statements the chat routes issue, keyed by name"""
+    chat_sessions = ChatSession.__table__
+    chat_messages = ChatMessage.__table__
+    gear_items = GearItem.__table__
+    uploaded_images = UploadedImage.__table__
+
+    return {
+        'active_session': lambda rng: select(chat_sessions).where(
+            chat_sessions.c.user_id == rng.randint(1, users), chat_sessions.c.is_active == True
+        ).limit(1),
+        'recent_history': lambda rng: select(chat_messages).where(
+            chat_messages.c.session_id == rng.randint(1, users * sessions)
+        ).order_by(chat_messages.c.timestamp.desc()).limit(50),
+        'user_gear': lambda rng: select(gear_items).where(
+            gear_items.c.user_id == rng.randint(1, users)
+        ).order_by(gear_items.c.id),
+        'gear_category': lambda rng: select(gear_items).where(
+            gear_items.c.user_id == rng.randint(1, users), gear_items.c.category == rng.choice(GEAR_CATEGORIES)
+        ),
+        'message_images': lambda rng: select(uploaded_images).where(
+            uploaded_images.c.message_id == rng.randint(1, users * sessions * messages)
+        ),
+    }
+
+def measure(engine, queries: Dict[str, Callable[[random.Random], Any]], iterations: int) -> Dict[str, Dict[str, Any]]:
+    """Median/p95 latency in milliseconds and the SQLite plan for each query"""
+    results = {}
+    with engine.connect() as conn:
+        for name, build in queries.items():
+            rng = random.Random(name)
+            compiled = build(rng).compile(engine, compile_kwargs={'literal_binds': True})
+            plan = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+            timings = []
+            for _ in range(iterations):
+                statement = build(rng)
+                started = time.perf_counter()
+                conn.execute(statement).all()
+                timings.append((time.perf_counter() - started) * 1000)
+
+            timings.sort()
+            results[name] = {
+                'median_ms': statistics.median(timings),
+                'p95_ms': timings[int(len(timings) * 0.95) - 1],
+                'plan': '; '.join(plan)
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=4, help='chat sessions per user')
+    parser.add_argument('--messages', type=int, default=50, help='messages per session')
+    parser.add_argument('--gear', type=int, default=8, help='gear items per user')
+    parser.add_argument('--image-every', type=int, default=10, help='attach an upload to every Nth message')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    path = os.path.join(BENCHMARK_DIR, 'benchmark.db')
+    engine = create_engine(f"sqlite:///{path}")
+
+    # Build the pre-index schema: current tables without the hot path indexes
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for index_name in HOT_PATH_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+    started = time.perf_counter()
+    total_sessions, total_messages = seed(engine, args.users, args.sessions, args.messages, args.gear, args.image_every)
+    print(f"Seeded {args.users} users, {total_sessions} sessions, {total_messages} messages "
+          f"in {time.perf_counter() - started:.1f}s ({path})")
+
+    queries = hot_path_queries(args.users, args.sessions, args.messages)
+    before = measure(engine, queries, args.iterations)
+
+    started = time.perf_counter()
+    run_migrations(engine)
+    print(f"Applied migrations in {time.perf_counter() - started:.1f}s")
+
+    after = measure(engine, queries, args.iterations)
+
+    print(f"\n{'query':<16}{'before p50':>12}{'before p95':>12}{'after p50':>12}{'after p95':>12}{'speedup':>10}")
+    for name in queries:
+        b, a = before[name], after[name]
+        speedup = b['median_ms'] / a['median_ms'] if a['median_ms'] else float('inf')
+        print(f"{name:<16}{b['median_ms']:>10.3f}ms{b['p95_ms']:>10.3f}ms{a['median_ms']:>10.3f}ms{a['p95_ms']:>10.3f}ms{speedup:>9.1f}x")
+
+    print("\nQuery plans")
+    for name in queries:
+        print(f"  {name}\n    before: {before[name]['plan']}\n    after:  {after[name]['plan']}")
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,165 @@
-import json
 import logging
 import re
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional, Tuple, Union
 from models import GearItem, ChatSession, UploadedImage
 from image_analysis import create_image_analysis_service
+from analysis_cache import AnalysisCache
+from intent_index import IntentIndex, IntentMatch
+from response_cache import ResponseCache, CompiledTemplate, compile_template, gear_fingerprint
+from knowledge_base import KnowledgeBase, shared_knowledge_base
+from gear_profile import GearSnapshot
+from session_state import read_context, merge_context
+from analysis_schema import InspirationAnalysis, TechniqueAnalysis, analysis_to_dict
+from metrics import chat_routing
+
+# Follow-up topics, in the priority order used to pick the advice section
+FOLLOWUP_TOPICS = [
+    ('posing', ['posing', 'pose', 'poses', 'positioning']),
+    ('lighting', ['lighting', 'light', 'lights', 'illumination']),
+    ('gear', ['gear', 'equipment', 'lens', 'camera']),
+    ('settings', ['settings', 'exposure', 'aperture', 'iso', 'shutter']),
+    ('composition', ['angles', 'composition', 'framing']),
+]
+
+# Keywords that suggest building on existing context
+FOLLOWUP_KEYWORDS = [
+    'tips', 'advice', 'suggestions', 'help',
+    'how to', 'what about', 'any', 'also',
+    'more', 'additional', 'other', 'different'
+]
+
+# Question patterns that suggest follow-ups
+FOLLOWUP_QUESTION_PATTERNS = [
+    'any suggestions', 'what about', 'how about', 'can you',
+    'do you have', 'what would', 'how do i', 'how should i'
+]
+
+# Prefixed to image analyses built locally while the vision backend is unavailable
+DEGRADED_ANALYSIS_NOTE = ("⚠️ *Quick analysis:* my full image analysis is temporarily unavailable, so this is based on "
+                          "the photo's camera data, exposure histogram and colours. Try again in a few minutes for a detailed breakdown.")
+
+INTENT_KEYWORDS = [
+    ('photography_style_request', ['portrait', 'fashion', 'glamour', 'boudoir', 'headshot', 'sports',
+                                   'moody', 'high-key', 'low-key', 'dramatic', 'soft', 'natural']),
+    ('technical_question', ['settings', 'camera', 'lens', 'lighting', 'exposure', 'aperture', 'iso']),
+]
+
+SPECIAL_CASE_TRIGGERS = [
+    ('group', ['group', 'event', 'party', 'people', 'multiple people']),
+    ('astro', ['astrophotography', 'stars', 'milky way', 'night sky', 'astro']),
+    ('ir_590', ['590nm', '590 nm']),
+    ('ir_720', ['720nm', '720 nm']),
+    ('drone', ['drone', 'aerial', 'flying', 'dji', 'uav']),
+    ('underwater', ['underwater']),
+]
+
+TECHNIQUE_REQUEST_KEYWORDS = ["feedback", "critique", "improve", "better", "review"]
+GENERAL_ADVICE_KEYWORDS = ['tips', 'advice', 'help', 'suggest']
+
+# Technique questions that EXIF, the histogram and the sharpness estimate fully
+# answer; these skip the vision model unless the message also asks about
+# something only the model can judge
+MEASURABLE_CHECK_KEYWORDS = ['exposure', 'exposed', 'histogram', 'clipping', 'clipped', 'blown out',
+                             'sharp', 'blurry', 'blur', 'in focus', 'out of focus', 'settings', 'exif']
+VISUAL_REVIEW_KEYWORDS = ['composition', 'compose', 'framing', 'crop', 'posing', 'lighting',
+                          'mood', 'color', 'colour', 'background', 'style', 'overall']
+
+CONTINUATION_WORDS = ['yes', 'y', 'continue', 'next', 'proceed', 'go ahead', 'sure', 'ok', 'okay']
+DECLINE_WORDS = ['no', 'n', 'stop', 'enough', 'good', "i'm good", 'thanks', 'thank you']
 
 class SynthiaChatEngine:
     """Synthia - The photography shoot planning assistant"""
     
     def __init__(self):
-        self.knowledge_base = self._load_knowledge_base()
-        self.image_analysis_service = create_image_analysis_service()
-        
-    def _load_knowledge_base(self) -> Dict[str, Any]:
-        """Load photography knowledge base from JSON file"""
-        try:
-            with open('photography_knowledge.json', 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            logging.error("Photography knowledge base not found")
-            return {}
-        except json.JSONDecodeError:
-            logging.error("Error decoding photography knowledge base")
-            return {}
+        # Compiled artifact shared by every engine in the process (and inherited
+        # from the gunicorn master), reloaded when the JSON changes
+        self.knowledge_base = shared_knowledge_base()
+        self._intent_index: Optional[IntentIndex] = None
+        self._intent_index_version: Optional[str] = None
+        self._last_intent_match = ('', None)
+        self.response_cache = ResponseCache()
+        self.image_analysis_service = create_image_analysis_service(cache=AnalysisCache())
+    
+    @property
+    def intent_index(self) -> IntentIndex:
+        """Intent index for the loaded knowledge base, rebuilt when it is reloaded"""
+        version = self.knowledge_base.version
+        if self._intent_index is None or version != self._intent_index_version:
+            self._intent_index = self._build_intent_index(self.knowledge_base)
+            self._intent_index_version = version
+            self._last_intent_match = ('', None)
+            # Responses rendered from the previous knowledge base are stale
+            self.response_cache.clear()
+        return self._intent_index
+    
+    def _build_intent_index(self, knowledge_base: KnowledgeBase) -> IntentIndex:
+        """Compile every routing keyword set into a single intent index"""
+        index = IntentIndex()
+        
+        for style_key in knowledge_base.styles():
+            index.add('style', style_key, knowledge_base.keywords(style_key))
+        
+        for topic, keywords in FOLLOWUP_TOPICS:
+            index.add('followup_topic', topic, keywords)
+            index.add('followup', topic, keywords)
+        index.add('followup', 'keyword', FOLLOWUP_KEYWORDS)
+        index.add('followup', 'question', FOLLOWUP_QUESTION_PATTERNS)
+        
+        for intent, keywords in INTENT_KEYWORDS:
+            index.add('intent', intent, keywords)
+        
+        for trigger, keywords in SPECIAL_CASE_TRIGGERS:
+            index.add('special_case', trigger, keywords)
+        
+        index.add('technique_request', 'technique', TECHNIQUE_REQUEST_KEYWORDS)
+        index.add('general_advice', 'advice', GENERAL_ADVICE_KEYWORDS)
+        index.add('measurable_check', 'measurable', MEASURABLE_CHECK_KEYWORDS)
+        index.add('visual_review', 'visual', VISUAL_REVIEW_KEYWORDS)
+        
+        index.add_exact('continuation', CONTINUATION_WORDS)
+        index.add_exact('decline', DECLINE_WORDS)
+        
+        index.compile()
+        return index
+    
+    def _render_cached(self, render: Callable[[], str], kind: str, scenario: str, skill_level: Optional[str] = None,
+                       step: Optional[Any] = None, topic: Optional[str] = None,
+                       matched_gear: Optional[Dict[str, List[GearItem]]] = None) -> str:
+        """Render response content through the LRU response cache"""
+        key = (kind, scenario, skill_level, step, topic, gear_fingerprint(matched_gear))
+        return self.response_cache.get_or_render(key, render)
+    
+    def invalidate_gear_cache(self, user_gear: List[GearItem]):
+        """Drop cached responses rendered for a user's previous gear"""
+        self.response_cache.invalidate_gear(gear_fingerprint(self._match_user_gear(user_gear, '')))
+    
+    def _match_intents(self, message: str) -> IntentMatch:
+        """Scan a message against the intent index, reusing the last scan for the same message"""
+        intent_index = self.intent_index
+        last_message, last_match = self._last_intent_match
+        if last_match is not None and last_message == message:
+            return last_match
+        
+        intent_match = intent_index.match(message)
+        self._last_intent_match = (message, intent_match)
+        return intent_match
     
     def generate_response(self, message: str, skill_level: str, user_gear: List[GearItem], 
                          chat_session: ChatSession, uploaded_images: Optional[List[UploadedImage]] = None, 
-                         user_specialization: Optional[str] = None) -> Dict[str, Any]:
-        """Generate appropriate response based on skill level and context"""
+                         user_specialization: Optional[str] = None,
+                         on_delta: Optional[Callable[[str], None]] = None,
+                         analysis_results: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Generate appropriate response based on skill level and context
+        
+        analysis_results, when given, are the already computed analyses of
+        the uploaded images (see plan_image_analysis) and are used as they are.
+        """
         
         # Handle image analysis if images are uploaded
         if uploaded_images:
-            return self._handle_image_analysis(message, skill_level, user_gear, uploaded_images)
+            chat_routing.inc(decision='image')
+            return self._handle_image_analysis(message, skill_level, user_gear, uploaded_images, on_delta,
+                                               analysis_results)
         
         # Get current conversation context
         current_scenario = self._get_current_scenario(chat_session)
@@ -39,10 +167,12 @@ class SynthiaChatEngine:
         # Handle continuation responses for beginners
         if skill_level == 'Beginner' and self._is_continuation_response(message):
             matched_gear = self._match_user_gear(user_gear, current_scenario or "portrait")
+            chat_routing.inc(decision='beginner_step')
             return self._handle_beginner_continuation(chat_session, matched_gear)
         
         # Handle decline responses for beginners
         if skill_level == 'Beginner' and self._is_decline_response(message):
+            chat_routing.inc(decision='decline')
             return self._handle_decline_response()
         
         # Check if this is a follow-up question to existing context
@@ -59,134 +189,85 @@ class SynthiaChatEngine:
             matched_gear = self._match_user_gear(user_gear, photography_style)
             
             if skill_level == 'Beginner':
+                chat_routing.inc(decision='beginner_step')
                 return self._generate_beginner_response(photography_style, matched_gear, message, chat_session)
             else:
+                chat_routing.inc(decision='comprehensive')
                 return self._generate_comprehensive_response(photography_style, matched_gear, skill_level, message)
         else:
             # If no specific style mentioned, use user's specialization for default advice
+            chat_routing.inc(decision='general')
             return self._generate_general_response(message, skill_level, user_specialization)
     
     def _get_current_scenario(self, chat_session: ChatSession) -> Optional[str]:
         """Get the current conversation scenario from session context"""
-        if chat_session.conversation_context and isinstance(chat_session.conversation_context, dict):
-            return chat_session.conversation_context.get('current_scenario')
-        return None
+        return read_context(chat_session).get('current_scenario')
     
     def _set_current_scenario(self, chat_session: ChatSession, scenario: str):
         """Set the current conversation scenario in session context"""
-        if not chat_session.conversation_context:
-            chat_session.conversation_context = {}
-        elif not isinstance(chat_session.conversation_context, dict):
-            chat_session.conversation_context = {}
-        chat_session.conversation_context['current_scenario'] = scenario
+        merge_context(chat_session, {'current_scenario': scenario})
     
     def _is_followup_question(self, message: str) -> bool:
         """Check if message is a follow-up question to existing context"""
-        message_lower = message.lower()
-        
-        # Follow-up keywords that suggest building on existing context
-        followup_keywords = [
-            'posing', 'pose', 'poses', 'positioning',
-            'lighting', 'light', 'lights', 'illumination',
-            'gear', 'equipment', 'lens', 'camera',
-            'settings', 'exposure', 'aperture', 'iso', 'shutter',
-            'angles', 'composition', 'framing',
-            'tips', 'advice', 'suggestions', 'help',
-            'how to', 'what about', 'any', 'also',
-            'more', 'additional', 'other', 'different'
-        ]
-        
-        # Check for follow-up patterns
-        for keyword in followup_keywords:
-            if keyword in message_lower:
-                return True
-        
-        # Question patterns that suggest follow-ups
-        question_patterns = [
-            'any suggestions', 'what about', 'how about', 'can you',
-            'do you have', 'what would', 'how do i', 'how should i'
-        ]
-        
-        for pattern in question_patterns:
-            if pattern in message_lower:
-                return True
-        
-        return False
+        return self._match_intents(message).has('followup')
     
     def _handle_followup_question(self, message: str, current_scenario: str, skill_level: str, 
                                  user_gear: List[GearItem], chat_session: ChatSession) -> Dict[str, Any]:
         """Handle follow-up questions within existing scenario context"""
-        message_lower = message.lower()
+        topic = self._match_intents(message).first('followup_topic')
         
-        # Get the scenario data
-        scenario_data = self.knowledge_base.get(current_scenario, {})
-        if not scenario_data:
+        if current_scenario not in self.knowledge_base:
             # Fallback to general response if scenario not found
+            chat_routing.inc(decision='general')
             return self._generate_general_response(message, skill_level)
         
+        # Topics outside FOLLOWUP_TOPICS get the general follow-up
+        chat_routing.inc(decision='followup', topic=topic or 'general')
+        
         # Determine what aspect they're asking about
-        if any(word in message_lower for word in ['posing', 'pose', 'poses', 'positioning']):
-            return self._generate_posing_advice(current_scenario, scenario_data, skill_level, user_gear)
+        if topic == 'posing':
+            return self._generate_posing_advice(current_scenario, skill_level, user_gear)
         
-        elif any(word in message_lower for word in ['lighting', 'light', 'lights', 'illumination']):
-            return self._generate_lighting_advice(current_scenario, scenario_data, skill_level, user_gear)
+        elif topic == 'lighting':
+            return self._generate_lighting_advice(current_scenario, skill_level, user_gear)
         
-        elif any(word in message_lower for word in ['gear', 'equipment', 'lens', 'camera']):
-            return self._generate_gear_advice(current_scenario, scenario_data, skill_level, user_gear)
+        elif topic == 'gear':
+            return self._generate_gear_advice(current_scenario, skill_level, user_gear)
         
-        elif any(word in message_lower for word in ['settings', 'exposure', 'aperture', 'iso', 'shutter']):
-            return self._generate_settings_advice(current_scenario, scenario_data, skill_level)
+        elif topic == 'settings':
+            return self._generate_settings_advice(current_scenario, skill_level)
         
-        elif any(word in message_lower for word in ['angles', 'composition', 'framing']):
-            return self._generate_composition_advice(current_scenario, scenario_data, skill_level)
+        elif topic == 'composition':
+            return self._generate_composition_advice(current_scenario, skill_level)
         
         else:
             # General follow-up - provide additional tips or clarification
-            return self._generate_general_followup(current_scenario, scenario_data, skill_level, message)
+            return self._generate_general_followup(current_scenario, skill_level, message)
     
     def _classify_intent(self, message: str) -> str:
         """Classify the user's intent from their message"""
-        message_lower = message.lower()
-        
-        # Photography style requests
-        style_keywords = ['portrait', 'fashion', 'glamour', 'boudoir', 'headshot', 'sports', 
-                         'moody', 'high-key', 'low-key', 'dramatic', 'soft', 'natural']
-        
-        if any(keyword in message_lower for keyword in style_keywords):
-            return 'photography_style_request'
-        
-        # Technical questions
-        technical_keywords = ['settings', 'camera', 'lens', 'lighting', 'exposure', 'aperture', 'iso']
-        if any(keyword in message_lower for keyword in technical_keywords):
-            return 'technical_question'
-        
-        # General advice
-        return 'general_advice'
+        # Photography style requests take precedence over technical questions
+        return self._match_intents(message).first('intent') or 'general_advice'
     
     def _is_continuation_response(self, message: str) -> bool:
         """Check if user wants to continue to next step"""
-        continuation_words = ['yes', 'y', 'continue', 'next', 'proceed', 'go ahead', 'sure', 'ok', 'okay']
-        return message.lower().strip() in continuation_words
+        return self._match_intents(message).exact('continuation')
     
     def _is_decline_response(self, message: str) -> bool:
         """Check if user wants to stop the step-by-step process"""
-        decline_words = ['no', 'n', 'stop', 'enough', 'good', "i'm good", 'thanks', 'thank you']
-        return message.lower().strip() in decline_words
+        return self._match_intents(message).exact('decline')
     
     def _extract_photography_style(self, message: str) -> Optional[str]:
         """Extract photography style from user message"""
-        message_lower = message.lower()
-        
-        # Match against knowledge base
-        for style_key, style_data in self.knowledge_base.items():
-            keywords = style_data.get('keywords', [])
-            if any(keyword in message_lower for keyword in keywords):
-                return style_key
-        
-        return None
+        # Styles are registered in knowledge base order, so the first match wins
+        return self._match_intents(message).first('style')
     
     def _match_user_gear(self, user_gear: List[GearItem], photography_style: str) -> Dict[str, List[GearItem]]:
         """Match user's gear to photography requirements"""
+        # Snapshots are already categorized
+        if isinstance(user_gear, GearSnapshot):
+            return user_gear.matched_gear
+        
         matched_gear = {
             'cameras': [],
             'lenses': [],
@@ -209,19 +290,21 @@ class SynthiaChatEngine:
         
         return matched_gear
     
-    def _generate_posing_advice(self, scenario: str, scenario_data: Dict[str, Any], skill_level: str, user_gear: List[GearItem]) -> Dict[str, Any]:
+    def _generate_posing_advice(self, scenario: str, skill_level: str, user_gear: List[GearItem]) -> Dict[str, Any]:
         """Generate posing advice for current scenario"""
-        comprehensive_data = scenario_data.get('comprehensive', {})
-        
-        # Extract posing/composition guidance
-        angles_info = comprehensive_data.get('angles', '')
-        
-        # Add scenario-specific posing tips
-        posing_tips = self._get_posing_tips_for_scenario(scenario)
+        def render_content() -> str:
+            # Extract posing/composition guidance
+            angles_info = self.knowledge_base.text(scenario, 'comprehensive', 'angles')
+            
+            # Add scenario-specific posing tips
+            posing_tips = self._get_posing_tips_for_scenario(scenario)
+            
+            content = f"**Posing & Composition for {scenario.replace('_', ' ').title()}:**\n\n"
+            content += f"{angles_info}\n\n"
+            content += f"**Additional Posing Tips:**\n{posing_tips}"
+            return content
         
-        content = f"**Posing & Composition for {scenario.replace('_', ' ').title()}:**\n\n"
-        content += f"{angles_info}\n\n"
-        content += f"**Additional Posing Tips:**\n{posing_tips}"
+        content = self._render_cached(render_content, 'followup', scenario, topic='posing')
         
         return {
             'content': content,
@@ -231,19 +314,22 @@ class SynthiaChatEngine:
             'context': {'current_scenario': scenario}
         }
     
-    def _generate_lighting_advice(self, scenario: str, scenario_data: Dict[str, Any], skill_level: str, user_gear: List[GearItem]) -> Dict[str, Any]:
+    def _generate_lighting_advice(self, scenario: str, skill_level: str, user_gear: List[GearItem]) -> Dict[str, Any]:
         """Generate lighting advice for current scenario"""
-        comprehensive_data = scenario_data.get('comprehensive', {})
-        setup_info = comprehensive_data.get('setup', '')
-        
-        # Filter for lighting-specific content
-        lighting_content = self._extract_lighting_content(setup_info)
         matched_gear = self._match_user_gear(user_gear, scenario)
-        lighting_gear = self._personalize_gear_recommendations("Use your lighting equipment for ", matched_gear)
         
-        content = f"**Lighting Setup for {scenario.replace('_', ' ').title()}:**\n\n"
-        content += f"{lighting_content}\n\n"
-        content += f"**Your Lighting Gear:** {lighting_gear}"
+        def render_content() -> str:
+            # Filter for lighting-specific content
+            setup_info = self.knowledge_base.text(scenario, 'comprehensive', 'setup')
+            lighting_content = self._extract_lighting_content(setup_info)
+            lighting_gear = self._personalize_gear_recommendations("Use your lighting equipment for ", matched_gear)
+            
+            content = f"**Lighting Setup for {scenario.replace('_', ' ').title()}:**\n\n"
+            content += f"{lighting_content}\n\n"
+            content += f"**Your Lighting Gear:** {lighting_gear}"
+            return content
+        
+        content = self._render_cached(render_content, 'followup', scenario, topic='lighting', matched_gear=matched_gear)
         
         return {
             'content': content,
@@ -253,33 +339,36 @@ class SynthiaChatEngine:
             'context': {'current_scenario': scenario}
         }
     
-    def _generate_gear_advice(self, scenario: str, scenario_data: Dict[str, Any], skill_level: str, user_gear: List[GearItem]) -> Dict[str, Any]:
+    def _generate_gear_advice(self, scenario: str, skill_level: str, user_gear: List[GearItem]) -> Dict[str, Any]:
         """Generate gear advice for current scenario"""
-        comprehensive_data = scenario_data.get('comprehensive', {})
-        gear_info = comprehensive_data.get('gear', '')
-        
+        gear_info = self.knowledge_base.template(scenario, 'comprehensive', 'gear')
         matched_gear = self._match_user_gear(user_gear, scenario)
-        personalized_gear = self._personalize_gear_recommendations(gear_info, matched_gear)
-        
-        content = f"**Recommended Gear for {scenario.replace('_', ' ').title()}:**\n\n"
-        content += f"{personalized_gear}\n\n"
-        content += "**From Your Collection:** "
         
-        # Enhanced camera body recommendations
-        camera_advice = self._get_best_camera_for_scenario(matched_gear['cameras'], scenario)
-        gear_summary = []
-        
-        if camera_advice:
-            gear_summary.append(f"Camera: {camera_advice}")
-        
-        if matched_gear['lenses']:
-            lens_advice = self._get_best_lens_for_scenario(matched_gear['lenses'], scenario)
-            gear_summary.append(f"Lens: {lens_advice}")
-        
-        if matched_gear['lighting']:
-            gear_summary.append(f"Lighting: {len(matched_gear['lighting'])} item(s)")
+        def render_content() -> str:
+            personalized_gear = self._personalize_gear_recommendations(gear_info, matched_gear)
+            
+            content = f"**Recommended Gear for {scenario.replace('_', ' ').title()}:**\n\n"
+            content += f"{personalized_gear}\n\n"
+            content += "**From Your Collection:** "
+            
+            # Enhanced camera body recommendations
+            camera_advice = self._get_best_camera_for_scenario(matched_gear['cameras'], scenario)
+            gear_summary = []
+            
+            if camera_advice:
+                gear_summary.append(f"Camera: {camera_advice}")
+            
+            if matched_gear['lenses']:
+                lens_advice = self._get_best_lens_for_scenario(matched_gear['lenses'], scenario)
+                gear_summary.append(f"Lens: {lens_advice}")
+            
+            if matched_gear['lighting']:
+                gear_summary.append(f"Lighting: {len(matched_gear['lighting'])} item(s)")
+            
+            content += " • ".join(gear_summary) if gear_summary else "Add your gear in the profile for personalized recommendations"
+            return content
         
-        content += " • ".join(gear_summary) if gear_summary else "Add your gear in the profile for personalized recommendations"
+        content = self._render_cached(render_content, 'followup', scenario, topic='gear', matched_gear=matched_gear)
         
         return {
             'content': content,
@@ -289,14 +378,17 @@ class SynthiaChatEngine:
             'context': {'current_scenario': scenario}
         }
     
-    def _generate_settings_advice(self, scenario: str, scenario_data: Dict[str, Any], skill_level: str) -> Dict[str, Any]:
+    def _generate_settings_advice(self, scenario: str, skill_level: str) -> Dict[str, Any]:
         """Generate camera settings advice for current scenario"""
-        comprehensive_data = scenario_data.get('comprehensive', {})
-        camera_settings = comprehensive_data.get('camera_settings', '')
+        def render_content() -> str:
+            camera_settings = self.knowledge_base.text(scenario, 'comprehensive', 'camera_settings')
+            
+            content = f"**Camera Settings for {scenario.replace('_', ' ').title()}:**\n\n"
+            content += f"{camera_settings}\n\n"
+            content += "**Remember:** These are starting points - adjust based on your specific lighting conditions and creative vision."
+            return content
         
-        content = f"**Camera Settings for {scenario.replace('_', ' ').title()}:**\n\n"
-        content += f"{camera_settings}\n\n"
-        content += "**Remember:** These are starting points - adjust based on your specific lighting conditions and creative vision."
+        content = self._render_cached(render_content, 'followup', scenario, topic='settings')
         
         return {
             'content': content,
@@ -306,14 +398,17 @@ class SynthiaChatEngine:
             'context': {'current_scenario': scenario}
         }
     
-    def _generate_composition_advice(self, scenario: str, scenario_data: Dict[str, Any], skill_level: str) -> Dict[str, Any]:
+    def _generate_composition_advice(self, scenario: str, skill_level: str) -> Dict[str, Any]:
         """Generate composition advice for current scenario"""
-        comprehensive_data = scenario_data.get('comprehensive', {})
-        angles_info = comprehensive_data.get('angles', '')
+        def render_content() -> str:
+            angles_info = self.knowledge_base.text(scenario, 'comprehensive', 'angles')
+            
+            content = f"**Composition & Angles for {scenario.replace('_', ' ').title()}:**\n\n"
+            content += f"{angles_info}\n\n"
+            content += "**Pro Tip:** Try multiple angles and compositions during your shoot - you can always narrow down to the best shots later."
+            return content
         
-        content = f"**Composition & Angles for {scenario.replace('_', ' ').title()}:**\n\n"
-        content += f"{angles_info}\n\n"
-        content += "**Pro Tip:** Try multiple angles and compositions during your shoot - you can always narrow down to the best shots later."
+        content = self._render_cached(render_content, 'followup', scenario, topic='composition')
         
         return {
             'content': content,
@@ -323,14 +418,17 @@ class SynthiaChatEngine:
             'context': {'current_scenario': scenario}
         }
     
-    def _generate_general_followup(self, scenario: str, scenario_data: Dict[str, Any], skill_level: str, message: str) -> Dict[str, Any]:
+    def _generate_general_followup(self, scenario: str, skill_level: str, message: str) -> Dict[str, Any]:
         """Generate general follow-up advice for current scenario"""
-        comprehensive_data = scenario_data.get('comprehensive', {})
-        pro_tip = comprehensive_data.get('pro_tip', '')
+        def render_content() -> str:
+            pro_tip = self.knowledge_base.text(scenario, 'comprehensive', 'pro_tip')
+            
+            content = f"**Additional Tips for {scenario.replace('_', ' ').title()}:**\n\n"
+            content += f"{pro_tip}\n\n"
+            content += "Feel free to ask about specific aspects like posing, lighting, gear, or camera settings for more detailed guidance!"
+            return content
         
-        content = f"**Additional Tips for {scenario.replace('_', ' ').title()}:**\n\n"
-        content += f"{pro_tip}\n\n"
-        content += "Feel free to ask about specific aspects like posing, lighting, gear, or camera settings for more detailed guidance!"
+        content = self._render_cached(render_content, 'followup', scenario, topic='general')
         
         return {
             'content': content,
@@ -420,16 +518,17 @@ class SynthiaChatEngine:
                                   message: str, chat_session: ChatSession) -> Dict[str, Any]:
         """Generate step-by-step response for beginners"""
         
-        style_data = self.knowledge_base.get(photography_style, {})
-        beginner_steps = style_data.get('beginner_steps', {})
-        
         # Start with intake summary and step 1
         if chat_session.current_step == 0:
             intake_summary = f"**Intake Summary:** I understand you want to create a {photography_style.replace('_', ' ')} look. "
             intake_summary += "Let me walk you through this step by step to help you achieve the perfect shot."
             
-            step1_content = beginner_steps.get('step1', {}).get('scene_gear_overview', '')
-            step1_content = self._personalize_gear_recommendations(step1_content, matched_gear)
+            def render_step1() -> str:
+                step1_template = self.knowledge_base.template(photography_style, 'beginner_steps', 'step1', 'scene_gear_overview')
+                return self._personalize_gear_recommendations(step1_template, matched_gear)
+            
+            step1_content = self._render_cached(render_step1, 'beginner', photography_style, 'Beginner', step=1,
+                                                matched_gear=matched_gear)
             
             # Handle special cases and triggers
             step1_content = self._apply_special_case_triggers(step1_content, message, matched_gear)
@@ -447,7 +546,7 @@ class SynthiaChatEngine:
                 'awaiting_continuation': True,
                 'context': {
                     'photography_style': photography_style, 
-                    'matched_gear': self._serialize_gear(matched_gear),
+                    'gear_fingerprint': gear_fingerprint(matched_gear),
                     'skip_lighting': skip_lighting
                 }
             }
@@ -464,43 +563,37 @@ class SynthiaChatEngine:
     
     def _should_skip_lighting_step(self, message: str, matched_gear: Dict[str, List[GearItem]]) -> bool:
         """Check if we should skip the lighting step for special cases like astrophotography"""
-        message_lower = message.lower()
-        
         # Astrophotography cases - skip lighting unless user has lighting gear
-        astro_keywords = ['astrophotography', 'stars', 'milky way', 'night sky', 'astro']
-        if any(keyword in message_lower for keyword in astro_keywords):
+        if self._match_intents(message).has('special_case', 'astro'):
             return len(matched_gear.get('lighting', [])) == 0
         
         return False
     
     def _apply_special_case_triggers(self, content: str, message: str, matched_gear: Dict[str, List[GearItem]]) -> str:
         """Apply special case triggers based on user message"""
-        message_lower = message.lower()
+        intent_match = self._match_intents(message)
         
         # Group photography trigger
-        group_keywords = ['group', 'event', 'party', 'people', 'multiple people']
-        if any(keyword in message_lower for keyword in group_keywords):
+        if intent_match.has('special_case', 'group'):
             content += "\n\n**Important for Groups:** When photographing groups of 3 or more, an aperture of f/2.8 may result in only part of the group being in focus, especially if people are on different planes. Suggest stopping down to f/4 or f/5.6 to keep multiple faces sharp, and adjust ISO or shutter speed accordingly to maintain exposure."
         
         # Astrophotography trigger
-        astro_keywords = ['astrophotography', 'stars', 'milky way', 'night sky', 'astro']
-        if any(keyword in message_lower for keyword in astro_keywords):
+        if intent_match.has('special_case', 'astro'):
             content += "\n\n**Astrophotography Notes:** Focus on exposure, tripod use, and mobile workflow. Use manual focus set to infinity, ISO 1600-6400, aperture f/2.8-f/4, and 15-30 second exposures depending on focal length (500 rule)."
         
         # Infrared triggers
-        if '590nm' in message_lower or '590 nm' in message_lower:
+        if intent_match.has('special_case', 'ir_590'):
             content += "\n\n**590nm Infrared:** This creates Aerochrome-style looks with red/gold foliage. Set custom white balance around 2500K and consider channel swapping in post-processing for dramatic color effects."
         
-        if '720nm' in message_lower or '720 nm' in message_lower:
+        if intent_match.has('special_case', 'ir_720'):
             content += "\n\n**720nm Infrared:** This produces the traditional IR look with white foliage and dark skies. Set custom white balance around 3000K for best starting point."
         
         # Drone photography trigger
-        drone_keywords = ['drone', 'aerial', 'flying', 'dji', 'uav']
-        if any(keyword in message_lower for keyword in drone_keywords):
+        if intent_match.has('special_case', 'drone'):
             content += "\n\n**Drone Safety:** Recommend ND filters for smooth footage and slow pans for cinematic movement. ⚠️ **Important:** FAA rules regarding drone registration, Remote ID, and airspace limits vary by location. Users should consult faa.gov/uas or the B4UFLY app before flying."
         
         # Underwater trigger
-        if 'underwater' in message_lower:
+        if intent_match.has('special_case', 'underwater'):
             content += "\n\n**Underwater Photography:** Use underwater housing, shoot in RAW, and consider red filters at depth. Manual white balance is crucial due to color loss underwater."
         
         return content
@@ -508,10 +601,8 @@ class SynthiaChatEngine:
     def _handle_beginner_continuation(self, chat_session: ChatSession, matched_gear: Dict[str, List[GearItem]]) -> Dict[str, Any]:
         """Handle continuation to next step for beginners"""
         
-        context = chat_session.conversation_context or {}
-        if isinstance(context, str):
-            context = {}
-        photography_style = context.get('photography_style', '') if context else ''
+        context = read_context(chat_session)
+        photography_style = context.get('photography_style', '')
         skip_lighting = context.get('skip_lighting', False)
         
         if not photography_style:
@@ -522,9 +613,6 @@ class SynthiaChatEngine:
                 'awaiting_continuation': False
             }
         
-        style_data = self.knowledge_base.get(photography_style, {})
-        beginner_steps = style_data.get('beginner_steps', {})
-        
         current_step = chat_session.current_step or 0
         next_step = current_step + 1
         
@@ -533,10 +621,13 @@ class SynthiaChatEngine:
             if skip_lighting:
                 next_step = 3  # Skip to step 3
             else:
-                step2_content = beginner_steps.get('step2', {}).get('lighting_setup', '')
-                # Add mobile flash tip
-                step2_content += "\n\n**Mobile Flash Tip:** If you want to stay mobile, use handheld or on-camera flash with diffusers (e.g., MagMod Sphere). Start with flash power at 1/64 or 1/128 as a starting point. **Optional Color Balance Tip:** If you have an orange gel (½ CTO - Color Temperature Orange), place it over your flash to better match warm indoor lighting."
-                full_content = f"🟦 **Step 2: Lighting Setup**\n{step2_content}\n\nReady for Step 3: Posing & Composition?"
+                def render_step2() -> str:
+                    step2_content = self.knowledge_base.text(photography_style, 'beginner_steps', 'step2', 'lighting_setup')
+                    # Add mobile flash tip
+                    step2_content += "\n\n**Mobile Flash Tip:** If you want to stay mobile, use handheld or on-camera flash with diffusers (e.g., MagMod Sphere). Start with flash power at 1/64 or 1/128 as a starting point. **Optional Color Balance Tip:** If you have an orange gel (½ CTO - Color Temperature Orange), place it over your flash to better match warm indoor lighting."
+                    return f"🟦 **Step 2: Lighting Setup**\n{step2_content}\n\nReady for Step 3: Posing & Composition?"
+                
+                full_content = self._render_cached(render_step2, 'beginner', photography_style, 'Beginner', step=2)
                 
                 return {
                     'content': full_content,
@@ -547,8 +638,11 @@ class SynthiaChatEngine:
         
         if next_step == 3:
             # Step 3: Posing & Composition
-            step3_content = beginner_steps.get('step3', {}).get('posing_composition', '')
-            full_content = f"🟦 **Step 3: Posing & Composition**\n{step3_content}\n\nWant a final pro tip before you shoot?"
+            def render_step3() -> str:
+                step3_content = self.knowledge_base.text(photography_style, 'beginner_steps', 'step3', 'posing_composition')
+                return f"🟦 **Step 3: Posing & Composition**\n{step3_content}\n\nWant a final pro tip before you shoot?"
+            
+            full_content = self._render_cached(render_step3, 'beginner', photography_style, 'Beginner', step=3)
             
             return {
                 'content': full_content,
@@ -559,8 +653,11 @@ class SynthiaChatEngine:
         
         if next_step == 4:
             # Step 4: Final Pro Tip
-            step4_content = beginner_steps.get('step4', {}).get('final_pro_tip', '')
-            full_content = f"🟦 **Step 4: Final Pro Tip**\n{step4_content}\n\n📌 These tips should give you a solid foundation — but every shoot is different. Adjust on the fly, and trust your eye. If anything changes, I've got your back."
+            def render_step4() -> str:
+                step4_content = self.knowledge_base.text(photography_style, 'beginner_steps', 'step4', 'final_pro_tip')
+                return f"🟦 **Step 4: Final Pro Tip**\n{step4_content}\n\n📌 These tips should give you a solid foundation — but every shoot is different. Adjust on the fly, and trust your eye. If anything changes, I've got your back."
+            
+            full_content = self._render_cached(render_step4, 'beginner', photography_style, 'Beginner', step=4)
             
             return {
                 'content': full_content,
@@ -592,16 +689,17 @@ class SynthiaChatEngine:
                                        skill_level: str, message: str) -> Dict[str, Any]:
         """Generate comprehensive response for intermediate/advanced users"""
         
-        style_data = self.knowledge_base.get(photography_style, {})
-        comprehensive_data = style_data.get('comprehensive', {})
-        
-        # Build comprehensive response
-        setup_info = comprehensive_data.get('setup', '')
-        gear_info = self._personalize_gear_recommendations(comprehensive_data.get('gear', ''), matched_gear)
-        angles_info = comprehensive_data.get('angles', '')
-        camera_settings = comprehensive_data.get('camera_settings', '')
-        
-        response_content = f"""**Setup:** {setup_info}
+        def render_content() -> str:
+            # Build comprehensive response
+            setup_info = self.knowledge_base.text(photography_style, 'comprehensive', 'setup')
+            gear_info = self._personalize_gear_recommendations(
+                self.knowledge_base.template(photography_style, 'comprehensive', 'gear'), matched_gear)
+            angles_info = self.knowledge_base.text(photography_style, 'comprehensive', 'angles')
+            camera_settings = self.knowledge_base.text(photography_style, 'comprehensive', 'camera_settings')
+            pro_tip = self.knowledge_base.text(photography_style, 'comprehensive', 'pro_tip',
+                                               default='Adjust these settings based on your specific lighting conditions and creative vision.')
+            
+            return f"""**Setup:** {setup_info}
 
 **Recommended Gear from Your Collection:** {gear_info}
 
@@ -609,7 +707,10 @@ class SynthiaChatEngine:
 
 **Camera Settings:** {camera_settings}
 
-**Pro Tip:** {comprehensive_data.get('pro_tip', 'Adjust these settings based on your specific lighting conditions and creative vision.')}"""
+**Pro Tip:** {pro_tip}"""
+        
+        response_content = self._render_cached(render_content, 'comprehensive', photography_style, skill_level,
+                                               matched_gear=matched_gear)
         
         return {
             'content': response_content,
@@ -693,7 +794,7 @@ class SynthiaChatEngine:
         """Generate general photography advice based on user's specialization"""
         
         # If user has a specialization and message is general, provide specialized advice
-        if user_specialization and user_specialization != 'General' and any(word in message.lower() for word in ['tips', 'advice', 'help', 'suggest']):
+        if user_specialization and user_specialization != 'General' and self._match_intents(message).has('general_advice'):
             return self._generate_specialization_advice(user_specialization, skill_level)
         
         general_responses = [
@@ -713,97 +814,151 @@ class SynthiaChatEngine:
             'context': {}
         }
     
-    def _personalize_gear_recommendations(self, content: str, matched_gear: Dict[str, List[GearItem]]) -> str:
-        """Personalize recommendations based on user's actual gear"""
+    def _personalize_gear_recommendations(self, content: Union[str, CompiledTemplate],
+                                          matched_gear: Dict[str, List[GearItem]]) -> str:
+        """Personalize recommendations based on user's actual gear
+        
+        Knowledge base fields arrive as templates pre-split by the compiled
+        artifact; other text is compiled here.
+        """
+        template = compile_template(content) if isinstance(content, str) else content
+        if not template.placeholders:
+            return template.render({})
         
         # Replace generic gear mentions with user's specific gear
+        values = {}
         if matched_gear['cameras']:
             camera = matched_gear['cameras'][0]
-            content = content.replace('[CAMERA]', f"{camera.brand} {camera.model}")
+            values['CAMERA'] = f"{camera.brand} {camera.model}"
         
         if matched_gear['lenses']:
-            lens_names = [f"{lens.brand} {lens.model}" for lens in matched_gear['lenses']]
-            content = content.replace('[LENS]', ', '.join(lens_names))
+            values['LENS'] = ', '.join(f"{lens.brand} {lens.model}" for lens in matched_gear['lenses'])
         
         if matched_gear['lighting']:
-            lighting_names = [f"{light.brand} {light.model}" for light in matched_gear['lighting']]
-            content = content.replace('[LIGHTING]', ', '.join(lighting_names))
+            values['LIGHTING'] = ', '.join(f"{light.brand} {light.model}" for light in matched_gear['lighting'])
         
-        return content
+        return template.render(values)
     
 
     
-    def _serialize_gear(self, matched_gear: Dict[str, List[GearItem]]) -> Dict[str, List[Dict]]:
-        """Serialize gear for JSON storage"""
-        serialized = {}
-        for category, items in matched_gear.items():
-            serialized[category] = [{'brand': item.brand, 'model': item.model} for item in items]
-        return serialized
-    
     def _handle_image_analysis(self, message: str, skill_level: str, user_gear: List[GearItem], 
-                              uploaded_images: List[UploadedImage]) -> Dict[str, Any]:
+                              uploaded_images: List[UploadedImage],
+                              on_delta: Optional[Callable[[str], None]] = None,
+                              analysis_results: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """Handle image analysis requests"""
         
-        # Determine analysis type based on message content
-        analysis_type = "inspiration"
-        if any(word in message.lower() for word in ["feedback", "critique", "improve", "better", "review"]):
-            analysis_type = "technique"
-        
-        # Analyze the first uploaded image
-        image = uploaded_images[0]
-        analysis_result = self.image_analysis_service.analyze_photography_image(
-            image.file_path, 
-            analysis_type
-        )
+        analysis_type, image_paths, exif_paths, local_only = self.plan_image_analysis(message, uploaded_images)
+        
+        # Analyze every uploaded image concurrently
+        if analysis_results is None:
+            analysis_results = self.image_analysis_service.analyze_photography_images(
+                image_paths,
+                analysis_type,
+                on_delta,
+                local_only,
+                exif_paths
+            )
+        
+        responses = []
+        for image, analysis_result in zip(uploaded_images, analysis_results):
+            if not analysis_result["success"]:
+                responses.append((image, analysis_result, None))
+                continue
+            
+            # Store analysis result in the image record
+            image.analysis_result = analysis_to_dict(analysis_result["analysis"])
+            
+            # Generate personalized response based on analysis and skill level
+            if analysis_type == "inspiration":
+                response = self._generate_inspiration_response(analysis_result["analysis"], skill_level, user_gear, message)
+            else:
+                response = self._generate_technique_feedback_response(analysis_result["analysis"], skill_level, user_gear, message)
+            responses.append((image, analysis_result, response))
         
-        if not analysis_result["success"]:
+        if not any(response for _, _, response in responses):
+            error = analysis_results[0]['error']
             return {
-                'content': f"I'm sorry, I had trouble analyzing your image: {analysis_result['error']}. Please try uploading a different image.",
+                'content': f"I'm sorry, I had trouble analyzing your image: {error}. Please try uploading a different image.",
                 'message_type': 'error',
                 'metadata': {'has_images': True, 'analysis_type': analysis_type}
             }
         
-        # Store analysis result in the image record
-        image.analysis_result = analysis_result["analysis"]
-        
-        # Generate personalized response based on analysis and skill level
-        if analysis_type == "inspiration":
-            return self._generate_inspiration_response(analysis_result["analysis"], skill_level, user_gear, message)
+        if len(responses) == 1:
+            result = responses[0][2]
         else:
-            return self._generate_technique_feedback_response(analysis_result["analysis"], skill_level, user_gear, message)
+            result = self._combine_image_responses(responses, analysis_type)
+        
+        # Local fallback analyses are less detailed; say so rather than pass them off as full ones
+        if any(analysis_result.get('degraded') for analysis_result in analysis_results):
+            result['content'] = f"{DEGRADED_ANALYSIS_NOTE}\n\n{result['content']}"
+            result['metadata']['degraded'] = True
+        
+        return result
     
-    def _generate_inspiration_response(self, analysis: Dict[str, Any], skill_level: str, 
-                                     user_gear: List[GearItem], message: str) -> Dict[str, Any]:
-        """Generate response for inspiration image analysis"""
+    def plan_image_analysis(self, message: str, uploaded_images: List[UploadedImage]) -> Tuple[str, List[str], List[str], bool]:
+        """Analysis type, image and EXIF paths, and whether local measurements suffice for an image turn"""
+        
+        # Determine analysis type based on message content
+        intents = self._match_intents(message)
+        analysis_type = "inspiration"
+        if intents.has('technique_request'):
+            analysis_type = "technique"
+        
+        # Exposure/focus/settings checks are answered from local measurements alone
+        local_only = (analysis_type == "technique" and intents.has('measurable_check')
+                      and not intents.has('visual_review'))
         
-        # Extract key information from analysis
-        lighting = analysis.get("lighting_analysis", {})
-        composition = analysis.get("composition", {})
-        settings = analysis.get("camera_settings", {})
-        recreate_tips = analysis.get("recreate_tips", {})
+        # Use the ingest derivative when there is one; it carries no EXIF, so that is read from the original
+        image_paths = [image.analysis_path or image.file_path for image in uploaded_images]
+        exif_paths = [image.file_path for image in uploaded_images]
+        return analysis_type, image_paths, exif_paths, local_only
+    
+    def _combine_image_responses(self, responses: List[Any], analysis_type: str) -> Dict[str, Any]:
+        """Merge per-image analysis responses into one mood board response"""
+        analyzed_count = sum(1 for _, _, response in responses if response)
+        
+        response_parts = [f"I analyzed {analyzed_count} of your {len(responses)} images. Here's the breakdown for each one:"]
+        
+        for i, (image, analysis_result, response) in enumerate(responses, 1):
+            response_parts.append(f"\n**🖼️ Image {i}: {image.original_filename}**")
+            if response:
+                response_parts.append(response['content'])
+            else:
+                response_parts.append(f"I had trouble analyzing this image: {analysis_result['error']}")
         
-        # Check user's gear against requirements
-        available_gear = [f"{item.brand} {item.model}" for item in user_gear]
-        equipment_needed = recreate_tips.get("equipment_needed", [])
+        return {
+            'content': "\n".join(response_parts),
+            'message_type': 'image_analysis',
+            'metadata': {
+                'analysis_type': analysis_type,
+                'has_images': True,
+                'image_count': len(responses),
+                'analyzed_count': analyzed_count
+            }
+        }
+    
+    def _generate_inspiration_response(self, analysis: InspirationAnalysis, skill_level: str, 
+                                     user_gear: List[GearItem], message: str) -> Dict[str, Any]:
+        """Generate response for inspiration image analysis"""
         
         # Build personalized response
         response_parts = []
         
         if skill_level == 'Beginner':
             response_parts.append("Great inspiration image! Let me break down how to recreate this look in simple steps:")
-            response_parts.append(f"\n**📸 Lighting Setup:**\n{lighting.get('lighting_setup', 'Natural lighting recommended')}")
-            response_parts.append(f"\n**📐 Camera Position:**\n{composition.get('camera_angle', 'Standard positioning')}")
+            response_parts.append(f"\n**📸 Lighting Setup:**\n{analysis.lighting_setup or 'Natural lighting recommended'}")
+            response_parts.append(f"\n**📐 Camera Position:**\n{analysis.camera_angle or 'Standard positioning'}")
             response_parts.append(f"\n**⚙️ Camera Settings:**")
-            response_parts.append(f"• Aperture: {settings.get('estimated_aperture', 'f/5.6')}")
-            response_parts.append(f"• ISO: {settings.get('estimated_iso', '400')}")
-            response_parts.append(f"• Focus: {settings.get('focus_point', 'Subject')}")
+            response_parts.append(f"• Aperture: {analysis.aperture or 'f/5.6'}")
+            response_parts.append(f"• ISO: {analysis.iso or '400'}")
+            response_parts.append(f"• Focus: {analysis.focus_point or 'Subject'}")
         else:
             response_parts.append("Excellent choice for inspiration! Here's my technical analysis:")
-            response_parts.append(f"\n**Lighting Analysis:**\n{lighting.get('primary_light_source', 'Analysis unavailable')} - {lighting.get('light_quality', '')}")
+            response_parts.append(f"\n**Lighting Analysis:**\n{analysis.primary_light_source or 'Analysis unavailable'} - {analysis.light_quality}")
             response_parts.append(f"\n**Technical Settings:**")
-            response_parts.append(f"• Estimated aperture: {settings.get('estimated_aperture', 'f/5.6')} - {settings.get('estimated_shutter_speed', '1/125s')}")
-            response_parts.append(f"• ISO: {settings.get('estimated_iso', '400')}")
-            response_parts.append(f"• Estimated focal length: {composition.get('focal_length', '85mm')}")
+            response_parts.append(f"• Estimated aperture: {analysis.aperture or 'f/5.6'} - {analysis.shutter_speed or '1/125s'}")
+            response_parts.append(f"• ISO: {analysis.iso or '400'}")
+            response_parts.append(f"• Estimated focal length: {analysis.focal_length or '85mm'}")
         
         # Add gear-specific recommendations
         response_parts.append(f"\n**🎯 With Your Gear:**")
@@ -820,7 +975,7 @@ class SynthiaChatEngine:
             response_parts.append("• Consider using a portrait lens (85mm or 50mm) for best results")
         
         # Add step-by-step recreation guide
-        steps = recreate_tips.get("step_by_step", [])
+        steps = analysis.steps
         if steps and skill_level == 'Beginner':
             response_parts.append(f"\n**📋 Step-by-Step Guide:**")
             for i, step in enumerate(steps[:4], 1):
@@ -838,16 +993,12 @@ class SynthiaChatEngine:
             }
         }
     
-    def _generate_technique_feedback_response(self, analysis: Dict[str, Any], skill_level: str,
+    def _generate_technique_feedback_response(self, analysis: TechniqueAnalysis, skill_level: str,
                                             user_gear: List[GearItem], message: str) -> Dict[str, Any]:
         """Generate response for technique feedback analysis"""
         
-        # Extract key information from analysis
-        technical = analysis.get("technical_assessment", {})
-        strengths = analysis.get("strengths", [])
-        improvements = analysis.get("improvements", {})
-        tips = analysis.get("specific_tips", {})
-        rating = analysis.get("overall_rating", "No rating available")
+        strengths = analysis.strengths
+        rating = analysis.overall_rating or "No rating available"
         
         response_parts = []
         
@@ -862,30 +1013,30 @@ class SynthiaChatEngine:
         
         # Technical assessment
         response_parts.append(f"\n**🔍 Technical Review:**")
-        if technical.get("exposure"):
-            response_parts.append(f"• **Exposure:** {technical['exposure']}")
-        if technical.get("focus"):
-            response_parts.append(f"• **Focus:** {technical['focus']}")
-        if technical.get("composition"):
-            response_parts.append(f"• **Composition:** {technical['composition']}")
+        if analysis.exposure:
+            response_parts.append(f"• **Exposure:** {analysis.exposure}")
+        if analysis.focus:
+            response_parts.append(f"• **Focus:** {analysis.focus}")
+        if analysis.composition:
+            response_parts.append(f"• **Composition:** {analysis.composition}")
         
         # Improvement suggestions based on skill level
         if skill_level == 'Beginner':
-            immediate_improvements = improvements.get("immediate", [])
+            immediate_improvements = analysis.immediate_improvements
             if immediate_improvements:
                 response_parts.append(f"\n**🎯 Quick Improvements to Try:**")
                 for improvement in immediate_improvements[:3]:
                     response_parts.append(f"• {improvement}")
         else:
-            technique_improvements = improvements.get("technique", [])
+            technique_improvements = analysis.technique_improvements
             if technique_improvements:
                 response_parts.append(f"\n**📈 Technique Development:**")
                 for improvement in technique_improvements:
                     response_parts.append(f"• {improvement}")
         
         # Specific tips
-        if tips.get("camera_settings"):
-            response_parts.append(f"\n**⚙️ Settings Suggestion:** {tips['camera_settings']}")
+        if analysis.camera_settings:
+            response_parts.append(f"\n**⚙️ Settings Suggestion:** {analysis.camera_settings}")
         
         content = "\n".join(response_parts)
         
@@ -0,0 +1,74 @@
+import os
+import base64
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+from flask import url_for
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import selectinload
+from app import db
+from models import ChatMessage
+
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "50"))
+MAX_HISTORY_PAGE_SIZE = 200
+
+def encode_cursor(message: ChatMessage) -> str:
+    """Opaque cursor pointing just before a message, by (timestamp, id)"""
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """(timestamp, id) from a cursor, or None if it is malformed"""
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, UnicodeError):
+        return None
+
+def load_history_page(session_id: int, before: Optional[Tuple[datetime, int]] = None,
+                      limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[ChatMessage], Optional[str]]:
+    """Newest messages of a session older than `before`, returned oldest first
+
+    Seeks on the (session_id, timestamp) index instead of using OFFSET, so
+    every page costs the same however long the session is. Uploaded images
+    are loaded in one extra query for the whole page.
+
+    Returns the messages and the cursor for the next older page (None when
+    there is nothing older)
+    """
+    query = (
+        db.select(ChatMessage)
+        .where(ChatMessage.session_id == session_id)
+        .options(selectinload(ChatMessage.uploaded_images))
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        .limit(limit + 1)
+    )
+    if before is not None:
+        timestamp, message_id = before
+        query = query.where(or_(
+            ChatMessage.timestamp < timestamp,
+            and_(ChatMessage.timestamp == timestamp, ChatMessage.id < message_id)
+        ))
+
+    messages = db.session.execute(query).scalars().all()
+    has_more = len(messages) > limit
+    messages = list(reversed(messages[:limit]))
+
+    next_cursor = encode_cursor(messages[0]) if has_more else None
+    return messages, next_cursor
+
+def serialize_message(message: ChatMessage) -> Dict[str, Any]:
+    """JSON-ready form of a message for the history API"""
+    return {
+        'id': message.id,
+        'message_type': message.message_type,
+        'content': message.content,
+        'step_number': message.step_number,
+        'timestamp': message.timestamp.isoformat(),
+        'images': [
+            {
+                'url': url_for('static', filename=image.display_path),
+                'original_filename': image.original_filename
+            }
+            for image in message.uploaded_images
+        ]
+    }
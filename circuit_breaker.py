@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Deque, Tuple
+
+# Calls considered when deciding whether to trip
+BREAKER_WINDOW = int(os.environ.get("VISION_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.environ.get("VISION_BREAKER_MIN_CALLS", "5"))
+
+# Trip when at least this fraction of recent calls failed...
+BREAKER_FAILURE_RATE = float(os.environ.get("VISION_BREAKER_FAILURE_RATE", "0.5"))
+
+# ...or when the 95th percentile latency of recent calls exceeds this many seconds
+BREAKER_LATENCY_P95 = float(os.environ.get("VISION_BREAKER_LATENCY_P95", "30"))
+
+# How long to fail fast before letting a probe call through
+BREAKER_OPEN_SECONDS = float(os.environ.get("VISION_BREAKER_OPEN_SECONDS", "30"))
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a sliding window of call outcomes
+
+    While open every call is refused until the cool-down passes; then a
+    single probe is let through and its outcome closes or re-opens it.
+    A probe that is neither recorded nor released within the cool-down is
+    presumed lost, and the next call becomes the probe.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, latency_p95: float = BREAKER_LATENCY_P95,
+                 open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.latency_p95 = latency_p95
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._calls: Deque[Tuple[bool, float]] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        self._counters = {'allowed': 0, 'rejected': 0, 'trips': 0}
+
+    def allow(self) -> bool:
+        """Whether a call may go to the backend right now"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            elif self.state == self.HALF_OPEN and self._probe_in_flight and now - self._probe_started >= self.open_seconds:
+                logging.error(f"Circuit {self.name} probe was never recorded, letting another through")
+                self._probe_in_flight = False
+
+            if self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probe_in_flight):
+                if self.state == self.HALF_OPEN:
+                    self._probe_in_flight = True
+                    self._probe_started = now
+                self._counters['allowed'] += 1
+                return True
+
+            self._counters['rejected'] += 1
+            return False
+
+    def record_success(self, latency: float):
+        self._record(True, latency)
+
+    def record_failure(self, latency: float):
+        self._record(False, latency)
+
+    def release(self):
+        """Give back an allowed call that never reached the backend, freeing the probe slot"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        """State, counters and the current window's failure rate and p95 latency"""
+        with self._lock:
+            failure_rate, p95 = self._window_metrics()
+            return dict(self._counters, state=self.state, window_calls=len(self._calls),
+                        failure_rate=failure_rate, latency_p95=p95)
+
+    def _record(self, success: bool, latency: float):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if success and latency < self.latency_p95:
+                    logging.info(f"Circuit {self.name} closed after a successful probe")
+                    self.state = self.CLOSED
+                    self._calls.clear()
+                else:
+                    self._trip("probe failed")
+                return
+
+            self._calls.append((success, latency))
+            if self.state != self.CLOSED or len(self._calls) < self.min_calls:
+                return
+
+            failure_rate, p95 = self._window_metrics()
+            if failure_rate >= self.failure_rate:
+                self._trip(f"failure rate {failure_rate:.0%}")
+            elif p95 >= self.latency_p95:
+                self._trip(f"p95 latency {p95:.1f}s")
+
+    def _trip(self, reason: str):
+        logging.error(f"Circuit {self.name} opened: {reason}")
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._counters['trips'] += 1
+
+    def _window_metrics(self) -> Tuple[float, float]:
+        if not self._calls:
+            return 0.0, 0.0
+        failures = sum(1 for success, _ in self._calls if not success)
+        latencies = sorted(latency for _, latency in self._calls)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return failures / len(self._calls), p95
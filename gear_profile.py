@@ -0,0 +1,270 @@
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Any, Iterator, Mapping, Optional, Tuple
+from response_cache import gear_fingerprint
+from sqlalchemy import insert, update, delete
+from app import db
+from models import GearItem, User
+
+GEAR_SNAPSHOT_CACHE_SIZE = int(os.environ.get("GEAR_SNAPSHOT_CACHE_SIZE", "5000"))
+
+# Gear categories and the keys the gear form and templates use for them
+GEAR_CATEGORIES = [
+    ('camera_body', 'camera_bodies'),
+    ('lens', 'lenses'),
+    ('lighting', 'lighting'),
+    ('backdrop', 'backdrops'),
+    ('accessory', 'accessories'),
+]
+
+# Keys the chat engine uses for matched gear
+ENGINE_GEAR_KEYS = {
+    'camera_body': 'cameras',
+    'lens': 'lenses',
+    'lighting': 'lighting',
+    'backdrop': 'backdrops',
+    'accessory': 'accessories',
+}
+
+def parse_gear_form(gear_data: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Turn the submitted gear form into a list of gear item values, in form order"""
+    items = []
+
+    # Process camera bodies (multiple cameras supported)
+    camera_index = 0
+    while True:
+        camera_brand = gear_data.get(f'camera_brand_{camera_index}')
+        camera_model = gear_data.get(f'camera_model_{camera_index}')
+
+        if not camera_brand or not camera_model:
+            break
+
+        items.append({'category': 'camera_body', 'brand': camera_brand, 'model': camera_model, 'specifications': None})
+        camera_index += 1
+
+    # Process lenses
+    lens_count = int(gear_data.get('lens_count', 0))
+    for i in range(lens_count):
+        lens_brand = gear_data.get(f'lens_brand_{i}')
+        lens_model = gear_data.get(f'lens_model_{i}')
+        if lens_brand and lens_model:
+            lens_specs = {
+                'aperture_range': gear_data.get(f'lens_aperture_{i}', ''),
+                'type': gear_data.get(f'lens_type_{i}', 'prime')
+            }
+            items.append({'category': 'lens', 'brand': lens_brand, 'model': lens_model, 'specifications': lens_specs})
+
+    # Process lighting equipment
+    lighting_count = int(gear_data.get('lighting_count', 0))
+    for i in range(lighting_count):
+        lighting_brand = gear_data.get(f'lighting_brand_{i}')
+        lighting_model = gear_data.get(f'lighting_model_{i}')
+        if lighting_brand and lighting_model:
+            lighting_specs = {
+                'type': gear_data.get(f'lighting_type_{i}', ''),
+                'power': gear_data.get(f'lighting_power_{i}', ''),
+                'quantity': gear_data.get(f'lighting_quantity_{i}', '1')
+            }
+            items.append({'category': 'lighting', 'brand': lighting_brand, 'model': lighting_model, 'specifications': lighting_specs})
+
+    # Process backdrops
+    backdrop_count = int(gear_data.get('backdrop_count', 0))
+    for i in range(backdrop_count):
+        backdrop_brand = gear_data.get(f'backdrop_brand_{i}')
+        backdrop_model = gear_data.get(f'backdrop_model_{i}')
+        if backdrop_brand and backdrop_model:
+            items.append({'category': 'backdrop', 'brand': backdrop_brand, 'model': backdrop_model, 'specifications': None})
+
+    # Process accessories
+    accessory_count = int(gear_data.get('accessory_count', 0))
+    for i in range(accessory_count):
+        accessory_brand = gear_data.get(f'accessory_brand_{i}')
+        accessory_model = gear_data.get(f'accessory_model_{i}')
+        if accessory_brand and accessory_model:
+            items.append({'category': 'accessory', 'brand': accessory_brand, 'model': accessory_model, 'specifications': None})
+
+    return items
+
+def load_user_gear(user_id: int) -> List[GearItem]:
+    """All of a user's gear in one query, in the order it was entered"""
+    return GearItem.query.filter_by(user_id=user_id).order_by(GearItem.id).all()
+
+def group_gear(gear_items: List[GearItem]) -> Dict[str, List[GearItem]]:
+    """Group gear rows by form/template key"""
+    keys = dict(GEAR_CATEGORIES)
+    grouped = {key: [] for _, key in GEAR_CATEGORIES}
+    for item in gear_items:
+        key = keys.get(item.category)
+        if key:
+            grouped[key].append(item)
+    return grouped
+
+def save_gear_profile(user_id: int, submitted_items: List[Dict[str, Any]],
+                      existing_gear: Optional[List[GearItem]] = None) -> Dict[str, int]:
+    """Apply a submitted gear profile as a diff against the stored rows
+
+    Items are compared position by position within each category, so
+    unchanged gear is never rewritten and the entered order is kept.
+    Inserts, updates and deletes each go out as one bulk statement; the
+    caller commits.
+
+    Returns counts of inserted, updated and deleted rows
+    """
+    if existing_gear is None:
+        existing_gear = load_user_gear(user_id)
+
+    existing_by_category: Dict[str, List[GearItem]] = {}
+    for item in existing_gear:
+        existing_by_category.setdefault(item.category, []).append(item)
+
+    inserts, updates = [], []
+    positions: Dict[str, int] = {}
+    for values in submitted_items:
+        category = values['category']
+        position = positions.get(category, 0)
+        positions[category] = position + 1
+
+        existing = existing_by_category.get(category, [])
+        if position >= len(existing):
+            inserts.append(dict(values, user_id=user_id))
+            continue
+
+        item = existing[position]
+        if (item.brand, item.model, item.specifications) != (values['brand'], values['model'], values['specifications']):
+            updates.append({
+                'id': item.id,
+                'brand': values['brand'],
+                'model': values['model'],
+                'specifications': values['specifications']
+            })
+
+    delete_ids = [
+        item.id
+        for category, existing in existing_by_category.items()
+        for item in existing[positions.get(category, 0):]
+    ]
+
+    if delete_ids:
+        db.session.execute(delete(GearItem).where(GearItem.id.in_(delete_ids)), execution_options={'synchronize_session': False})
+    if updates:
+        db.session.execute(update(GearItem), updates)
+    if inserts:
+        db.session.execute(insert(GearItem), inserts)
+
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(delete_ids)}
+
+
+@dataclass(frozen=True)
+class GearEntry:
+    """Read-only copy of a GearItem row"""
+    id: int
+    category: str
+    brand: str
+    model: str
+    specifications: Optional[Mapping[str, Any]] = None
+
+class MatchedGear(Mapping):
+    """Read-only engine-category mapping of gear entries"""
+
+    def __init__(self, entries: Tuple[GearEntry, ...]):
+        matched = {key: [] for key in ENGINE_GEAR_KEYS.values()}
+        for entry in entries:
+            key = ENGINE_GEAR_KEYS.get(entry.category)
+            if key:
+                matched[key].append(entry)
+        self._items = {key: tuple(items) for key, items in matched.items()}
+        self.fingerprint = gear_fingerprint(self._items)
+
+    def __getitem__(self, key: str) -> Tuple[GearEntry, ...]:
+        return self._items[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class GearSnapshot:
+    """Immutable, categorized view of a user's gear at one gear_version"""
+
+    def __init__(self, user_id: int, version: int, entries: Tuple[GearEntry, ...]):
+        self.user_id = user_id
+        self.version = version
+        self.entries = entries
+        self.matched_gear = MatchedGear(entries)
+
+    def __iter__(self) -> Iterator[GearEntry]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def summary(self) -> Dict[str, int]:
+        """Item counts per gear form category"""
+        counts = {key: 0 for _, key in GEAR_CATEGORIES}
+        keys = dict(GEAR_CATEGORIES)
+        for entry in self.entries:
+            if entry.category in keys:
+                counts[keys[entry.category]] += 1
+        return counts
+
+def build_gear_snapshot(user_id: int, version: int) -> GearSnapshot:
+    """Load a user's gear in one query and freeze it into a snapshot"""
+    rows = db.session.execute(
+        db.select(GearItem.id, GearItem.category, GearItem.brand, GearItem.model, GearItem.specifications)
+        .where(GearItem.user_id == user_id)
+        .order_by(GearItem.id)
+    ).all()
+    entries = tuple(
+        GearEntry(row.id, row.category, row.brand, row.model,
+                  MappingProxyType(dict(row.specifications)) if row.specifications else None)
+        for row in rows
+    )
+    return GearSnapshot(user_id, version, entries)
+
+class GearSnapshotCache:
+    """Per-process LRU of gear snapshots, validated against User.gear_version"""
+
+    def __init__(self, max_users: int = GEAR_SNAPSHOT_CACHE_SIZE):
+        self.max_users = max_users
+        self._snapshots: "OrderedDict[int, GearSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user: User) -> GearSnapshot:
+        """Return the user's gear snapshot, rebuilding it if gear_version moved on"""
+        version = user.gear_version or 0
+        with self._lock:
+            snapshot = self._snapshots.get(user.id)
+            if snapshot is not None and snapshot.version == version:
+                self._snapshots.move_to_end(user.id)
+                self._hits += 1
+                return snapshot
+            self._misses += 1
+
+        snapshot = build_gear_snapshot(user.id, version)
+
+        with self._lock:
+            self._snapshots[user.id] = snapshot
+            self._snapshots.move_to_end(user.id)
+            while len(self._snapshots) > self.max_users:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._snapshots.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'users': len(self._snapshots),
+                'hit_rate': self._hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,13 @@
+"""Gunicorn settings, read automatically from the working directory"""
+import gc
+from knowledge_base import shared_knowledge_base
+
+def on_starting(server):
+    # Map the knowledge base once in the master; workers fork with the
+    # mapping and its style table already in place
+    shared_knowledge_base().load()
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach, so
+    # workers do not copy shared pages just by running a GC pass over them
+    gc.freeze()
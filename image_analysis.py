@@ -1,47 +1,276 @@
 import os
-import base64
+import binascii
 import json
-from typing import Dict, Any, Optional
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Any, List, Optional, Union
+from flask import current_app, has_app_context
 from PIL import Image
-from openai import OpenAI
+from image_ingest import ANALYSIS_MAX_SIZE, encode_profile, is_compliant_jpeg, reduce_image, encode_jpeg, read_jpeg_without_metadata
+from vision_client import VisionClient, AsyncVisionClient, create_vision_client, create_async_vision_client
+from circuit_breaker import CircuitBreaker
+from analysis_schema import Analysis, SchemaError, analysis_to_dict, json_schema, parse_analysis
+from local_analysis import analyze_locally, apply_measurements, describe_measurements, fallback_analysis
+from metrics import chat_stage_latency
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+
+# Bump whenever the analysis prompts change so cached results are not reused
+PROMPT_VERSION = "3"
+
+# Completion budget; the structured responses need well under this
+ANALYSIS_MAX_TOKENS = int(os.environ.get("ANALYSIS_MAX_TOKENS", "500"))
+
+# Upper bound on vision requests in flight per process
+MAX_CONCURRENT_ANALYSES = int(os.environ.get("MAX_CONCURRENT_ANALYSES", "4"))
+
+# The same bound in the ASGI mode, where waiting requests hold no thread
+ASYNC_MAX_CONCURRENT_ANALYSES = int(os.environ.get("ASYNC_MAX_CONCURRENT_ANALYSES", "512"))
+
+# Input bytes base64-encoded per step; a multiple of 3 so chunks need no padding
+BASE64_CHUNK_SIZE = 3 * 16 * 1024
+
+def encode_data_url(image: memoryview, mime_type: str = "image/jpeg") -> bytearray:
+    """ASCII bytes of a base64 data URL for an image buffer
+    
+    The encoded text is written chunk by chunk into one preallocated
+    buffer straight from the memoryview. Callers drop the image buffer
+    before decoding the result to a string, so at most one full-size
+    copy of the image exists next to the payload at any moment.
+    """
+    prefix = f"data:{mime_type};base64,".encode('ascii')
+    encoded_size = 4 * ((len(image) + 2) // 3)
+    
+    payload = bytearray(len(prefix) + encoded_size)
+    payload[:len(prefix)] = prefix
+    offset = len(prefix)
+    for start in range(0, len(image), BASE64_CHUNK_SIZE):
+        chunk = binascii.b2a_base64(image[start:start + BASE64_CHUNK_SIZE], newline=False)
+        payload[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    
+    return payload
+
+@dataclass
+class VisionRequest:
+    """An encoded image ready to send to the vision model"""
+    image_path: str
+    exif_path: Optional[str]
+    analysis_type: str
+    image_hash: Optional[str]
+    insights: Optional[Dict[str, Any]]
+    request_kwargs: Dict[str, Any]
 
 class ImageAnalysisService:
     """Service for analyzing photography images using OpenAI's vision capabilities"""
     
-    def __init__(self):
-        self.client = openai_client
+    def __init__(self, cache=None, max_concurrency: int = MAX_CONCURRENT_ANALYSES, encode_profile_name: Optional[str] = None,
+                 client: Optional[VisionClient] = None, breaker: Optional[CircuitBreaker] = None):
+        # One pooled connection per concurrent analysis
+        self.client = client or create_vision_client(max_connections=max_concurrency)
+        self.breaker = breaker or CircuitBreaker('vision')
+        self.cache = cache
+        self.encode_profile = encode_profile(encode_profile_name)
+        self._stats_lock = threading.Lock()
+        self._encode_stats = {'images': 0, 'image_bytes': 0, 'payload_bytes': 0, 'bytes_copied': 0}
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="vision")
+        self._async_client: Optional[AsyncVisionClient] = None
+        self._async_slots: Optional[asyncio.Semaphore] = None
+    
+    def analyze_photography_images(self, image_paths: List[str], analysis_type: str = "inspiration",
+                                   on_delta: Optional[Callable[[str], None]] = None,
+                                   local_only: bool = False,
+                                   exif_paths: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Analyze several images concurrently
+        
+        Each image is resized, encoded and sent to the vision model on the
+        shared worker pool, so a batch takes roughly as long as its slowest image.
+        
+        Args:
+            image_paths: Paths to the uploaded images
+            analysis_type: Type of analysis - "inspiration" or "technique"
+            on_delta: Optional callback receiving streamed model output
+            local_only: Answer from the local measurements without calling the model
+            exif_paths: Original uploads to read EXIF from, one per image path
+        
+        Returns:
+            List of analysis results in the same order as image_paths
+        """
+        exif_paths = exif_paths or [None] * len(image_paths)
+        if len(image_paths) == 1:
+            return [self.analyze_photography_image(image_paths[0], analysis_type, on_delta, local_only, exif_paths[0])]
+        
+        # Worker threads need the app context for the analysis cache
+        app = current_app._get_current_object() if has_app_context() else None
+        
+        def analyze(image_path: str, exif_path: Optional[str]) -> Dict[str, Any]:
+            if app is None:
+                return self.analyze_photography_image(image_path, analysis_type, on_delta, local_only, exif_path)
+            with app.app_context():
+                return self.analyze_photography_image(image_path, analysis_type, on_delta, local_only, exif_path)
+        
+        return list(self.executor.map(analyze, image_paths, exif_paths))
     
-    def analyze_photography_image(self, image_path: str, analysis_type: str = "inspiration") -> Dict[str, Any]:
+    def analyze_photography_image(self, image_path: str, analysis_type: str = "inspiration",
+                                  on_delta: Optional[Callable[[str], None]] = None,
+                                  local_only: bool = False, exif_path: Optional[str] = None) -> Dict[str, Any]:
         """
         Analyze a photography image to provide technical insights
         
         Args:
             image_path: Path to the uploaded image
             analysis_type: Type of analysis - "inspiration" or "technique"
+            on_delta: Optional callback; when given the completion is streamed
+                and each content delta is passed to it as it arrives
+            local_only: Answer from EXIF, histogram and sharpness measurements
+                alone, without calling the model
+            exif_path: Original upload to read EXIF from when image_path is
+                an ingest derivative, which is saved without metadata
         
         Returns:
-            Dictionary containing analysis results
+            Dictionary containing analysis results; "degraded" is set when
+            the vision backend was unavailable and a local analysis was used
+        """
+        prepared = self._prepare_analysis(image_path, analysis_type, local_only, exif_path)
+        if not isinstance(prepared, VisionRequest):
+            return prepared
+        
+        started = time.perf_counter()
+        try:
+            if on_delta is None:
+                response = self.client.create(**prepared.request_kwargs)
+                response_content = response.choices[0].message.content
+            else:
+                response_content = self.client.stream(on_delta, **prepared.request_kwargs)
+        except Exception as e:
+            return self._complete_analysis(prepared, None, time.perf_counter() - started, e)
+        return self._complete_analysis(prepared, response_content, time.perf_counter() - started)
+    
+    async def analyze_photography_images_async(self, image_paths: List[str], analysis_type: str = "inspiration",
+                                               on_delta: Optional[Callable[[str], None]] = None,
+                                               local_only: bool = False, app=None,
+                                               exif_paths: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Async twin of analyze_photography_images for the ASGI mode
+        
+        Encoding and cache lookups run on the worker pool (inside the given
+        app's context); the vision requests are awaited on the event loop,
+        so thousands of them can be in flight without holding threads.
         """
+        exif_paths = exif_paths or [None] * len(image_paths)
+        return list(await asyncio.gather(*(
+            self.analyze_photography_image_async(image_path, analysis_type, on_delta, local_only, app, exif_path)
+            for image_path, exif_path in zip(image_paths, exif_paths)
+        )))
+    
+    async def analyze_photography_image_async(self, image_path: str, analysis_type: str = "inspiration",
+                                              on_delta: Optional[Callable[[str], None]] = None,
+                                              local_only: bool = False, app=None,
+                                              exif_path: Optional[str] = None) -> Dict[str, Any]:
+        """Async twin of analyze_photography_image; see analyze_photography_images_async"""
+        loop = asyncio.get_running_loop()
+        
+        def in_context(call: Callable[..., Any], *args) -> Any:
+            if app is None:
+                return call(*args)
+            with app.app_context():
+                return call(*args)
+        
+        prepared = await loop.run_in_executor(self.executor, in_context, self._prepare_analysis,
+                                              image_path, analysis_type, local_only, exif_path)
+        if not isinstance(prepared, VisionRequest):
+            return prepared
+        
+        client, slots = self._get_async_client()
+        async with slots:
+            started = time.perf_counter()
+            try:
+                if on_delta is None:
+                    response = await client.create(**prepared.request_kwargs)
+                    response_content = response.choices[0].message.content
+                else:
+                    response_content = await client.stream(on_delta, **prepared.request_kwargs)
+                error = None
+            except asyncio.CancelledError:
+                # Not the backend's failure, but a half-open probe must not stay taken
+                self.breaker.release()
+                raise
+            except Exception as e:
+                response_content, error = None, e
+            latency = time.perf_counter() - started
+        
+        return await loop.run_in_executor(self.executor, in_context, self._complete_analysis,
+                                          prepared, response_content, latency, error)
+    
+    def _get_async_client(self):
+        """Async client and in-flight limit, created on the first async analysis's event loop"""
+        if self._async_client is None:
+            self._async_client = create_async_vision_client(max_connections=ASYNC_MAX_CONCURRENT_ANALYSES)
+            self._async_slots = asyncio.Semaphore(ASYNC_MAX_CONCURRENT_ANALYSES)
+        return self._async_client, self._async_slots
+    
+    def _prepare_analysis(self, image_path: str, analysis_type: str, local_only: bool,
+                          exif_path: Optional[str] = None) -> Union[Dict[str, Any], VisionRequest]:
+        """Answer from local measurements, the cache or the open breaker, or build the vision request"""
+        if local_only:
+            return self._local_analysis(image_path, analysis_type, exif_path=exif_path)
+        
+        allowed = False
         try:
-            # Convert image to base64
-            base64_image = self._encode_image_to_base64(image_path)
+            # Normalize the image once; the JPEG bytes double as the cache key
+            encode_started = time.perf_counter()
+            image_buffer = self._encode_image_to_jpeg(image_path)
+            encode_seconds = time.perf_counter() - encode_started
+            
+            image_hash = None
+            if self.cache is not None:
+                image_hash = self.cache.image_hash(image_buffer)
+                cached_result = self._cached_analysis(image_hash, analysis_type)
+                if cached_result is not None:
+                    chat_stage_latency.observe(encode_seconds, stage='image_encode')
+                    return {
+                        "success": True,
+                        "analysis": cached_result,
+                        "analysis_type": analysis_type,
+                        "cached": True
+                    }
+            
+            # Fail fast while the backend is unhealthy
+            if not self.breaker.allow():
+                return self._local_analysis(image_path, analysis_type, exif_path=exif_path, degraded=True)
+            allowed = True
+            
+            # Measured facts replace what the model would otherwise have to guess
+            insights = self._measure(image_path, exif_path)
+            
+            # Free the JPEG before the payload is turned into the request string
+            encode_started = time.perf_counter()
+            data_url = encode_data_url(image_buffer)
+            image_size = len(image_buffer)
+            del image_buffer
+            image_url = data_url.decode('ascii')
+            del data_url
+            self._count_encode(image_size, len(image_url))
+            chat_stage_latency.observe(encode_seconds + time.perf_counter() - encode_started, stage='image_encode')
             
             if analysis_type == "inspiration":
                 prompt = self._get_inspiration_analysis_prompt()
             else:
                 prompt = self._get_technique_analysis_prompt()
+            if insights is not None:
+                prompt += self._get_measurements_prompt(insights)
             
-            response = self.client.chat.completions.create(
+            request_kwargs = dict(
                 model="gpt-4o",
                 messages=[
                     {
                         "role": "system",
-                        "content": "You are Synthia, an expert photography assistant. Analyze images to provide detailed technical photography advice. Always respond in JSON format with structured insights."
+                        "content": "You are Synthia, an expert photography assistant. Give concise, practical technical advice."
                     },
                     {
                         "role": "user",
@@ -52,19 +281,51 @@ class ImageAnalysisService:
                             },
                             {
                                 "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                                "image_url": {"url": image_url}
                             }
                         ]
                     }
                 ],
-                response_format={"type": "json_object"},
-                max_tokens=1000
+                response_format=json_schema(analysis_type),
+                max_tokens=ANALYSIS_MAX_TOKENS
             )
+            return VisionRequest(image_path, exif_path, analysis_type, image_hash, insights, request_kwargs)
+            
+        except Exception as e:
+            if allowed:
+                # The request was never sent; a half-open breaker must not wait on it
+                self.breaker.release()
+            return {
+                "success": False,
+                "error": f"Failed to analyze image: {str(e)}",
+                "analysis_type": analysis_type
+            }
+    
+    def _complete_analysis(self, prepared: VisionRequest, response_content: Optional[str], latency: float,
+                           error: Optional[Exception] = None) -> Dict[str, Any]:
+        """Validate the model's response and cache it, falling back to local analysis on failure"""
+        analysis_type = prepared.analysis_type
+        chat_stage_latency.observe(latency, stage='vision_call')
+        try:
+            try:
+                if error is not None:
+                    raise error
+                if not response_content:
+                    raise ValueError("Empty response from OpenAI")
+                result = parse_analysis(analysis_type, json.loads(response_content))
+            except Exception as e:
+                self.breaker.record_failure(latency)
+                logging.error(f"Vision analysis failed, using local analysis: {str(e)}")
+                return self._local_analysis(prepared.image_path, analysis_type, prepared.insights,
+                                            prepared.exif_path, degraded=True)
+            self.breaker.record_success(latency)
+            
+            if prepared.insights is not None:
+                result = apply_measurements(result, prepared.insights)
+            
+            if self.cache is not None:
+                self.cache.put(prepared.image_hash, analysis_type, PROMPT_VERSION, analysis_to_dict(result))
             
-            response_content = response.choices[0].message.content
-            if not response_content:
-                raise ValueError("Empty response from OpenAI")
-            result = json.loads(response_content)
             return {
                 "success": True,
                 "analysis": result,
@@ -78,93 +339,106 @@ class ImageAnalysisService:
                 "analysis_type": analysis_type
             }
     
-    def _encode_image_to_base64(self, image_path: str) -> str:
-        """Convert image file to base64 string"""
+    def _cached_analysis(self, image_hash: str, analysis_type: str) -> Optional[Analysis]:
+        """Cached analysis for an image, or None; entries that no longer parse count as misses"""
+        cached = self.cache.get(image_hash, analysis_type, PROMPT_VERSION)
+        if cached is None:
+            return None
+        try:
+            return parse_analysis(analysis_type, cached)
+        except SchemaError as e:
+            logging.error(f"Ignoring cached analysis that fails validation: {str(e)}")
+            return None
+    
+    def _measure(self, image_path: str, exif_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """EXIF, histogram and sharpness measurements; None if the image cannot be measured"""
+        try:
+            return analyze_locally(image_path, exif_path)
+        except Exception as e:
+            logging.error(f"Local image analysis failed for {image_path}: {str(e)}")
+            return None
+    
+    def _local_analysis(self, image_path: str, analysis_type: str, insights: Optional[Dict[str, Any]] = None,
+                        exif_path: Optional[str] = None, degraded: bool = False) -> Dict[str, Any]:
+        """Analysis built from local measurements only; never cached
+        
+        Used for technique questions the measurements answer, and as the
+        degraded-mode fallback while the vision backend is unavailable.
+        """
+        try:
+            analysis = fallback_analysis(insights or analyze_locally(image_path, exif_path), analysis_type)
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Failed to analyze image: {str(e)}",
+                "analysis_type": analysis_type
+            }
+        result = {
+            "success": True,
+            "analysis": analysis,
+            "analysis_type": analysis_type,
+            "local": True
+        }
+        if degraded:
+            result["degraded"] = True
+        return result
+    
+    def encode_stats(self) -> Dict[str, Any]:
+        """Bytes copied while building vision payloads in this process
+        
+        bytes_copied counts every full pass over image data: the file read
+        or JPEG encoder output, the base64 buffer and the final string. The
+        old b64encode/decode/f-string path made three payload-sized copies
+        instead of two and kept the JPEG alive until the end.
+        """
+        with self._stats_lock:
+            return dict(self._encode_stats)
+    
+    def _count_encode(self, image_size: int, payload_size: int):
+        with self._stats_lock:
+            self._encode_stats['images'] += 1
+            self._encode_stats['image_bytes'] += image_size
+            self._encode_stats['payload_bytes'] += payload_size
+            self._encode_stats['bytes_copied'] += image_size + 2 * payload_size
+    
+    def _encode_image_to_jpeg(self, image_path: str) -> memoryview:
+        """Normalize an image file to a resized RGB JPEG
+        
+        Compliant JPEGs (ingest derivatives, small photos) are returned
+        without re-encoding, minus any metadata segments; anything else is
+        decoded at reduced scale and re-encoded with the configured encode
+        profile.
+        """
         try:
-            # Open and potentially resize image if too large
             with Image.open(image_path) as img:
-                # Resize if image is too large (max 1024px on longest side)
-                max_size = 1024
-                if max(img.size) > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
+                if is_compliant_jpeg(img, os.path.getsize(image_path)):
+                    stripped = read_jpeg_without_metadata(image_path)
+                    if stripped is not None:
+                        return stripped
                 
-                # Save to bytes
-                import io
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='JPEG', quality=85)
-                img_byte_arr = img_byte_arr.getvalue()
-                
-                # Encode to base64
-                return base64.b64encode(img_byte_arr).decode('utf-8')
+                reduced = reduce_image(img, ANALYSIS_MAX_SIZE, self.encode_profile)
+                return encode_jpeg(reduced, self.encode_profile['jpeg_quality'])
                 
         except Exception as e:
             raise Exception(f"Failed to encode image: {str(e)}")
     
     def _get_inspiration_analysis_prompt(self) -> str:
-        """Prompt for analyzing inspiration images"""
-        return """Analyze this photography image to help someone recreate a similar look. Provide a detailed technical breakdown in JSON format with these sections:
+        """Prompt for analyzing inspiration images; the fields come from the response schema"""
+        return "Analyze this photo so the user can recreate a similar look. Keep every field brief."
+    
+    def _get_measurements_prompt(self, insights: Dict[str, Any]) -> str:
+        """Prompt section listing values measured from the file"""
+        return f"""
 
-{
-  "lighting_analysis": {
-    "primary_light_source": "description of main light direction and quality",
-    "lighting_setup": "suggested lighting equipment and positioning",
-    "light_quality": "hard/soft, warm/cool temperature description",
-    "shadows": "description of shadow characteristics"
-  },
-  "composition": {
-    "camera_angle": "estimated camera position and angle",
-    "framing": "description of how subject is framed",
-    "depth_of_field": "estimated aperture and DOF characteristics",
-    "focal_length": "estimated lens focal length"
-  },
-  "camera_settings": {
-    "estimated_aperture": "f-stop estimate with reasoning",
-    "estimated_shutter_speed": "shutter speed estimate",
-    "estimated_iso": "ISO estimate",
-    "focus_point": "where the focus appears to be"
-  },
-  "styling_notes": {
-    "background": "description of background elements",
-    "props": "any props or accessories used",
-    "clothing": "wardrobe considerations if applicable",
-    "makeup_hair": "styling notes if applicable"
-  },
-  "recreate_tips": {
-    "equipment_needed": ["list of recommended equipment"],
-    "step_by_step": ["ordered list of steps to recreate this look"],
-    "key_challenges": ["potential difficulties and how to overcome them"]
-  }
-}"""
+Measured from the image file:
+{describe_measurements(insights)}
+
+Use these recorded values as given instead of estimating them, keeping those fields to the value alone, and spend your analysis on what cannot be measured."""
     
     def _get_technique_analysis_prompt(self) -> str:
-        """Prompt for analyzing technique in user's own photos"""
-        return """Analyze this photograph to provide constructive feedback and improvement suggestions. Respond in JSON format:
-
-{
-  "technical_assessment": {
-    "exposure": "evaluation of exposure quality and suggestions",
-    "focus": "assessment of focus accuracy and sharpness",
-    "composition": "composition strengths and areas for improvement",
-    "lighting": "lighting quality and suggestions"
-  },
-  "strengths": ["list of what works well in this image"],
-  "improvements": {
-    "immediate": ["simple adjustments that could be made"],
-    "technique": ["skill-based improvements to practice"],
-    "equipment": ["equipment upgrades that might help"]
-  },
-  "specific_tips": {
-    "camera_settings": "suggested setting adjustments",
-    "positioning": "suggestions for camera or subject positioning",
-    "timing": "timing considerations if applicable"
-  },
-  "overall_rating": "rating out of 10 with brief explanation"
-}"""
+        """Prompt for analyzing technique in user's own photos; the fields come from the response schema"""
+        return "Give constructive feedback on this photograph so the user can improve. Keep every field brief."
 
-def create_image_analysis_service() -> ImageAnalysisService:
+def create_image_analysis_service(cache=None, max_concurrency: int = MAX_CONCURRENT_ANALYSES) -> ImageAnalysisService:
     """Factory function to create image analysis service"""
-    return ImageAnalysisService()
\ No newline at end of file
+    return ImageAnalysisService(cache=cache, max_concurrency=max_concurrency)
\ No newline at end of file
@@ -0,0 +1,277 @@
+import io
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Dict, Any, List, Optional
+from PIL import Image
+from metrics import chat_stage_latency
+
+# Processes per web worker decoding and resizing uploads
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+
+# Longest side of the image sent to the vision model
+ANALYSIS_MAX_SIZE = 1024
+
+# JPEGs within the size limit and this many bytes are sent without re-encoding
+ANALYSIS_MAX_BYTES = int(os.environ.get("ANALYSIS_MAX_BYTES", str(1024 * 1024)))
+
+# Quality/speed trade-offs for downscaling. draft_gap is how far above the
+# target size DCT scaling (JPEG) and box reduction (everything else) may
+# stop before the resample filter takes over; a larger gap keeps more
+# pixels for a smoother result.
+ENCODE_PROFILES = {
+    'quality': {'resample': Image.Resampling.LANCZOS, 'draft_gap': 2.0, 'jpeg_quality': 85},
+    'fast': {'resample': Image.Resampling.BILINEAR, 'draft_gap': 1.0, 'jpeg_quality': 80},
+}
+IMAGE_ENCODE_PROFILE = os.environ.get("IMAGE_ENCODE_PROFILE", "quality")
+
+# Longest side of the image shown in the chat history
+THUMBNAIL_MAX_SIZE = 320
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+class UploadTooLarge(Exception):
+    """Raised when an upload stream exceeds the size limit"""
+
+def save_upload_stream(stream: BinaryIO, file_path: str, max_bytes: int, chunk_size: int = UPLOAD_CHUNK_SIZE) -> int:
+    """Copy an upload to disk chunk by chunk, returning its size
+
+    The size is counted as it is written, so an oversized upload is
+    rejected without being buffered and the partial file is removed.
+    """
+    size = 0
+    try:
+        with open(file_path, 'wb') as output:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                output.write(chunk)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return size
+
+def derivative_paths(file_path: str) -> Dict[str, str]:
+    """Where the analysis and thumbnail derivatives of an upload live"""
+    directory, filename = os.path.split(file_path)
+    stem = os.path.splitext(filename)[0]
+    derived = os.path.join(directory, 'derived')
+    return {
+        'analysis_path': os.path.join(derived, f"{stem}_analysis.jpg"),
+        'thumbnail_path': os.path.join(derived, f"{stem}_thumb.jpg"),
+    }
+
+def encode_profile(name: Optional[str] = None) -> Dict[str, Any]:
+    """Settings for a named encode profile, falling back to IMAGE_ENCODE_PROFILE"""
+    return ENCODE_PROFILES.get(name or IMAGE_ENCODE_PROFILE, ENCODE_PROFILES['quality'])
+
+def is_compliant_jpeg(img: Image.Image, file_size: int, max_size: int = ANALYSIS_MAX_SIZE,
+                      max_bytes: int = ANALYSIS_MAX_BYTES) -> bool:
+    """True if an opened image can be sent to the vision model byte for byte"""
+    return img.format == 'JPEG' and img.mode == 'RGB' and max(img.size) <= max_size and file_size <= max_bytes
+
+def reduce_image(img: Image.Image, max_size: int, profile: Dict[str, Any]) -> Image.Image:
+    """Downscale an opened image to fit max_size and convert it to RGB
+
+    JPEGs are first decoded with draft(), which lets libjpeg scale down by
+    up to 8x in the DCT domain, so a large photo is never fully decoded
+    just to be shrunk to 1024px.
+    """
+    width, height = img.size
+    if max(width, height) > max_size:
+        scale = max_size / max(width, height)
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+        # draft() only reduces while both sides stay at or above the requested box
+        if img.format == 'JPEG':
+            gap = profile['draft_gap']
+            img.draft('RGB', (int(target[0] * gap), int(target[1] * gap)))
+        img = img.resize(target, profile['resample'], reducing_gap=profile['draft_gap'])
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+def encode_jpeg(img: Image.Image, quality: int) -> memoryview:
+    """Encode an RGB image as a JPEG, returning a view of the encoder's buffer"""
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality)
+    return output.getbuffer()
+
+def is_metadata_segment(marker: int, payload: bytes) -> bool:
+    """Whether a JPEG segment holds metadata rather than anything the decoder needs
+
+    EXIF and XMP (APP1, where GPS and serial numbers live), IPTC (APP13),
+    the other vendor APPn blocks and comments are metadata. JFIF (APP0),
+    ICC colour profiles (APP2) and the Adobe colour transform (APP14)
+    change how the pixels decode, so they are kept.
+    """
+    if marker == 0xFE:
+        return True
+    if marker == 0xE2:
+        return not payload.startswith(b'ICC_PROFILE\x00')
+    return 0xE1 <= marker <= 0xEF and marker != 0xEE
+
+def read_jpeg_without_metadata(file_path: str) -> Optional[memoryview]:
+    """Read a JPEG with its metadata segments, and anything after its end marker, removed
+
+    Only the segment headers are rewritten; the compressed image data is
+    kept byte for byte. Data after the end marker is dropped because phones
+    append preview images and videos there, with their own EXIF. None if
+    the file is not a JPEG this can walk.
+    """
+    buffer = bytearray(os.path.getsize(file_path))
+    with open(file_path, 'rb', buffering=0) as source:
+        del buffer[source.readinto(buffer):]
+    if buffer[:2] != b'\xff\xd8':
+        return None
+
+    dropped = []
+    offset = 2
+    in_scan = False
+    while True:
+        if in_scan:
+            # Scan data only contains 0xFF as stuffed 0xFF00, restart markers or fill bytes
+            offset = buffer.find(b'\xff', offset)
+            if offset < 0 or offset + 1 >= len(buffer):
+                return None
+            marker = buffer[offset + 1]
+            if marker == 0x00 or 0xD0 <= marker <= 0xD7:
+                offset += 2
+                continue
+        elif offset + 1 >= len(buffer) or buffer[offset] != 0xFF:
+            return None
+        else:
+            marker = buffer[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0xD9:
+            del buffer[offset + 2:]
+            break
+
+        end = offset + 2 + int.from_bytes(buffer[offset + 2:offset + 4], 'big')
+        if end < offset + 4 or end > len(buffer):
+            return None
+        if is_metadata_segment(marker, bytes(buffer[offset + 4:min(end, offset + 16)])):
+            dropped.append((offset, end))
+        in_scan = marker == 0xDA
+        offset = end
+
+    for start, end in reversed(dropped):
+        del buffer[start:end]
+    return memoryview(buffer)
+
+def create_derivatives(file_path: str, analysis_path: str, thumbnail_path: str,
+                       profile_name: Optional[str] = None) -> Dict[str, Any]:
+    """Decode an upload once and write its analysis JPEG and display thumbnail
+
+    Runs in an ingest worker process.
+    """
+    profile = encode_profile(profile_name)
+    os.makedirs(os.path.dirname(analysis_path), exist_ok=True)
+
+    with Image.open(file_path) as img:
+        original_size = img.size
+        stripped = None
+        if is_compliant_jpeg(img, os.path.getsize(file_path)):
+            stripped = read_jpeg_without_metadata(file_path)
+        if stripped is not None:
+            # Same pixels, without the GPS position and serial numbers of the original
+            with open(analysis_path, 'wb') as output:
+                output.write(stripped)
+            reduced = img.convert('RGB')
+        else:
+            # Saved without EXIF: it goes to the vision model, and local analysis reads the original's
+            reduced = reduce_image(img, ANALYSIS_MAX_SIZE, profile)
+            reduced.save(analysis_path, format='JPEG', quality=profile['jpeg_quality'])
+        analysis_size = reduced.size
+
+        # The thumbnail comes from the already reduced image
+        reduce_image(reduced, THUMBNAIL_MAX_SIZE, profile).save(thumbnail_path, format='JPEG', quality=80)
+
+    return {
+        'analysis_path': analysis_path,
+        'thumbnail_path': thumbnail_path,
+        'original_size': original_size,
+        'analysis_size': analysis_size,
+    }
+
+class ImageIngestPool:
+    """Process pool that turns saved uploads into analysis and display derivatives"""
+
+    def __init__(self, max_workers: int = INGEST_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Not forked: the pool starts inside analysis threads, and a child forked
+        # from a multi-threaded process can inherit a held logging, SQLAlchemy or
+        # SSL lock. The forkserver is a clean single-threaded process that only
+        # preloads this module, so workers start without importing the app.
+        with self._lock:
+            if self._executor is None:
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload(['image_ingest'])
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._executor
+
+    def ensure_derivatives(self, uploaded_images: List[Any]) -> int:
+        """Create missing derivatives for UploadedImage rows in parallel (caller commits)
+
+        Returns how many images were processed. Images that fail keep
+        their original file for analysis.
+        """
+        pending = [image for image in uploaded_images if not image.analysis_path]
+        if not pending:
+            return 0
+
+        started = time.perf_counter()
+        futures = []
+        for image in pending:
+            paths = derivative_paths(image.file_path)
+            futures.append(self._submit(image.file_path, paths['analysis_path'], paths['thumbnail_path']))
+
+        processed = 0
+        for image, future in zip(pending, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Failed to create derivatives for {image.file_path}: {str(e)}")
+                continue
+            image.analysis_path = result['analysis_path']
+            image.thumbnail_path = result['thumbnail_path']
+            processed += 1
+        chat_stage_latency.observe(time.perf_counter() - started, stage='image_ingest')
+        return processed
+
+    def _submit(self, file_path: str, analysis_path: str, thumbnail_path: str):
+        try:
+            return self._get_executor().submit(create_derivatives, file_path, analysis_path, thumbnail_path)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool
+            logging.error("Image ingest pool broken, restarting it")
+            self._discard_executor()
+            return self._get_executor().submit(create_derivatives, file_path, analysis_path, thumbnail_path)
+
+    def _discard_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def shutdown(self):
+        self._discard_executor()
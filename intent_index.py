@@ -0,0 +1,123 @@
+import re
+from typing import Dict, List, Set, Tuple, Iterable, Optional
+
+
+class IntentMatch:
+    """Result of a single scan of a user message against the intent index"""
+
+    def __init__(self, labels: Dict[str, List[str]], exact: Dict[str, str]):
+        self._labels = labels
+        self._exact = exact
+
+    def labels(self, group: str) -> List[str]:
+        """Matched labels in a group, in the order they were registered"""
+        return self._labels.get(group, [])
+
+    def first(self, group: str) -> Optional[str]:
+        """First registered label matched in a group, if any"""
+        labels = self._labels.get(group)
+        return labels[0] if labels else None
+
+    def has(self, group: str, label: Optional[str] = None) -> bool:
+        """Check whether a group (or a specific label within it) matched"""
+        labels = self._labels.get(group, [])
+        if label is None:
+            return bool(labels)
+        return label in labels
+
+    def exact(self, group: str) -> bool:
+        """Check whether the whole message matched an exact phrase group"""
+        return group in self._exact
+
+
+class IntentIndex:
+    """Keyword index compiled once into a single trie-shaped regex.
+
+    Keywords are matched as case-insensitive substrings, like the
+    `keyword in message.lower()` checks they replace. A message is scanned
+    once; every keyword is attributed to one or more (group, label) pairs.
+    """
+
+    def __init__(self):
+        self._keyword_tags: Dict[str, Set[Tuple[str, str]]] = {}
+        self._exact_tags: Dict[str, Dict[str, str]] = {}
+        self._rank: Dict[Tuple[str, str], int] = {}
+        self._expanded: Dict[str, Set[Tuple[str, str]]] = {}
+        self._pattern: Optional[re.Pattern] = None
+
+    def add(self, group: str, label: str, keywords: Iterable[str]):
+        """Register substring keywords for a (group, label) pair"""
+        tag = (group, label)
+        self._rank.setdefault(tag, len(self._rank))
+        for keyword in keywords:
+            keyword = keyword.lower()
+            if keyword:
+                self._keyword_tags.setdefault(keyword, set()).add(tag)
+        self._pattern = None
+
+    def add_exact(self, group: str, phrases: Iterable[str]):
+        """Register phrases that must equal the whole (stripped) message"""
+        for phrase in phrases:
+            self._exact_tags.setdefault(phrase.lower().strip(), {})[group] = phrase
+        self._pattern = None
+
+    def compile(self):
+        """Build the scanning regex and the substring closure of each keyword"""
+        keywords = list(self._keyword_tags)
+        # A lookahead scan only reports the longest keyword starting at each
+        # position, so each keyword also carries the tags of every keyword it
+        # contains.
+        self._expanded = {}
+        for keyword in keywords:
+            tags = set()
+            for other in keywords:
+                if other in keyword:
+                    tags |= self._keyword_tags[other]
+            self._expanded[keyword] = tags
+
+        if keywords:
+            self._pattern = re.compile('(?=(' + self._trie_regex(keywords) + '))')
+        else:
+            self._pattern = re.compile('(?!)')
+
+    def match(self, message: str) -> IntentMatch:
+        """Scan a message once and return every matching label"""
+        if self._pattern is None:
+            self.compile()
+
+        message_lower = message.lower()
+        tags: Set[Tuple[str, str]] = set()
+        for found in self._pattern.finditer(message_lower):
+            tags |= self._expanded[found.group(1)]
+
+        labels: Dict[str, List[str]] = {}
+        for group, label in sorted(tags, key=self._rank.__getitem__):
+            labels.setdefault(group, []).append(label)
+
+        return IntentMatch(labels, self._exact_tags.get(message_lower.strip(), {}))
+
+    @staticmethod
+    def _trie_regex(keywords: List[str]) -> str:
+        """Build an alternation regex with shared prefixes factored out"""
+        trie: Dict = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = True
+
+        def render(node: Dict) -> str:
+            terminal = '' in node
+            branches = []
+            # Longer continuations first so the lookahead captures the
+            # longest keyword at each position
+            for char in sorted(k for k in node if k):
+                branches.append(re.escape(char) + render(node[char]))
+            if not branches:
+                return ''
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            if terminal:
+                return '(?:' + body + ')?'
+            return body
+
+        return render(trie)
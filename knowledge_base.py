@@ -0,0 +1,337 @@
+"""Compiled photography knowledge base
+
+`photography_knowledge.json` is compiled into a binary artifact:
+
+    header | marshalled style table | body
+
+The style table holds each style's keywords and the location of its
+field index in the body. A field index maps every text field to its
+UTF-8 text in the body, pre-split around its gear placeholders. The
+body is memory-mapped and only the style table is read at load, so boot
+time tracks the number of styles rather than the size of the text, and
+the text pages are shared through the OS page cache.
+
+Under gunicorn the master loads the process-wide instance before
+forking (see gunicorn.conf.py), so workers inherit one mapping and one
+style table instead of each reading their own.
+
+    python knowledge_base.py build    # compile (also done automatically when stale)
+    python knowledge_base.py stats
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import struct
+import marshal
+import hashlib
+import logging
+import argparse
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+from response_cache import PLACEHOLDER_PATTERN, CompiledTemplate
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+KNOWLEDGE_SOURCE = os.environ.get("KNOWLEDGE_SOURCE", os.path.join(BASE_DIR, "photography_knowledge.json"))
+KNOWLEDGE_ARTIFACT = os.environ.get("KNOWLEDGE_ARTIFACT", os.path.join(BASE_DIR, "photography_knowledge.kb"))
+
+# Seconds between checks of the source and artifact for changes
+KNOWLEDGE_RELOAD_INTERVAL = float(os.environ.get("KNOWLEDGE_RELOAD_INTERVAL", "2"))
+
+MAGIC = b"SYNTHKB\x00"
+FORMAT_VERSION = 2
+
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# magic, format version, style table length, CRC32 of everything after the header
+HEADER = struct.Struct('<8sIII')
+
+class KnowledgeBaseError(Exception):
+    """A knowledge base artifact that is missing, stale or corrupt"""
+
+def _source_signature(source_path: str) -> Tuple[int, int]:
+    stat = os.stat(source_path)
+    return stat.st_mtime_ns, stat.st_size
+
+def compile_knowledge_base(source_path: str = KNOWLEDGE_SOURCE, artifact_path: str = KNOWLEDGE_ARTIFACT) -> Dict[str, Any]:
+    """Compile the JSON knowledge base into the binary artifact
+
+    The artifact is written to a temporary file and renamed into place,
+    so concurrent builds and readers never see a partial file.
+    """
+    with open(source_path, 'rb') as f:
+        source = f.read()
+    knowledge = json.loads(source)
+
+    body = bytearray()
+    styles: Dict[str, Any] = {}
+    for style, style_data in knowledge.items():
+        fields: Dict[Tuple[str, ...], Any] = {}
+        _compile_fields(style_data, (), fields, body)
+        field_index = marshal.dumps(fields)
+        styles[style] = (tuple(style_data.get('keywords', [])), len(body), len(field_index))
+        body.extend(field_index)
+
+    mtime_ns, size = _source_signature(source_path)
+    index = marshal.dumps({
+        'source_sha256': hashlib.sha256(source).hexdigest(),
+        'source_mtime_ns': mtime_ns,
+        'source_size': size,
+        'styles': styles,
+    })
+    payload = index + bytes(body)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(index), zlib.crc32(payload))
+
+    temp_path = f"{artifact_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(temp_path, artifact_path)
+
+    return {'styles': len(styles), 'index_bytes': len(index), 'body_bytes': len(body)}
+
+def _compile_fields(node: Dict[str, Any], path: Tuple[str, ...], fields: Dict[Tuple[str, ...], Any], body: bytearray):
+    """Append every string under node to the body and index it by its key path
+
+    Each entry is (offset, length, parts): parts alternates (offset, length)
+    text segments with placeholder names, as CompiledTemplate splits them.
+    """
+    for key, value in node.items():
+        if isinstance(value, dict):
+            _compile_fields(value, path + (key,), fields, body)
+        elif isinstance(value, str):
+            offset = len(body)
+            parts = []
+            for i, part in enumerate(PLACEHOLDER_PATTERN.split(value)):
+                if i % 2:
+                    parts.append(part)
+                    body.extend(f"[{part}]".encode('utf-8'))
+                else:
+                    encoded = part.encode('utf-8')
+                    parts.append((len(body), len(encoded)))
+                    body.extend(encoded)
+            fields[path + (key,)] = (offset, len(body) - offset, tuple(parts))
+
+class CompiledKnowledgeBase:
+    """One memory-mapped, checksum-validated artifact
+
+    `styles` maps each style to (keywords, field index offset, field index
+    length); field indexes are unmarshalled per lookup.
+    """
+
+    def __init__(self, artifact_path: str):
+        with open(artifact_path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise KnowledgeBaseError("Knowledge base artifact is truncated")
+            magic, version, index_length, checksum = HEADER.unpack(header)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise KnowledgeBaseError("Knowledge base artifact has an unknown format")
+
+            # Checksummed through a small read buffer so the map's pages
+            # are only brought in as fields are actually read
+            crc = 0
+            for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+            if crc != checksum:
+                raise KnowledgeBaseError("Knowledge base artifact failed its checksum")
+
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.stat = os.fstat(f.fileno())
+
+        index = marshal.loads(self._map[HEADER.size:HEADER.size + index_length])
+        self._body_offset = HEADER.size + index_length
+        self.source_sha256: str = index['source_sha256']
+        self.source_signature = (index['source_mtime_ns'], index['source_size'])
+        self.styles: Dict[str, Any] = index['styles']
+
+    def fields(self, style: str) -> Optional[Dict[Tuple[str, ...], Any]]:
+        """A style's field index, or None for an unknown style"""
+        style_entry = self.styles.get(style)
+        if style_entry is None:
+            return None
+        start = self._body_offset + style_entry[1]
+        return marshal.loads(self._map[start:start + style_entry[2]])
+
+    def text(self, entry: Tuple[int, int, Any]) -> str:
+        offset, length = entry[0], entry[1]
+        start = self._body_offset + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def template(self, entry: Tuple[int, int, Any]) -> CompiledTemplate:
+        parts = [part if isinstance(part, str) else self.text(part) for part in entry[2]]
+        return CompiledTemplate.from_parts(parts)
+
+    def close(self):
+        self._map.close()
+
+class KnowledgeBase:
+    """Lazily loaded, hot-reloading, read-only view of the compiled knowledge base
+
+    Nothing is read until first use. The artifact is rebuilt when the JSON
+    source changes and remapped when the artifact is replaced, checked at
+    most every KNOWLEDGE_RELOAD_INTERVAL seconds. Responses read single
+    fields with `text()` / `template()`; `get(style)` materializes a whole
+    style as the nested dict the JSON file holds, for tooling.
+    """
+
+    def __init__(self, source_path: str = KNOWLEDGE_SOURCE, artifact_path: str = KNOWLEDGE_ARTIFACT,
+                 reload_interval: float = KNOWLEDGE_RELOAD_INTERVAL):
+        self.source_path = source_path
+        self.artifact_path = artifact_path
+        self.reload_interval = reload_interval
+        self._compiled: Optional[CompiledKnowledgeBase] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._counters = {'loads': 0, 'builds': 0}
+
+    def load(self) -> 'KnowledgeBase':
+        """Map the artifact now rather than on first use"""
+        self._current()
+        return self
+
+    @property
+    def version(self) -> Optional[str]:
+        """Hash of the JSON source currently loaded"""
+        compiled = self._current()
+        return compiled.source_sha256 if compiled else None
+
+    def styles(self) -> List[str]:
+        compiled = self._current()
+        return list(compiled.styles) if compiled else []
+
+    def keywords(self, style: str) -> Tuple[str, ...]:
+        compiled = self._current()
+        style_entry = compiled.styles.get(style) if compiled else None
+        return style_entry[0] if style_entry else ()
+
+    def get(self, style: str, default: Any = None) -> Any:
+        """A style's sections as nested dicts, decoded from the mapped body"""
+        compiled = self._current()
+        fields = compiled.fields(style) if compiled else None
+        if fields is None:
+            return default
+
+        style_data: Dict[str, Any] = {'keywords': list(compiled.styles[style][0])}
+        for path, entry in fields.items():
+            node = style_data
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = compiled.text(entry)
+        return style_data
+
+    def text(self, style: str, *path: str, default: str = '') -> str:
+        """One text field, e.g. text('high_key_portrait', 'comprehensive', 'setup')"""
+        compiled = self._current()
+        fields = compiled.fields(style) if compiled else None
+        entry = fields.get(path) if fields else None
+        return compiled.text(entry) if entry is not None else default
+
+    def template(self, style: str, *path: str) -> CompiledTemplate:
+        """A field pre-split around its gear placeholders; empty if the style or field is missing"""
+        compiled = self._current()
+        fields = compiled.fields(style) if compiled else None
+        entry = fields.get(path) if fields else None
+        if entry is None:
+            return CompiledTemplate.from_parts([''])
+        return compiled.template(entry)
+
+    def __contains__(self, style: str) -> bool:
+        compiled = self._current()
+        return bool(compiled) and style in compiled.styles
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            compiled = self._compiled
+            return dict(self._counters,
+                        styles=len(compiled.styles) if compiled else 0,
+                        artifact_bytes=compiled.stat.st_size if compiled else 0)
+
+    def _current(self) -> Optional[CompiledKnowledgeBase]:
+        now = time.monotonic()
+        if self._compiled is not None and now - self._checked_at < self.reload_interval:
+            return self._compiled
+        with self._lock:
+            if self._compiled is None or now - self._checked_at >= self.reload_interval:
+                self._checked_at = now
+                self._refresh()
+            return self._compiled
+
+    def _refresh(self):
+        """Load, rebuild or remap the artifact as needed; keeps serving the old one on errors"""
+        try:
+            source_signature = _source_signature(self.source_path)
+        except OSError:
+            source_signature = None
+
+        compiled = self._compiled
+        try:
+            artifact_stat = os.stat(self.artifact_path)
+        except OSError:
+            artifact_stat = None
+
+        if compiled is not None and artifact_stat is not None \
+                and (artifact_stat.st_ino, artifact_stat.st_mtime_ns) == (compiled.stat.st_ino, compiled.stat.st_mtime_ns) \
+                and source_signature in (None, compiled.source_signature):
+            return
+
+        try:
+            candidate = CompiledKnowledgeBase(self.artifact_path) if artifact_stat is not None else None
+        except (KnowledgeBaseError, OSError, ValueError, EOFError) as e:
+            logging.error(f"Discarding knowledge base artifact: {str(e)}")
+            candidate = None
+
+        if source_signature is not None and (candidate is None or candidate.source_signature != source_signature):
+            try:
+                compile_knowledge_base(self.source_path, self.artifact_path)
+                self._counters['builds'] += 1
+                candidate = CompiledKnowledgeBase(self.artifact_path)
+            except (OSError, ValueError, KnowledgeBaseError) as e:
+                # A stale but valid artifact (e.g. on a read-only deploy) still beats none
+                logging.error(f"Error compiling photography knowledge base: {str(e)}")
+
+        if candidate is None:
+            if compiled is None:
+                logging.error("Photography knowledge base not found")
+            return
+
+        # The old map is left to the garbage collector: a request may still be reading it
+        self._compiled = candidate
+        self._counters['loads'] += 1
+
+_shared: Optional[KnowledgeBase] = None
+_shared_lock = threading.Lock()
+
+def shared_knowledge_base() -> KnowledgeBase:
+    """The process-wide knowledge base; created in the gunicorn master and inherited by workers"""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = KnowledgeBase()
+    return _shared
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the photography knowledge base")
+    parser.add_argument('command', choices=['build', 'stats'])
+    parser.add_argument('--source', default=KNOWLEDGE_SOURCE)
+    parser.add_argument('--output', default=KNOWLEDGE_ARTIFACT)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        result = compile_knowledge_base(args.source, args.output)
+        print(f"Compiled {result['styles']} styles: {result['index_bytes']} byte index, "
+              f"{result['body_bytes']} byte body -> {args.output}")
+        return
+
+    started = time.perf_counter()
+    compiled = CompiledKnowledgeBase(args.output)
+    print(f"{len(compiled.styles)} styles, {compiled.stat.st_size} bytes, "
+          f"loaded in {(time.perf_counter() - started) * 1000:.2f}ms, source {compiled.source_sha256[:12]}")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,273 @@
+from typing import Dict, Any, List, Optional
+from PIL import Image, ImageFilter, ImageStat
+from analysis_schema import Analysis, InspirationAnalysis, TechniqueAnalysis
+
+# Longest side the image is reduced to before computing statistics
+STATS_SIZE = 256
+
+# Sharpness needs more detail than the histograms; measured per tile of a
+# SHARPNESS_GRID x SHARPNESS_GRID grid so a sharp subject on a blurred
+# background still counts as in focus
+SHARPNESS_SIZE = 512
+SHARPNESS_GRID = 4
+
+# Laplacian variance of the sharpest tile at SHARPNESS_SIZE
+SHARP_THRESHOLD = 300
+SOFT_THRESHOLD = 100
+
+LAPLACIAN = ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128)
+
+EXIF_IFD = 0x8769
+EXIF_TAGS = {
+    'make': 0x010F,
+    'model': 0x0110,
+    'exposure_time': 0x829A,
+    'f_number': 0x829D,
+    'iso': 0x8827,
+    'focal_length': 0x920A,
+    'lens_model': 0xA434,
+}
+
+def read_exif(img: Image.Image) -> Dict[str, Any]:
+    """Camera, lens and exposure settings recorded in the image, formatted for display"""
+    exif = img.getexif()
+    values = dict(exif)
+    values.update(exif.get_ifd(EXIF_IFD))
+
+    settings: Dict[str, Any] = {}
+    make = str(values.get(EXIF_TAGS['make'], '')).strip('\x00 ')
+    model = str(values.get(EXIF_TAGS['model'], '')).strip('\x00 ')
+    if model:
+        settings['camera'] = model if model.startswith(make) else f"{make} {model}".strip()
+
+    lens = str(values.get(EXIF_TAGS['lens_model'], '')).strip('\x00 ')
+    if lens:
+        settings['lens'] = lens
+
+    try:
+        if EXIF_TAGS['f_number'] in values:
+            settings['aperture'] = f"f/{float(values[EXIF_TAGS['f_number']]):g}"
+        if EXIF_TAGS['exposure_time'] in values:
+            exposure = float(values[EXIF_TAGS['exposure_time']])
+            settings['shutter_speed'] = f"1/{round(1 / exposure)}s" if 0 < exposure < 1 else f"{exposure:g}s"
+        if EXIF_TAGS['iso'] in values:
+            iso = values[EXIF_TAGS['iso']]
+            settings['iso'] = str(iso[0] if isinstance(iso, tuple) else iso)
+        if EXIF_TAGS['focal_length'] in values:
+            settings['focal_length'] = f"{float(values[EXIF_TAGS['focal_length']]):g}mm"
+    except (TypeError, ValueError, ZeroDivisionError):
+        pass
+
+    return settings
+
+def luminance_stats(img: Image.Image) -> Dict[str, float]:
+    """Brightness, contrast and clipping from the luminance histogram"""
+    histogram = img.convert('L').histogram()
+    total = sum(histogram) or 1
+    mean = sum(level * count for level, count in enumerate(histogram)) / total
+    variance = sum(((level - mean) ** 2) * count for level, count in enumerate(histogram)) / total
+    return {
+        'mean': mean,
+        'contrast': variance ** 0.5,
+        'shadows_clipped': 100 * sum(histogram[:8]) / total,
+        'highlights_clipped': 100 * sum(histogram[248:]) / total,
+    }
+
+def color_stats(img: Image.Image, colors: int = 5) -> Dict[str, Any]:
+    """Dominant colours and the warm/cool balance of the image"""
+    rgb = img.convert('RGB')
+    red, green, blue = (sum(i * c for i, c in enumerate(rgb.getchannel(band).histogram())) / (rgb.width * rgb.height)
+                        for band in range(3))
+
+    quantized = rgb.quantize(colors=colors)
+    palette = quantized.getpalette()
+    dominant = []
+    for count, index in sorted(quantized.getcolors(), reverse=True):
+        r, g, b = palette[index * 3:index * 3 + 3]
+        dominant.append({'hex': f"#{r:02x}{g:02x}{b:02x}", 'share': 100 * count / (rgb.width * rgb.height)})
+
+    balance = red - blue
+    temperature = 'warm' if balance > 15 else 'cool' if balance < -15 else 'neutral'
+    return {'average': (red, green, blue), 'temperature': temperature, 'dominant': dominant}
+
+def sharpness_estimate(gray: Image.Image) -> float:
+    """Laplacian variance of the sharpest tile of a grayscale image"""
+    edges = gray.filter(LAPLACIAN)
+    tile_width, tile_height = edges.width // SHARPNESS_GRID, edges.height // SHARPNESS_GRID
+    if not tile_width or not tile_height:
+        return ImageStat.Stat(edges).var[0]
+
+    return max(
+        ImageStat.Stat(edges.crop((x * tile_width, y * tile_height, (x + 1) * tile_width, (y + 1) * tile_height))).var[0]
+        for x in range(SHARPNESS_GRID) for y in range(SHARPNESS_GRID)
+    )
+
+def analyze_locally(image_path: str, exif_path: Optional[str] = None) -> Dict[str, Any]:
+    """EXIF settings plus histogram, colour and sharpness statistics, computed with PIL only
+
+    exif_path is the original upload when image_path is a derivative
+    without metadata; only its header is read.
+    """
+    with Image.open(image_path) as img:
+        if exif_path and exif_path != image_path:
+            with Image.open(exif_path) as original:
+                exif = read_exif(original)
+        else:
+            exif = read_exif(img)
+        if img.format == 'JPEG':
+            img.draft('RGB', (SHARPNESS_SIZE, SHARPNESS_SIZE))
+        medium = img.convert('RGB')
+        medium.thumbnail((SHARPNESS_SIZE, SHARPNESS_SIZE))
+
+    small = medium.copy()
+    small.thumbnail((STATS_SIZE, STATS_SIZE))
+    return {
+        'exif': exif,
+        'luminance': luminance_stats(small),
+        'color': color_stats(small),
+        'sharpness': sharpness_estimate(medium.convert('L')),
+    }
+
+def describe_exposure(luminance: Dict[str, float]) -> str:
+    """One-line exposure assessment from luminance statistics"""
+    mean = luminance['mean']
+    if luminance['highlights_clipped'] > 2:
+        assessment = f"Highlights are clipping ({luminance['highlights_clipped']:.1f}% pure white)"
+    elif luminance['shadows_clipped'] > 5:
+        assessment = f"Shadows are crushed ({luminance['shadows_clipped']:.1f}% pure black)"
+    elif mean < 70:
+        assessment = "Underexposed overall"
+    elif mean > 185:
+        assessment = "Bright, high-key exposure"
+    else:
+        assessment = "Well balanced exposure"
+    return f"{assessment} - average brightness {mean:.0f}/255"
+
+def describe_focus(sharpness: float) -> str:
+    """One-line focus assessment from the sharpness estimate"""
+    if sharpness >= SHARP_THRESHOLD:
+        return "Crisp detail in the sharpest area - focus looks accurate"
+    if sharpness >= SOFT_THRESHOLD:
+        return "Acceptably sharp, though fine detail is slightly soft"
+    return "Soft throughout - likely missed focus or camera shake"
+
+def describe_measurements(insights: Dict[str, Any]) -> str:
+    """Measured facts about the image, one per line, for the vision prompt"""
+    exif = insights['exif']
+    lines = [f"- {label}: {exif[key]}" for key, label in (
+        ('camera', 'Camera'), ('lens', 'Lens'), ('focal_length', 'Focal length'), ('aperture', 'Aperture'),
+        ('shutter_speed', 'Shutter speed'), ('iso', 'ISO'),
+    ) if key in exif]
+    luminance = insights['luminance']
+    lines.append(f"- Exposure: {describe_exposure(luminance)}; {luminance['shadows_clipped']:.1f}% of pixels "
+                 f"clipped to black, {luminance['highlights_clipped']:.1f}% clipped to white")
+    lines.append(f"- Sharpness: {describe_focus(insights['sharpness'])}")
+    return "\n".join(lines)
+
+def apply_measurements(analysis: Analysis, insights: Dict[str, Any]) -> Analysis:
+    """Replace model estimates with the recorded EXIF values and attach the measurements"""
+    exif = insights['exif']
+    if isinstance(analysis, InspirationAnalysis):
+        for key in ('aperture', 'shutter_speed', 'iso', 'focal_length'):
+            if key in exif:
+                setattr(analysis, key, exif[key])
+
+    analysis.measurements = {
+        'exif': exif,
+        'mean_brightness': round(insights['luminance']['mean'], 1),
+        'shadows_clipped': round(insights['luminance']['shadows_clipped'], 2),
+        'highlights_clipped': round(insights['luminance']['highlights_clipped'], 2),
+        'sharpness': round(insights['sharpness'], 1),
+    }
+    return analysis
+
+def describe_light(luminance: Dict[str, float], color: Dict[str, Any]) -> Dict[str, str]:
+    """Lighting hints from contrast and colour temperature"""
+    contrast = luminance['contrast']
+    if contrast > 70:
+        quality, setup = "Hard, high-contrast light", "A small or bare key light, or direct sun, for crisp defined shadows"
+        shadows = "Deep, well-defined shadows"
+    elif contrast < 40:
+        quality, setup = "Soft, low-contrast light", "A large softbox, umbrella or window light close to the subject"
+        shadows = "Gentle, open shadows"
+    else:
+        quality, setup = "Moderate contrast light", "A medium softbox as key with a reflector for fill"
+        shadows = "Soft-edged shadows with some depth"
+
+    temperature = color['temperature']
+    return {
+        'light_quality': f"{quality}, {temperature} colour balance",
+        'lighting_setup': setup,
+        'shadows': shadows,
+        'temperature': temperature,
+    }
+
+def fallback_analysis(insights: Dict[str, Any], analysis_type: str) -> Analysis:
+    """Analysis built from the measurements alone
+
+    Stands in for the vision model when it is unavailable, and answers
+    technique questions the measurements fully cover.
+    """
+    exif = insights['exif']
+    luminance = insights['luminance']
+    light = describe_light(luminance, insights['color'])
+    exposure = describe_exposure(luminance)
+    not_recorded = "Not recorded in the photo"
+
+    if analysis_type == "inspiration":
+        return apply_measurements(InspirationAnalysis(
+            lighting_setup=light['lighting_setup'],
+            primary_light_source=light['light_quality'],
+            light_quality=light['shadows'],
+            camera_angle="Not assessed in the quick analysis",
+            focal_length=not_recorded,
+            aperture=not_recorded,
+            shutter_speed=not_recorded,
+            iso=not_recorded,
+            focus_point="Subject",
+            steps=[
+                f"Set up {light['lighting_setup'].lower()}",
+                f"Match the {light['temperature']} tones with your white balance",
+                f"Expose for a similar result: {exposure.lower()}",
+            ],
+        ), insights)
+
+    sharpness = insights['sharpness']
+    strengths: List[str] = []
+    immediate: List[str] = []
+    practice: List[str] = []
+    if sharpness >= SHARP_THRESHOLD:
+        strengths.append("Sharp, well-focused detail")
+    if luminance['highlights_clipped'] <= 2 and luminance['shadows_clipped'] <= 5:
+        strengths.append("No significant clipping - highlight and shadow detail is preserved")
+    if 70 <= luminance['mean'] <= 185:
+        strengths.append("Overall exposure is in a healthy range")
+    if luminance['highlights_clipped'] > 2:
+        immediate.append("Reduce exposure by about 1/3 to 2/3 stop to recover highlights")
+    if luminance['mean'] < 70 or luminance['shadows_clipped'] > 5:
+        immediate.append("Add fill light or open up your exposure to lift the shadows")
+    if luminance['contrast'] > 70:
+        immediate.append("Soften the key light or add a reflector to tame contrast")
+    if sharpness < SOFT_THRESHOLD:
+        immediate.append("Use a faster shutter speed or a tripod, and check your focus point is on the subject")
+
+    # Skills to build over time, as opposed to the fixes for this shot above
+    if luminance['highlights_clipped'] > 2 or luminance['shadows_clipped'] > 5:
+        practice.append("Practise metering: check the histogram and highlight warnings after each test shot")
+    if luminance['contrast'] > 70:
+        practice.append("Practise reading lighting ratios by metering key and fill separately")
+    if sharpness < SOFT_THRESHOLD:
+        practice.append("Practise back-button focus and steady handholding, and learn your slowest sharp shutter speed")
+
+    recorded = [exif.get('aperture'), exif.get('shutter_speed'), 'iso' in exif and f"ISO {exif['iso']}", exif.get('focal_length')]
+    settings = ', '.join(value for value in recorded if value)
+    return apply_measurements(TechniqueAnalysis(
+        overall_rating="Not rated - this review covers the measured exposure, focus and settings",
+        strengths=strengths,
+        exposure=exposure,
+        focus=describe_focus(sharpness),
+        composition="",
+        immediate_improvements=immediate,
+        technique_improvements=practice,
+        camera_settings=f"Recorded settings: {settings}" if settings else "",
+    ), insights)
@@ -0,0 +1,296 @@
+"""Prometheus-style metrics for the web app
+
+Counters and histograms live in memory per process and are rendered in
+the Prometheus text exposition format by the /metrics route. Under
+gunicorn each worker also writes a snapshot of its metrics to a file in
+METRICS_DIR (default: instance/metrics) every METRICS_FLUSH_SECONDS, and
+the worker that answers a scrape adds up every snapshot, so the totals
+do not depend on which worker was asked.
+"""
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+# How often a worker publishes its snapshot for the other workers
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+# Seconds; spans the sub-millisecond cache paths up to slow vision calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names: Tuple[str, ...], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Metric:
+    """A named family of samples, one per combination of label values"""
+
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 collect: Optional[Callable[[], Dict[LabelValues, Any]]] = None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._values: Dict[LabelValues, Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self) -> Dict[LabelValues, Any]:
+        """Current values; a collected metric asks its source instead of keeping state"""
+        if self.collect is not None:
+            try:
+                return dict(self.collect())
+            except Exception as e:
+                logging.error(f"Metric {self.name} collection failed: {str(e)}")
+                return {}
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value: Any) -> Any:
+        return value
+
+    def merge(self, total: Any, value: Any) -> Any:
+        return total + value
+
+    def render(self, values: Dict[LabelValues, Any]) -> List[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self, values: Dict[LabelValues, Any]) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+                for key, value in sorted(values.items())]
+
+class Histogram(Metric):
+    """Fixed-bucket histogram; each sample is [per-bucket counts..., +Inf count, sum]"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[index] += 1
+            sample[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block, including when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _copy(self, value: Any) -> Any:
+        return list(value)
+
+    def merge(self, total: Any, value: Any) -> Any:
+        return [a + b for a, b in zip(total, value)]
+
+    def render(self, values: Dict[LabelValues, Any]) -> List[str]:
+        lines = []
+        for key, sample in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), sample):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(sample[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """All metrics of this process, optionally combined with sibling worker processes"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.directory: Optional[str] = None
+        self._flusher_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), **kwargs) -> Counter:
+        return self.register(Counter(name, help_text, labelnames, **kwargs))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, **kwargs))
+
+    def share_directory(self, directory: Optional[str]):
+        """Publish snapshots to, and merge them from, a directory shared by worker processes
+
+        Snapshots left by processes that no longer exist are removed, so a
+        restarted app starts counting from zero.
+        """
+        self.directory = directory or None
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for pid, path in self._snapshot_files():
+            if pid != os.getpid() and not process_alive(pid):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def ensure_flushing(self):
+        """Start this process's snapshot thread; cheap to call on every request, and safe after fork"""
+        if self.directory is None or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True).start()
+
+    def flush(self):
+        """Write this process's snapshot atomically"""
+        if self.directory is None:
+            return
+        snapshot = {name: [[list(key), value] for key, value in metric.snapshot().items()]
+                    for name, metric in self.metrics.items()}
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(temp_path, path)
+
+    def render(self) -> str:
+        """Prometheus text format of every metric, summed over all worker processes"""
+        combined = {name: metric.snapshot() for name, metric in self.metrics.items()}
+        for pid, path in self._snapshot_files():
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                values = combined[name]
+                for key, value in samples:
+                    key = tuple(key)
+                    values[key] = metric.merge(values[key], value) if key in values else value
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(combined[name]))
+        return '\n'.join(lines) + '\n'
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Metrics snapshot failed: {str(e)}")
+
+    def _snapshot_files(self) -> List[Tuple[int, str]]:
+        if self.directory is None:
+            return []
+        files = []
+        for filename in os.listdir(self.directory):
+            stem, extension = os.path.splitext(filename)
+            if extension == '.json' and stem.isdigit():
+                files.append((int(stem), os.path.join(self.directory, filename)))
+        return files
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# Process-wide registry and the metrics the app records
+registry = MetricsRegistry()
+
+request_latency = registry.histogram(
+    'shutter_synth_http_request_duration_seconds',
+    'HTTP request latency by route, until the last byte of the response',
+    ('route', 'method', 'status'))
+
+chat_stage_latency = registry.histogram(
+    'shutter_synth_chat_stage_duration_seconds',
+    'Latency of each stage of a chat turn and its analysis job',
+    ('stage',))
+
+chat_routing = registry.counter(
+    'shutter_synth_chat_routing_total',
+    'Routing decisions taken for chat messages; topic is set for follow-ups',
+    ('decision', 'topic'))
+
+openai_tokens = registry.counter(
+    'shutter_synth_openai_tokens_total',
+    'Tokens reported in OpenAI response usage',
+    ('model', 'kind'))
+
+_caches: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+def watch_cache(name: str, stats: Callable[[], Dict[str, Any]]):
+    """Export a cache's 'hits' and 'misses' from its stats() as cache lookup counters"""
+    _caches[name] = stats
+
+def _cache_lookups() -> Dict[LabelValues, Any]:
+    values = {}
+    for name, stats in list(_caches.items()):
+        counters = stats()
+        values[(name, 'hit')] = counters['hits']
+        values[(name, 'miss')] = counters['misses']
+    return values
+
+cache_lookups = registry.counter(
+    'shutter_synth_cache_lookups_total',
+    'Cache lookups by result; hit rate is hit / (hit + miss)',
+    ('cache', 'result'), collect=_cache_lookups)
+
+def configure_metrics(instance_path: str):
+    """Share metrics between workers through METRICS_DIR; set it empty to keep them per process"""
+    directory = os.environ.get("METRICS_DIR", os.path.join(instance_path, 'metrics'))
+    try:
+        registry.share_directory(directory)
+    except OSError as e:
+        logging.error(f"Metrics directory {directory} unavailable, serving this process only: {str(e)}")
+        registry.share_directory(None)
@@ -0,0 +1,66 @@
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+# db.create_all() only creates missing tables, so changes to existing tables
+# are applied here. Migrations run in order, once per database, and each one
+# checks the live schema first so it is a no-op on freshly created tables.
+
+def _add_user_gear_version(conn: Connection):
+    """Version counter bumped whenever a user's gear profile is saved"""
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+    if 'gear_version' not in columns:
+        conn.execute(text("ALTER TABLE users ADD COLUMN gear_version INTEGER NOT NULL DEFAULT 0"))
+
+def _add_hot_path_indexes(conn: Connection):
+    """Composite indexes for the session, history, gear and upload lookups"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_sessions_user_active ON chat_sessions (user_id, is_active)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_messages_session_timestamp ON chat_messages (session_id, timestamp)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_gear_items_user_category ON gear_items (user_id, category)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_uploaded_images_message_id ON uploaded_images (message_id)"))
+
+def _add_uploaded_image_derivatives(conn: Connection):
+    """Paths of the analysis and thumbnail images created at ingest"""
+    columns = {column['name'] for column in inspect(conn).get_columns('uploaded_images')}
+    if 'analysis_path' not in columns:
+        conn.execute(text("ALTER TABLE uploaded_images ADD COLUMN analysis_path VARCHAR(500)"))
+    if 'thumbnail_path' not in columns:
+        conn.execute(text("ALTER TABLE uploaded_images ADD COLUMN thumbnail_path VARCHAR(500)"))
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ('0001_user_gear_version', _add_user_gear_version),
+    ('0002_hot_path_indexes', _add_hot_path_indexes),
+    ('0003_uploaded_image_derivatives', _add_uploaded_image_derivatives),
+]
+
+def run_migrations(engine: Engine):
+    """Apply any migrations not yet recorded in schema_migrations"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (id VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT id FROM schema_migrations"))}
+
+    for migration_id, migrate in MIGRATIONS:
+        if migration_id in applied:
+            continue
+
+        try:
+            with engine.begin() as conn:
+                migrate(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (id, applied_at) VALUES (:id, :applied_at)"),
+                    {'id': migration_id, 'applied_at': datetime.utcnow()}
+                )
+            logging.info(f"Applied migration {migration_id}")
+        except Exception as e:
+            # Another worker booting at the same time may have applied it first
+            with engine.connect() as conn:
+                recorded = conn.execute(
+                    text("SELECT 1 FROM schema_migrations WHERE id = :id"), {'id': migration_id}
+                ).first()
+            if not recorded:
+                logging.error(f"Migration {migration_id} failed: {str(e)}")
+                raise
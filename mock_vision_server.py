@@ -0,0 +1,181 @@
+"""Local stand-in for the OpenAI chat completions API
+
+Serves canned inspiration/technique analyses so uploads can be exercised
+without network access or API cost, with knobs for latency and failures
+to test timeouts, retries and degraded mode.
+
+    python mock_vision_server.py --port 8765 --latency 0.5 --error-rate 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python main.py
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Tuple
+
+# Responses follow the schemas in analysis_schema.py
+INSPIRATION_ANALYSIS = {
+    "lighting_setup": "Softbox key with a white reflector filling from the right",
+    "primary_light_source": "Large soft key light camera left at 45 degrees",
+    "light_quality": "Soft, slightly warm",
+    "camera_angle": "Eye level",
+    "focal_length": "85mm",
+    "aperture": "f/2.8",
+    "shutter_speed": "1/200s",
+    "iso": "100",
+    "focus_point": "Nearest eye",
+    "steps": ["Place the softbox at 45 degrees", "Add the reflector opposite", "Meter for the highlights"]
+}
+
+TECHNIQUE_ANALYSIS = {
+    "overall_rating": "7/10 - solid basics, lighting needs more direction",
+    "strengths": ["Good eye contact", "Clean background"],
+    "exposure": "Slightly underexposed in the shadows",
+    "focus": "Sharp on the eyes",
+    "composition": "Balanced, with room to tighten the crop",
+    "immediate_improvements": ["Raise exposure by 2/3 stop"],
+    "technique_improvements": ["Move the key light further to the side"],
+    "camera_settings": "f/4 at 1/160s, ISO 200"
+}
+
+class MockVisionServer(ThreadingHTTPServer):
+    """HTTP server holding the mock's settings and a log of received requests"""
+
+    daemon_threads = True
+
+    # Accept bursts of connections from load tests without SYN retries
+    request_queue_size = 1024
+
+    def __init__(self, address: Tuple[str, int], latency: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 500, chunk_size: int = 40):
+        super().__init__(address, MockVisionHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.chunk_size = chunk_size
+        self.requests: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients that time out close the connection mid-response
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+class MockVisionHandler(BaseHTTPRequestHandler):
+    server: MockVisionServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json(200, {"object": "list", "data": [
+                {"id": "gpt-4o", "object": "model", "created": 0, "owned_by": "mock"}
+            ]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with self.server.lock:
+            self.server.requests.append(body)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if random.random() < self.server.error_rate:
+            self._send_json(self.server.error_status, {"error": {"message": "Mock upstream failure", "type": "server_error"}})
+            return
+
+        content = json.dumps(self._analysis_for(body))
+        if body.get('stream'):
+            self._send_stream(body, content)
+        else:
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get('model', 'gpt-4o'),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 800, "completion_tokens": 300, "total_tokens": 1100}
+            })
+
+    def _analysis_for(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Technique feedback for feedback prompts, inspiration otherwise"""
+        prompt = json.dumps(body.get('messages', [])).lower()
+        return TECHNIQUE_ANALYSIS if 'feedback' in prompt or 'constructive' in prompt else INSPIRATION_ANALYSIS
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, body: Dict[str, Any], content: str):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        size = self.server.chunk_size
+        for start in range(0, len(content), size):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get('model', 'gpt-4o'),
+                "choices": [{"index": 0, "delta": {"content": content[start:start + size]}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        if (body.get('stream_options') or {}).get('include_usage'):
+            # Like the real API: a last chunk with no choices carries the usage
+            usage_chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get('model', 'gpt-4o'),
+                "choices": [],
+                "usage": {"prompt_tokens": 800, "completion_tokens": 300, "total_tokens": 1100}
+            }
+            self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+def start_mock_server(port: int = 0, **settings) -> MockVisionServer:
+    """Start the mock on a background thread; port 0 picks a free port"""
+    server = MockVisionServer(('127.0.0.1', port), **settings)
+    threading.Thread(target=server.serve_forever, name="mock-vision", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of completions that fail')
+    parser.add_argument('--error-status', type=int, default=500)
+    args = parser.parse_args()
+
+    server = MockVisionServer(('127.0.0.1', args.port), latency=args.latency,
+                              error_rate=args.error_rate, error_status=args.error_status)
+    print(f"Mock vision server on {server.base_url}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
+import os
 from app import db
 from sqlalchemy import String, Integer, Text, DateTime, Boolean, JSON
+from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
 from typing import List, Optional
@@ -11,6 +13,7 @@ class User(db.Model):
     username: Mapped[str] = mapped_column(String(80), unique=True, nullable=False)
     skill_level: Mapped[str] = mapped_column(String(20), nullable=False, default='Beginner')  # Beginner, Intermediate, Advanced
     main_specialization: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)  # Primary photography type
+    gear_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')  # Bumped on every gear profile save
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -20,6 +23,9 @@ class User(db.Model):
 
 class GearItem(db.Model):
     __tablename__ = 'gear_items'
+    __table_args__ = (
+        db.Index('ix_gear_items_user_category', 'user_id', 'category'),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, db.ForeignKey('users.id'), nullable=False)
@@ -34,12 +40,15 @@ class GearItem(db.Model):
 
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
+    __table_args__ = (
+        db.Index('ix_chat_sessions_user_active', 'user_id', 'is_active'),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, db.ForeignKey('users.id'), nullable=False)
     session_token: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
     current_step: Mapped[Optional[int]] = mapped_column(Integer, default=0)  # For beginner step tracking
-    conversation_context: Mapped[Optional[dict]] = mapped_column(JSON)  # Store context as JSON
+    conversation_context: Mapped[Optional[dict]] = mapped_column(MutableDict.as_mutable(JSON))  # Small state dict, tracked per key (see session_state.py)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -50,6 +59,9 @@ class ChatSession(db.Model):
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        db.Index('ix_chat_messages_session_timestamp', 'session_id', 'timestamp'),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     session_id: Mapped[int] = mapped_column(Integer, db.ForeignKey('chat_sessions.id'), nullable=False)
@@ -67,14 +79,53 @@ class UploadedImage(db.Model):
     __tablename__ = 'uploaded_images'
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    message_id: Mapped[int] = mapped_column(Integer, db.ForeignKey('chat_messages.id'), nullable=False)
+    message_id: Mapped[int] = mapped_column(Integer, db.ForeignKey('chat_messages.id'), nullable=False, index=True)
     filename: Mapped[str] = mapped_column(String(255), nullable=False)
     original_filename: Mapped[str] = mapped_column(String(255), nullable=False)
     file_path: Mapped[str] = mapped_column(String(500), nullable=False)
     file_size: Mapped[int] = mapped_column(Integer, nullable=False)
     mime_type: Mapped[str] = mapped_column(String(100), nullable=False)
+    analysis_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)  # Normalized 1024px JPEG sent for analysis
+    thumbnail_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)  # Small JPEG shown in the chat
     analysis_result: Mapped[Optional[dict]] = mapped_column(JSON)  # Store AI analysis results
     uploaded_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationships
     message: Mapped["ChatMessage"] = relationship("ChatMessage", back_populates="uploaded_images")
+    
+    @property
+    def display_path(self) -> str:
+        """Image shown in the chat, relative to the static folder"""
+        return os.path.relpath(self.thumbnail_path or self.file_path, 'static')
+
+class AnalysisJob(db.Model):
+    __tablename__ = 'analysis_jobs'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_token: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
+    session_id: Mapped[int] = mapped_column(Integer, db.ForeignKey('chat_sessions.id'), nullable=False)
+    message_id: Mapped[int] = mapped_column(Integer, db.ForeignKey('chat_messages.id'), nullable=False)  # User message with the uploads
+    bot_message_id: Mapped[Optional[int]] = mapped_column(Integer, db.ForeignKey('chat_messages.id'), nullable=True)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    result: Mapped[Optional[dict]] = mapped_column(JSON)  # Response payload returned to the client
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    
+    # Relationships
+    session: Mapped["ChatSession"] = relationship("ChatSession")
+    message: Mapped["ChatMessage"] = relationship("ChatMessage", foreign_keys=[message_id])
+
+class AnalysisCacheEntry(db.Model):
+    __tablename__ = 'analysis_cache'
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    cache_key: Mapped[str] = mapped_column(String(64), unique=True, nullable=False)  # sha256 of image hash, analysis type and prompt version
+    image_hash: Mapped[str] = mapped_column(String(64), nullable=False)  # sha256 of the normalized JPEG sent to the vision model
+    analysis_type: Mapped[str] = mapped_column(String(20), nullable=False)
+    prompt_version: Mapped[str] = mapped_column(String(20), nullable=False)
+    analysis_result: Mapped[dict] = mapped_column(JSON, nullable=False)
+    hit_count: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_used_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,172 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+class RateLimit:
+    """Token bucket rule: `limit` requests per `window_seconds`, refilled continuously"""
+
+    def __init__(self, limit: int, window_seconds: float):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.refill_rate = limit / window_seconds
+
+    def consume(self, tokens: Optional[float], updated: Optional[float], now: float) -> Tuple[bool, float]:
+        """Apply one request to a bucket state, returning (allowed, remaining tokens)"""
+        if tokens is None:
+            tokens = float(self.limit)
+        else:
+            tokens = min(float(self.limit), tokens + (now - updated) * self.refill_rate)
+
+        if tokens < 1:
+            return False, tokens
+        return True, tokens - 1
+
+class MemoryRateLimitBackend:
+    """In-process bucket store with LRU eviction of idle keys"""
+
+    name = 'memory'
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, rule: RateLimit, now: float) -> bool:
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (None, None))
+            allowed, tokens = rule.consume(tokens, updated, now)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+
+            # Least recently used keys are the idle ones
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+class SQLiteRateLimitBackend:
+    """Bucket store in a SQLite file shared by every worker process on the host"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str, idle_seconds: float = 3600, cleanup_every: int = 1000):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._ops = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_limit_buckets_updated ON rate_limit_buckets (updated)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, rule: RateLimit, now: float) -> bool:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+            allowed, tokens = rule.consume(row[0] if row else None, row[1] if row else None, now)
+            conn.execute(
+                "INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+
+            self._ops += 1
+            if self._ops % self.cleanup_every == 0:
+                conn.execute("DELETE FROM rate_limit_buckets WHERE updated < ?", (now - self.idle_seconds,))
+
+            conn.execute("COMMIT")
+            return allowed
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def size(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM rate_limit_buckets").fetchone()[0]
+
+class RateLimiter:
+    """Per-route token bucket limiter over a pluggable backend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.rules: Dict[str, RateLimit] = {}
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def limit(self, rule_name: str, limit: int, window_seconds: float):
+        """Register the limit for a named route or group of routes"""
+        self.rules[rule_name] = RateLimit(limit, window_seconds)
+        self._counters.setdefault(rule_name, {'allowed': 0, 'limited': 0, 'errors': 0})
+
+    def check(self, rule_name: str, client_key: str) -> bool:
+        """Consume one request for a client; False if the rule's limit is exceeded"""
+        rule = self.rules[rule_name]
+        try:
+            allowed = self.backend.hit(f"{rule_name}:{client_key}", rule, time.time())
+        except Exception as e:
+            # Fail open - a broken limiter store should not take the chat down
+            logging.error(f"Rate limiter backend error: {str(e)}")
+            self._count(rule_name, 'errors')
+            return True
+
+        self._count(rule_name, 'allowed' if allowed else 'limited')
+        return allowed
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-rule allowed/limited counters for this process"""
+        with self._lock:
+            rules = {name: dict(counts) for name, counts in self._counters.items()}
+        try:
+            tracked_keys = self.backend.size()
+        except Exception:
+            tracked_keys = None
+        return {'backend': self.backend.name, 'tracked_keys': tracked_keys, 'rules': rules}
+
+    def _count(self, rule_name: str, counter: str):
+        with self._lock:
+            self._counters[rule_name][counter] += 1
+
+def client_address(environ: Dict[str, Any], trusted_proxies: int = 1) -> str:
+    """Client IP for rate limiting, honouring X-Forwarded-For only from trusted proxies
+
+    Each proxy appends the address it received the request from, so with N
+    trusted proxies the client is the Nth entry from the right. Anything to
+    the left of that can be forged by the client.
+    """
+    remote_addr = environ.get('REMOTE_ADDR') or '127.0.0.1'
+    forwarded_for = environ.get('HTTP_X_FORWARDED_FOR')
+    if not forwarded_for or trusted_proxies <= 0:
+        return remote_addr
+
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    if not hops:
+        return remote_addr
+    return hops[-min(trusted_proxies, len(hops))]
+
+def create_rate_limiter(instance_path: str) -> RateLimiter:
+    """Build the limiter from RATE_LIMIT_BACKEND ('sqlite' or 'memory')"""
+    backend_name = os.environ.get("RATE_LIMIT_BACKEND", "sqlite")
+    if backend_name == 'memory':
+        backend = MemoryRateLimitBackend(max_keys=int(os.environ.get("RATE_LIMIT_MAX_KEYS", "10000")))
+    else:
+        path = os.environ.get("RATE_LIMIT_DB", os.path.join(instance_path, 'rate_limits.db'))
+        backend = SQLiteRateLimitBackend(path)
+    return RateLimiter(backend)
@@ -0,0 +1,112 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, Any, Hashable, Optional
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "1024"))
+
+# Gear placeholders used in the knowledge base, e.g. "Use your [LENS] for..."
+PLACEHOLDER_PATTERN = re.compile(r'\[(CAMERA|LENS|LIGHTING)\]')
+
+class CompiledTemplate:
+    """Knowledge base text pre-split around its gear placeholders"""
+
+    def __init__(self, text: str):
+        self.parts: List[str] = PLACEHOLDER_PATTERN.split(text)
+        self.placeholders = frozenset(self.parts[1::2])
+
+    @classmethod
+    def from_parts(cls, parts: List[str]) -> 'CompiledTemplate':
+        """Template from text already split around its placeholders"""
+        template = cls.__new__(cls)
+        template.parts = parts
+        template.placeholders = frozenset(parts[1::2])
+        return template
+
+    def render(self, values: Dict[str, str]) -> str:
+        """Fill placeholders; ones without a value are left as written"""
+        if not self.placeholders:
+            return self.parts[0]
+        rendered = list(self.parts)
+        for i in range(1, len(rendered), 2):
+            name = rendered[i]
+            rendered[i] = values.get(name, f"[{name}]")
+        return ''.join(rendered)
+
+@lru_cache(maxsize=4096)
+def compile_template(text: str) -> CompiledTemplate:
+    """Compile a template once per distinct knowledge base string"""
+    return CompiledTemplate(text)
+
+def gear_fingerprint(matched_gear: Optional[Dict[str, List[Any]]]) -> Optional[str]:
+    """Stable digest of the gear that can appear in a rendered response"""
+    if matched_gear is None:
+        return None
+    # Snapshots carry a precomputed fingerprint
+    fingerprint = getattr(matched_gear, 'fingerprint', None)
+    if fingerprint is not None:
+        return fingerprint
+    digest = hashlib.sha1()
+    for category in sorted(matched_gear):
+        for item in matched_gear[category]:
+            digest.update(f"{category}\x1f{item.brand}\x1f{item.model}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+class ResponseCache:
+    """Thread-safe LRU cache of rendered response content.
+
+    Keys are (kind, scenario, skill level, step, topic, gear fingerprint)
+    tuples, so a user whose gear changes simply stops hitting old entries.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> str:
+        """Return the cached content for a key, rendering it on a miss"""
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return content
+            self._misses += 1
+
+        content = render()
+
+        with self._lock:
+            self._entries[key] = content
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return content
+
+    def invalidate_gear(self, fingerprint: Optional[str]):
+        """Drop every entry rendered for a gear fingerprint"""
+        if fingerprint is None:
+            return
+        with self._lock:
+            for key in [key for key in self._entries if key[-1] == fingerprint]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'entries': len(self._entries),
+                'hit_rate': self._hits / lookups if lookups else 0.0
+            }
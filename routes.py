@@ -1,13 +1,25 @@
-from flask import render_template, request, redirect, url_for, session, flash, jsonify
+from flask import render_template, request, redirect, url_for, session, flash, jsonify, g, Response, stream_with_context
 from werkzeug.utils import secure_filename
+from sqlalchemy import insert, update
 from app import app, db
-from models import User, GearItem, ChatSession, ChatMessage, UploadedImage
+from models import User, ChatSession, ChatMessage, UploadedImage
 from chat_engine import SynthiaChatEngine
+from analysis_jobs import AnalysisJobQueue
+from rate_limiter import create_rate_limiter, client_address
+from gear_profile import parse_gear_form, load_user_gear, group_gear, save_gear_profile, GearSnapshotCache
+from image_ingest import ImageIngestPool, UploadTooLarge, save_upload_stream
+from session_state import merge_context, UserStateCache
+from chat_history import load_history_page, decode_cursor, serialize_message, HISTORY_PAGE_SIZE, MAX_HISTORY_PAGE_SIZE
+from metrics import registry as metrics_registry, configure_metrics, watch_cache, request_latency, chat_stage_latency
 import uuid
+import hmac
+import json
 import logging
 import os
+import queue
+import re
 import time
-from collections import defaultdict
+from functools import partial
 
 # Configure upload settings
 UPLOAD_FOLDER = 'static/uploads'
@@ -24,24 +36,67 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 # Initialize chat engine
 chat_engine = SynthiaChatEngine()
 
-# Simple rate limiting storage (in production, use Redis or similar)
-rate_limit_storage = defaultdict(list)
+# Per-user gear snapshots, refreshed when User.gear_version changes
+gear_snapshots = GearSnapshotCache()
 
-def check_rate_limit(ip_address, limit=5, window_seconds=60):
-    """Simple rate limiting: 5 requests per 60 seconds per IP"""
-    now = time.time()
-    requests = rate_limit_storage[ip_address]
-    
-    # Remove old requests outside the window
-    requests[:] = [req_time for req_time in requests if now - req_time < window_seconds]
-    
-    # Check if limit exceeded
-    if len(requests) >= limit:
-        return False
-    
-    # Add current request
-    requests.append(now)
-    return True
+# Signed-in user's profile and active session, refreshed on writes and after a short TTL
+user_states = UserStateCache()
+
+# Background pool for slow image analyses; jobs orphaned by a previous worker are failed at startup
+analysis_queue = AnalysisJobQueue(app)
+with app.app_context():
+    analysis_queue.expire_stale_jobs()
+
+# Worker processes that decode uploads into analysis and thumbnail derivatives
+ingest_pool = ImageIngestPool()
+
+# Rate limiting shared by all worker processes (see RATE_LIMIT_BACKEND)
+rate_limiter = create_rate_limiter(app.instance_path)
+rate_limiter.limit('chat', 5, 60)  # /chat/send and /chat/stream
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', '1'))
+
+# Prometheus metrics summed over all worker processes (see METRICS_DIR)
+configure_metrics(app.instance_path)
+watch_cache('response', chat_engine.response_cache.stats)
+watch_cache('analysis', chat_engine.image_analysis_service.cache.stats)
+watch_cache('gear_snapshot', gear_snapshots.stats)
+watch_cache('user_state', user_states.stats)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Bearer token required by /metrics when set
+
+def check_rate_limit(rule_name):
+    """Apply a named rate limit to the current client"""
+    return rate_limiter.check(rule_name, client_address(request.environ, TRUSTED_PROXIES))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Observe the request's latency once its body, streamed or not, has been sent"""
+    started = g.get('request_started')
+    if started is not None:
+        labels = {
+            # The URL rule, not the path, so job tokens and static files do not each get a series
+            'route': request.url_rule.rule if request.url_rule else 'unmatched',
+            'method': request.method,
+            'status': response.status_code
+        }
+        response.call_on_close(lambda: request_latency.observe(time.perf_counter() - started, **labels))
+    metrics_registry.ensure_flushing()
+    return response
+
+def current_user_state():
+    """The signed-in user's cached state, looked up once per request (None if the user is gone)"""
+    if 'user_state' not in g:
+        g.user_state = user_states.get(session['user_id'], session.get('state_revision', 0))
+    return g.user_state
+
+def invalidate_user_state():
+    """Drop the cached state after a write; the cookie revision makes every worker reload it"""
+    user_states.invalidate(session['user_id'])
+    session['state_revision'] = session.get('state_revision', 0) + 1
+    g.pop('user_state', None)
 
 def allowed_file(filename):
     """Check if uploaded file has allowed extension and is safe"""
@@ -59,6 +114,130 @@ def allowed_file(filename):
     extension = filename.rsplit('.', 1)[1].lower()
     return extension in ALLOWED_EXTENSIONS
 
+def add_user_message(chat_session, content, upload_rows):
+    """Add the user message and its uploads to the current transaction (caller commits)
+    
+    Uploads are bulk-inserted in one statement after a flush assigns the
+    message id; a text turn's message is simply written by the commit that
+    saves the bot response.
+    """
+    user_message = ChatMessage()
+    user_message.session_id = chat_session.id
+    user_message.message_type = 'user'
+    user_message.content = content
+    db.session.add(user_message)
+    if upload_rows:
+        db.session.flush()
+        db.session.execute(insert(UploadedImage), [dict(row, message_id=user_message.id) for row in upload_rows])
+    return user_message
+
+def discard_uploads(upload_rows):
+    """Remove files written for a chat message that will not be saved"""
+    for row in upload_rows:
+        try:
+            os.remove(row['file_path'])
+        except OSError as e:
+            logging.error(f"Error removing upload {row['file_path']}: {str(e)}")
+
+def save_bot_response(chat_session, response_data):
+    """Add the bot message and merge the new context into the chat session (caller commits)"""
+    bot_message = ChatMessage()
+    bot_message.session_id = chat_session.id
+    bot_message.message_type = 'bot'
+    bot_message.content = response_data['content']
+    bot_message.step_number = response_data.get('step_number')
+    bot_message.message_metadata = response_data.get('metadata')
+    db.session.add(bot_message)
+    
+    # Update session context
+    chat_session.current_step = response_data.get('next_step', chat_session.current_step)
+    
+    # Merge only the keys that changed into the tracked context
+    merge_context(chat_session, response_data.get('context'))
+    
+    return bot_message
+
+def queue_analysis_job(turn):
+    """Add the turn's analysis job and commit the turn; the caller starts the job"""
+    job = analysis_queue.create_job(turn['chat_session'].id, turn['user_message'].id)
+    job_token = job.job_token
+    with chat_stage_latency.time(stage='db_commit'):
+        db.session.commit()  # Message, uploads and job in one transaction
+    return job_token
+
+def job_accepted_payload(job_token, uploaded_image_count):
+    """Build the 202 JSON body pointing the chat UI at a queued analysis job"""
+    return {
+        'job_id': job_token,
+        'status': 'queued',
+        'status_url': url_for('analysis_job_status', job_token=job_token),
+        'uploaded_images': uploaded_image_count
+    }
+
+def response_payload(response_data, uploaded_image_count):
+    """Build the JSON body returned to the chat UI for a bot response"""
+    return {
+        'response': response_data['content'],
+        'step_number': response_data.get('step_number'),
+        'awaiting_continuation': response_data.get('awaiting_continuation', False),
+        'uploaded_images': uploaded_image_count
+    }
+
+def sse_event(event, data):
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def split_response_sections(content):
+    """Split a bot response into paragraph sections for incremental rendering"""
+    return [section for section in re.split(r'(?<=\n\n)', content) if section]
+
+def prepare_analysis_job(job):
+    """Decode a job's uploads and plan its analysis; the ASGI mode then runs the analysis on its event loop"""
+    uploaded_images = list(job.message.uploaded_images)
+    ingest_pool.ensure_derivatives(uploaded_images)
+    return chat_engine.plan_image_analysis(job.message.content, uploaded_images)
+
+def process_analysis_job(job, on_delta=None, analysis_results=None):
+    """Run image analysis for a queued job and persist the bot response
+    
+    analysis_results skips the analysis when it was already run elsewhere
+    (see prepare_analysis_job).
+    """
+    chat_session = job.session
+    user_message = job.message
+    user = chat_session.user
+    uploaded_images = list(user_message.uploaded_images)
+    
+    # Decode each upload once, off the request thread, into its derivatives; committing
+    # them now means no write lock is held while the vision model answers
+    if ingest_pool.ensure_derivatives(uploaded_images):
+        db.session.commit()
+    
+    # Analyze first so building the response is timed on its own
+    if analysis_results is None:
+        analysis_type, image_paths, exif_paths, local_only = chat_engine.plan_image_analysis(user_message.content, uploaded_images)
+        analysis_results = chat_engine.image_analysis_service.analyze_photography_images(
+            image_paths, analysis_type, on_delta, local_only, exif_paths
+        )
+    
+    user_gear = gear_snapshots.get(user)
+    with chat_stage_latency.time(stage='response_build'):
+        response_data = chat_engine.generate_response(
+            user_message.content,
+            user.skill_level,
+            user_gear,
+            chat_session,
+            uploaded_images,
+            user.main_specialization,
+            analysis_results=analysis_results
+        )
+    
+    bot_message = save_bot_response(chat_session, response_data)
+    db.session.flush()
+    job.bot_message_id = bot_message.id
+    
+    return response_payload(response_data, len(uploaded_images))
+
 @app.route('/')
 def index():
     """Home page"""
@@ -129,110 +308,32 @@ def gear_input():
     if 'user_id' not in session:
         return redirect(url_for('onboarding'))
     
-    user = User.query.get(session['user_id'])
+    user = current_user_state()
     if not user:
         session.clear()
         return redirect(url_for('onboarding'))
     
     if request.method == 'POST':
         # Process gear input
-        gear_data = request.form.to_dict()
-        
-        # Clear existing gear for this user
-        GearItem.query.filter_by(user_id=user.id).delete()
-        
-        # Process camera bodies (multiple cameras supported)
-        camera_index = 0
-        while True:
-            camera_brand = gear_data.get(f'camera_brand_{camera_index}')
-            camera_model = gear_data.get(f'camera_model_{camera_index}')
-            
-            if not camera_brand or not camera_model:
-                break
-                
-            camera = GearItem()
-            camera.user_id = user.id
-            camera.category = 'camera_body'
-            camera.brand = camera_brand
-            camera.model = camera_model
-            db.session.add(camera)
-            camera_index += 1
-        
-        # Process lenses
-        lens_count = int(gear_data.get('lens_count', 0))
-        for i in range(lens_count):
-            lens_brand = gear_data.get(f'lens_brand_{i}')
-            lens_model = gear_data.get(f'lens_model_{i}')
-            if lens_brand and lens_model:
-                lens_specs = {
-                    'aperture_range': gear_data.get(f'lens_aperture_{i}', ''),
-                    'type': gear_data.get(f'lens_type_{i}', 'prime')
-                }
-                lens = GearItem()
-                lens.user_id = user.id
-                lens.category = 'lens'
-                lens.brand = lens_brand
-                lens.model = lens_model
-                lens.specifications = lens_specs
-                db.session.add(lens)
-        
-        # Process lighting equipment
-        lighting_count = int(gear_data.get('lighting_count', 0))
-        for i in range(lighting_count):
-            lighting_brand = gear_data.get(f'lighting_brand_{i}')
-            lighting_model = gear_data.get(f'lighting_model_{i}')
-            if lighting_brand and lighting_model:
-                lighting_specs = {
-                    'type': gear_data.get(f'lighting_type_{i}', ''),
-                    'power': gear_data.get(f'lighting_power_{i}', ''),
-                    'quantity': gear_data.get(f'lighting_quantity_{i}', '1')
-                }
-                lighting = GearItem()
-                lighting.user_id = user.id
-                lighting.category = 'lighting'
-                lighting.brand = lighting_brand
-                lighting.model = lighting_model
-                lighting.specifications = lighting_specs
-                db.session.add(lighting)
+        submitted_gear = parse_gear_form(request.form.to_dict())
+        existing_gear = load_user_gear(user.id)
         
-        # Process backdrops
-        backdrop_count = int(gear_data.get('backdrop_count', 0))
-        for i in range(backdrop_count):
-            backdrop_brand = gear_data.get(f'backdrop_brand_{i}')
-            backdrop_model = gear_data.get(f'backdrop_model_{i}')
-            if backdrop_brand and backdrop_model:
-                backdrop = GearItem()
-                backdrop.user_id = user.id
-                backdrop.category = 'backdrop'
-                backdrop.brand = backdrop_brand
-                backdrop.model = backdrop_model
-                db.session.add(backdrop)
+        # Drop cached responses rendered for the gear being replaced
+        chat_engine.invalidate_gear_cache(existing_gear)
         
-        # Process accessories
-        accessory_count = int(gear_data.get('accessory_count', 0))
-        for i in range(accessory_count):
-            accessory_brand = gear_data.get(f'accessory_brand_{i}')
-            accessory_model = gear_data.get(f'accessory_model_{i}')
-            if accessory_brand and accessory_model:
-                accessory = GearItem()
-                accessory.user_id = user.id
-                accessory.category = 'accessory'
-                accessory.brand = accessory_brand
-                accessory.model = accessory_model
-                db.session.add(accessory)
+        # Write only the rows that changed
+        changes = save_gear_profile(user.id, submitted_gear, existing_gear)
+        if any(changes.values()):
+            db.session.execute(update(User).where(User.id == user.id).values(gear_version=User.gear_version + 1))
         
         db.session.commit()
+        gear_snapshots.invalidate(user.id)
+        invalidate_user_state()
         flash('Gear profile saved successfully!', 'success')
         return redirect(url_for('chat'))
     
     # Get existing gear for pre-population
-    existing_gear = {
-        'camera_bodies': GearItem.query.filter_by(user_id=user.id, category='camera_body').all(),
-        'lenses': GearItem.query.filter_by(user_id=user.id, category='lens').all(),
-        'lighting': GearItem.query.filter_by(user_id=user.id, category='lighting').all(),
-        'backdrops': GearItem.query.filter_by(user_id=user.id, category='backdrop').all(),
-        'accessories': GearItem.query.filter_by(user_id=user.id, category='accessory').all()
-    }
+    existing_gear = group_gear(load_user_gear(user.id))
     
     return render_template('gear_input.html', user=user, existing_gear=existing_gear)
 
@@ -242,43 +343,78 @@ def chat():
     if 'user_id' not in session:
         return redirect(url_for('onboarding'))
     
-    user = User.query.get(session['user_id'])
+    user = current_user_state()
     if not user:
         session.clear()
         return redirect(url_for('onboarding'))
     
     # Get or create active chat session
-    active_session = ChatSession.query.filter_by(user_id=user.id, is_active=True).first()
-    if not active_session:
+    if not user.active_session_id:
         session_token = str(uuid.uuid4())
         active_session = ChatSession()
         active_session.user_id = user.id
         active_session.session_token = session_token
         db.session.add(active_session)
         db.session.commit()
+        invalidate_user_state()
+        user = current_user_state()
     
-    # Get recent messages
-    recent_messages = ChatMessage.query.filter_by(session_id=active_session.id).order_by(ChatMessage.timestamp).limit(50).all()
+    # Get the newest page of messages; older pages are fetched from /chat/history
+    recent_messages, history_cursor = load_history_page(user.active_session_id)
     
-    return render_template('chat.html', user=user, session_token=active_session.session_token, messages=recent_messages)
+    return render_template('chat.html', user=user, session_token=user.active_session_token,
+                           messages=recent_messages, history_cursor=history_cursor)
 
-@app.route('/chat/send', methods=['POST'])
-def send_message():
-    """Handle chat message submission with rate limiting"""
+@app.route('/chat/history')
+def chat_history():
+    """Page backwards through a chat session's messages"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    chat_session = ChatSession.query.filter_by(
+        session_token=request.args.get('session_token'), user_id=session['user_id']
+    ).first()
+    if not chat_session:
+        return jsonify({'error': 'Invalid session'}), 400
+    
+    before = None
+    if request.args.get('before'):
+        before = decode_cursor(request.args['before'])
+        if before is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), MAX_HISTORY_PAGE_SIZE)
+    messages, next_cursor = load_history_page(chat_session.id, before, limit)
+    
+    return jsonify({
+        'messages': [serialize_message(message) for message in messages],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+def receive_chat_message():
+    """Validate a chat submission with rate limiting and add the user message and uploads to the transaction
+    
+    Returns (turn, None) on success or (None, error_response) on failure
+    """
     # Apply rate limiting
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', '127.0.0.1'))
-    if not check_rate_limit(client_ip):
-        return jsonify({
+    with chat_stage_latency.time(stage='rate_limit'):
+        allowed = check_rate_limit('chat')
+    if not allowed:
+        return None, (jsonify({
             'error': 'Rate limit exceeded. Please wait before sending another message.',
             'status': 'rate_limited'
-        }), 429
+        }), 429)
     
     if 'user_id' not in session:
-        return jsonify({'error': 'Not authenticated'}), 401
+        return None, (jsonify({'error': 'Not authenticated'}), 401)
     
-    user = User.query.get(session['user_id'])
+    # The user and chat session lookups together make the auth_lookup stage
+    lookup_started = time.perf_counter()
+    user = current_user_state()
+    lookup_seconds = time.perf_counter() - lookup_started
     if not user:
-        return jsonify({'error': 'User not found'}), 404
+        return None, (jsonify({'error': 'User not found'}), 404)
     
     # Handle both JSON and form data (for file uploads)
     if request.content_type and 'multipart/form-data' in request.content_type:
@@ -294,31 +430,29 @@ def send_message():
     # Validate message content length and content
     if message_content:
         if len(message_content) > 5000:  # Reasonable message limit
-            return jsonify({'error': 'Message too long (max 5000 characters)'}), 400
+            return None, (jsonify({'error': 'Message too long (max 5000 characters)'}), 400)
         
         # Basic XSS prevention - escape HTML if needed
         # Jinja2 auto-escapes by default, but additional validation here
         if '<script>' in message_content.lower() or 'javascript:' in message_content.lower():
-            return jsonify({'error': 'Invalid message content'}), 400
+            return None, (jsonify({'error': 'Invalid message content'}), 400)
     
     if not message_content and not uploaded_files:
-        return jsonify({'error': 'Message content or image is required'}), 400
+        return None, (jsonify({'error': 'Message content or image is required'}), 400)
     
-    # Find chat session
-    chat_session = ChatSession.query.filter_by(session_token=session_token, user_id=user.id).first()
+    # Find chat session; the active one is fetched by primary key
+    lookup_started = time.perf_counter()
+    if session_token and session_token == user.active_session_token:
+        chat_session = db.session.get(ChatSession, user.active_session_id)
+    else:
+        chat_session = ChatSession.query.filter_by(session_token=session_token, user_id=user.id).first()
+    chat_stage_latency.observe(lookup_seconds + time.perf_counter() - lookup_started, stage='auth_lookup')
     if not chat_session:
-        return jsonify({'error': 'Invalid session'}), 400
-    
-    # Save user message
-    user_message = ChatMessage()
-    user_message.session_id = chat_session.id
-    user_message.message_type = 'user'
-    user_message.content = message_content or "Uploaded image for analysis"
-    db.session.add(user_message)
-    db.session.commit()  # Commit to get message ID
+        return None, (jsonify({'error': 'Invalid session'}), 400)
     
-    # Handle file uploads
-    uploaded_images = []
+    # Write uploads to disk first so a failed upload leaves nothing to roll back
+    upload_rows = []
+    upload_started = time.perf_counter()
     for file in uploaded_files:
         if file and file.filename and allowed_file(file.filename):
             try:
@@ -337,73 +471,168 @@ def send_message():
                 # Ensure upload directory exists and is secure
                 os.makedirs(app.config['UPLOAD_FOLDER'], mode=0o755, exist_ok=True)
                 
-                # Check file size before saving
-                file.seek(0, os.SEEK_END)
-                file_size = file.tell()
-                file.seek(0)
-                
-                if file_size > MAX_FILE_SIZE:
-                    logging.error(f"File too large: {file_size} bytes")
-                    return jsonify({'error': 'File size exceeds 16MB limit'}), 413
-                
-                # Save file with restrictive permissions
-                file.save(file_path)
+                # Stream the file to disk, enforcing the size limit as it is written
+                try:
+                    file_size = save_upload_stream(file.stream, file_path, MAX_FILE_SIZE)
+                except UploadTooLarge:
+                    logging.error(f"File too large: {filename}")
+                    discard_uploads(upload_rows)
+                    return None, (jsonify({'error': 'File size exceeds 16MB limit'}), 413)
                 os.chmod(file_path, 0o644)  # Read-only for group/others
                 
-                # Create UploadedImage record
-                uploaded_image = UploadedImage()
-                uploaded_image.message_id = user_message.id
-                uploaded_image.filename = unique_filename
-                uploaded_image.original_filename = filename
-                uploaded_image.file_path = file_path
-                uploaded_image.file_size = os.path.getsize(file_path)
-                uploaded_image.mime_type = file.content_type or 'image/jpeg'
-                
-                db.session.add(uploaded_image)
-                uploaded_images.append(uploaded_image)
+                # UploadedImage row, inserted with the message
+                upload_rows.append({
+                    'filename': unique_filename,
+                    'original_filename': filename,
+                    'file_path': file_path,
+                    'file_size': file_size,
+                    'mime_type': file.content_type or 'image/jpeg'
+                })
                 
             except Exception as e:
                 logging.error(f"Error saving uploaded file: {str(e)}")
-                return jsonify({'error': 'Failed to save uploaded image'}), 500
-    
-    # Generate bot response
-    user_gear = GearItem.query.filter_by(user_id=user.id).all()
-    response_data = chat_engine.generate_response(
-        message_content,
-        user.skill_level,
-        user_gear,
-        chat_session,
-        uploaded_images,
-        user.main_specialization
+                discard_uploads(upload_rows)
+                return None, (jsonify({'error': 'Failed to save uploaded image'}), 500)
+    if upload_rows:
+        chat_stage_latency.observe(time.perf_counter() - upload_started, stage='upload_save')
+    
+    user_message = add_user_message(chat_session, message_content or "Uploaded image for analysis", upload_rows)
+    
+    return {
+        'user': user,
+        'chat_session': chat_session,
+        'message_content': message_content,
+        'user_message': user_message,
+        'upload_rows': upload_rows
+    }, None
+
+@app.route('/chat/send', methods=['POST'])
+def send_message():
+    """Handle chat message submission with rate limiting"""
+    turn, error_response = receive_chat_message()
+    if error_response:
+        return error_response
+    
+    # Image analysis can take several seconds, so hand it to the worker pool
+    if turn['upload_rows']:
+        job_token = queue_analysis_job(turn)
+        analysis_queue.submit(job_token, process_analysis_job)
+        
+        return jsonify(job_accepted_payload(job_token, len(turn['upload_rows']))), 202
+    
+    return jsonify(generate_chat_response(turn))
+
+def generate_chat_response(turn):
+    """Generate and persist the bot response to a text chat message"""
+    user = turn['user']
+    chat_session = turn['chat_session']
+    
+    user_gear = gear_snapshots.get(user)
+    with chat_stage_latency.time(stage='response_build'):
+        response_data = chat_engine.generate_response(
+            turn['message_content'],
+            user.skill_level,
+            user_gear,
+            chat_session,
+            [],  # Turns with uploads go through process_analysis_job
+            user.main_specialization
+        )
+    
+    save_bot_response(chat_session, response_data)
+    with chat_stage_latency.time(stage='db_commit'):
+        db.session.commit()  # User message, bot message and session state in one transaction
+    
+    return response_payload(response_data, 0)
+
+@app.route('/chat/stream', methods=['POST'])
+def stream_message():
+    """Handle chat message submission, streaming the response as Server-Sent Events"""
+    turn, error_response = receive_chat_message()
+    if error_response:
+        return error_response
+    
+    if turn['upload_rows']:
+        # Analysis runs on the worker pool; its model output is relayed as it arrives
+        job_token = queue_analysis_job(turn)
+        deltas = queue.Queue()
+        future = analysis_queue.submit(job_token, partial(process_analysis_job, on_delta=deltas.put))
+        events = stream_analysis_job(job_token, future, deltas)
+    else:
+        events = stream_chat_response(generate_chat_response(turn))
+    
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
     )
+
+def stream_chat_response(payload):
+    """Yield an already persisted chat response section by section"""
+    for section in split_response_sections(payload['response']):
+        yield sse_event('section', {'content': section})
+    
+    payload = dict(payload)
+    del payload['response']
+    yield sse_event('done', payload)
+
+def stream_analysis_job(job_token, future, deltas):
+    """Yield streamed model output for an analysis job, then the rendered response"""
+    yield sse_event('status', {'job_id': job_token, 'status': 'queued'})
+    
+    while True:
+        try:
+            delta = deltas.get(timeout=0.25)
+        except queue.Empty:
+            if future.done() and deltas.empty():
+                break
+            continue
+        yield sse_event('analysis_delta', {'text': delta})
     
-    # Save bot response
-    bot_message = ChatMessage()
-    bot_message.session_id = chat_session.id
-    bot_message.message_type = 'bot'
-    bot_message.content = response_data['content']
-    bot_message.step_number = response_data.get('step_number')
-    bot_message.message_metadata = response_data.get('metadata')
-    db.session.add(bot_message)
+    payload = future.result()
+    if not payload:
+        yield sse_event('error', {'job_id': job_token, 'error': 'Image analysis failed. Please try again.'})
+        return
     
-    # Update session context
-    chat_session.current_step = response_data.get('next_step', chat_session.current_step)
+    for section in split_response_sections(payload['response']):
+        yield sse_event('section', {'content': section})
     
-    # Merge context properly - preserve existing context and add new context
-    new_context = response_data.get('context', {})
-    if chat_session.conversation_context:
-        chat_session.conversation_context.update(new_context)
-    else:
-        chat_session.conversation_context = new_context
+    payload = dict(payload, job_id=job_token)
+    del payload['response']
+    yield sse_event('done', payload)
+
+@app.route('/chat/jobs/<job_token>')
+def analysis_job_status(job_token):
+    """Report the status of a background image analysis job"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    db.session.commit()
+    job = analysis_queue.get_job(job_token)
+    if not job or job.session.user_id != session['user_id']:
+        return jsonify({'error': 'Job not found'}), 404
     
-    return jsonify({
-        'response': response_data['content'],
-        'step_number': response_data.get('step_number'),
-        'awaiting_continuation': response_data.get('awaiting_continuation', False),
-        'uploaded_images': len(uploaded_images)
-    })
+    # A job whose worker died is never finished; report it instead of leaving the client polling
+    if analysis_queue.is_stale(job):
+        analysis_queue.expire_stale_jobs()
+        db.session.refresh(job)
+    
+    if job.status == 'completed':
+        return jsonify(dict(job.result or {}, job_id=job.job_token, status=job.status))
+    
+    if job.status == 'failed':
+        return jsonify({
+            'job_id': job.job_token,
+            'status': job.status,
+            'error': 'Image analysis failed. Please try again.'
+        })
+    
+    return jsonify({'job_id': job.job_token, 'status': job.status})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return jsonify({'error': 'Not authenticated'}), 401
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/profile', methods=['GET', 'POST'])
 def profile():
@@ -411,7 +640,7 @@ def profile():
     if 'user_id' not in session:
         return redirect(url_for('onboarding'))
     
-    user = User.query.get(session['user_id'])
+    user = current_user_state()
     if not user:
         session.clear()
         return redirect(url_for('onboarding'))
@@ -419,25 +648,22 @@ def profile():
     if request.method == 'POST':
         new_skill_level = request.form.get('skill_level')
         new_specialization = request.form.get('main_specialization')
+        account = db.session.get(User, user.id)
         
         if new_skill_level in ['Beginner', 'Intermediate', 'Advanced']:
-            user.skill_level = new_skill_level
+            account.skill_level = new_skill_level
             session['skill_level'] = new_skill_level
             
         if new_specialization:
-            user.main_specialization = new_specialization
+            account.main_specialization = new_specialization
             
         db.session.commit()
+        invalidate_user_state()
+        user = current_user_state()
         flash('Profile updated successfully!', 'success')
     
     # Get user's gear summary
-    gear_summary = {
-        'camera_bodies': GearItem.query.filter_by(user_id=user.id, category='camera_body').count(),
-        'lenses': GearItem.query.filter_by(user_id=user.id, category='lens').count(),
-        'lighting': GearItem.query.filter_by(user_id=user.id, category='lighting').count(),
-        'backdrops': GearItem.query.filter_by(user_id=user.id, category='backdrop').count(),
-        'accessories': GearItem.query.filter_by(user_id=user.id, category='accessory').count()
-    }
+    gear_summary = gear_snapshots.get(user).summary()
     
     return render_template('profile.html', user=user, gear_summary=gear_summary)
 
@@ -447,7 +673,7 @@ def new_session():
     if 'user_id' not in session:
         return redirect(url_for('onboarding'))
     
-    user = User.query.get(session['user_id'])
+    user = current_user_state()
     if not user:
         session.clear()
         return redirect(url_for('onboarding'))
@@ -455,6 +681,7 @@ def new_session():
     # Deactivate current sessions
     ChatSession.query.filter_by(user_id=user.id, is_active=True).update({'is_active': False})
     db.session.commit()
+    invalidate_user_state()
     
     return redirect(url_for('chat'))
 
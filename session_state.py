@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+from sqlalchemy import select
+from app import db
+from models import User, ChatSession
+
+# Largest encoded conversation_context we will store
+CONTEXT_MAX_BYTES = int(os.environ.get("CONVERSATION_CONTEXT_MAX_BYTES", "2048"))
+
+# Keys the conversation cannot continue without; never dropped to fit the cap
+ESSENTIAL_KEYS = ('current_scenario', 'photography_style', 'skip_lighting', 'gear_fingerprint')
+
+# Seconds a cached user state is trusted before it is reloaded
+USER_STATE_TTL = float(os.environ.get("USER_STATE_TTL", "30"))
+USER_STATE_CACHE_SIZE = int(os.environ.get("USER_STATE_CACHE_SIZE", "10000"))
+
+# Keys older sessions stored by copy; removed the next time the context is written
+LEGACY_KEYS = ('matched_gear',)
+
+def read_context(chat_session) -> Dict[str, Any]:
+    """The session's context as a dict, empty if unset or malformed"""
+    context = chat_session.conversation_context
+    return context if isinstance(context, dict) else {}
+
+def context_size(context: Dict[str, Any]) -> int:
+    """Encoded size of a context as the JSON column stores it"""
+    return len(json.dumps(context, separators=(',', ':')).encode('utf-8'))
+
+def merge_context(chat_session, updates: Optional[Dict[str, Any]]) -> List[str]:
+    """Apply updates to the session context, touching only keys whose value changed
+
+    A None value removes the key. The column is mutation-tracked, so an
+    untouched context is not written at all. Returns the changed keys.
+    """
+    if not isinstance(chat_session.conversation_context, dict):
+        chat_session.conversation_context = {}
+    context = chat_session.conversation_context
+
+    changed = []
+    for key in LEGACY_KEYS:
+        if key in context:
+            del context[key]
+            changed.append(key)
+
+    for key, value in (updates or {}).items():
+        if value is None:
+            if key in context:
+                del context[key]
+                changed.append(key)
+        elif key not in context or context[key] != value:
+            context[key] = value
+            changed.append(key)
+
+    if changed:
+        _enforce_cap(chat_session.id, context)
+    return changed
+
+def _enforce_cap(session_id: Optional[int], context: Dict[str, Any]):
+    """Drop non-essential keys, oldest first, until the context fits"""
+    size = context_size(context)
+    if size <= CONTEXT_MAX_BYTES:
+        return
+    for key in [key for key in context if key not in ESSENTIAL_KEYS]:
+        del context[key]
+        size = context_size(context)
+        logging.error(f"Conversation context of session {session_id} over {CONTEXT_MAX_BYTES} bytes, dropped {key}")
+        if size <= CONTEXT_MAX_BYTES:
+            return
+    if size > CONTEXT_MAX_BYTES:
+        logging.error(f"Conversation context of session {session_id} is {size} bytes with only essential keys")
+
+@dataclass(frozen=True)
+class UserState:
+    """Read-only copy of the fields routes and the chat engine read from a user and their active session"""
+    id: int
+    username: str
+    skill_level: str
+    main_specialization: Optional[str]
+    gear_version: int
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    active_session_id: Optional[int]
+    active_session_token: Optional[str]
+
+def load_user_state(user_id: int) -> Optional[UserState]:
+    """Load a user and their newest active chat session in one query"""
+    row = db.session.execute(
+        select(User.id, User.username, User.skill_level, User.main_specialization, User.gear_version,
+               User.created_at, User.updated_at, ChatSession.id, ChatSession.session_token)
+        .outerjoin(ChatSession, (ChatSession.user_id == User.id) & ChatSession.is_active.is_(True))
+        .where(User.id == user_id)
+        .order_by(ChatSession.id.desc())
+        .limit(1)
+    ).first()
+    if row is None:
+        return None
+    return UserState(row[0], row[1], row[2], row[3], row[4] or 0, row[5], row[6], row[7], row[8])
+
+class UserStateCache:
+    """Per-process LRU of user states with a short TTL
+
+    Entries are keyed by user id and tagged with a revision the caller
+    keeps in the client's signed session cookie and bumps on every write,
+    so a change made through any worker is seen by the next request from
+    that client; the TTL bounds staleness for other clients of the user.
+    """
+
+    def __init__(self, ttl: float = USER_STATE_TTL, max_users: int = USER_STATE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._states: "OrderedDict[int, Tuple[int, float, UserState]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user_id: int, revision: int = 0) -> Optional[UserState]:
+        """Return the user's state, reloading it if expired or from an older revision"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._states.get(user_id)
+            if entry is not None and entry[0] == revision and entry[1] > now:
+                self._states.move_to_end(user_id)
+                self._hits += 1
+                return entry[2]
+            self._misses += 1
+
+        state = load_user_state(user_id)
+        if state is None:
+            return None
+
+        with self._lock:
+            self._states[user_id] = (revision, now + self.ttl, state)
+            self._states.move_to_end(user_id)
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        return state
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'users': len(self._states),
+                'hit_rate': self._hits / lookups if lookups else 0.0
+            }
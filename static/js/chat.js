@@ -11,6 +11,9 @@ class ChatInterface {
         this.imageUploadBtn = document.getElementById('imageUploadBtn');
         this.imagePreview = document.getElementById('imagePreview');
         this.selectedFiles = [];
+        this.historyLoader = document.getElementById('historyLoader');
+        this.historyCursor = this.chatContainer.dataset.historyCursor || null;
+        this.loadingHistory = false;
         
         this.initializeEventListeners();
         this.scrollToBottom();
@@ -63,6 +66,90 @@ class ChatInterface {
         this.imageUploadBtn.addEventListener('click', () => {
             this.imageInput.click();
         });
+        
+        // Lazy-load older messages when scrolled near the top
+        this.chatContainer.addEventListener('scroll', () => {
+            if (this.chatContainer.scrollTop < 100) {
+                this.loadOlderMessages();
+            }
+        });
+    }
+    
+    async loadOlderMessages() {
+        if (!this.historyCursor || this.loadingHistory) {
+            return;
+        }
+        
+        this.loadingHistory = true;
+        this.historyLoader.style.display = 'block';
+        
+        try {
+            const params = new URLSearchParams({
+                session_token: this.sessionToken,
+                before: this.historyCursor
+            });
+            const response = await fetch(`/chat/history?${params}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            
+            const data = await response.json();
+            
+            // Prepend the page while keeping the visible messages in place
+            const previousHeight = this.chatContainer.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            data.messages.forEach(message => {
+                fragment.appendChild(this.renderHistoryMessage(message));
+            });
+            this.historyLoader.after(fragment);
+            this.chatContainer.scrollTop += this.chatContainer.scrollHeight - previousHeight;
+            
+            this.historyCursor = data.next_cursor;
+        } catch (error) {
+            console.error('Error loading chat history:', error);
+        } finally {
+            this.loadingHistory = false;
+            this.historyLoader.style.display = 'none';
+        }
+    }
+    
+    renderHistoryMessage(message) {
+        // Mirrors the server-rendered messages in chat.html
+        const messageDiv = document.createElement('div');
+        messageDiv.className = `message ${message.message_type}`;
+        
+        const header = document.createElement('div');
+        header.className = 'message-header';
+        if (message.message_type === 'user') {
+            header.innerHTML = '<i class="fas fa-user"></i> You';
+        } else {
+            header.innerHTML = '<i class="fas fa-robot"></i> Synthia';
+            if (message.step_number) {
+                header.insertAdjacentHTML('beforeend', ` <span class="badge bg-info ms-2">Step ${message.step_number}</span>`);
+            }
+        }
+        
+        const time = document.createElement('small');
+        time.className = 'text-muted ms-2';
+        time.textContent = new Date(message.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+        header.appendChild(time);
+        messageDiv.appendChild(header);
+        
+        message.images.forEach(image => {
+            const img = document.createElement('img');
+            img.src = image.url;
+            img.alt = image.original_filename;
+            img.className = 'uploaded-image';
+            img.loading = 'lazy';
+            messageDiv.appendChild(img);
+        });
+        
+        const content = document.createElement('div');
+        content.className = 'message-content';
+        content.textContent = message.content;
+        messageDiv.appendChild(content);
+        
+        return messageDiv;
     }
     
     autoResizeTextarea() {
@@ -192,7 +279,7 @@ class ChatInterface {
                     formData.append('images', file);
                 });
                 
-                response = await fetch('/chat/send', {
+                response = await fetch('/chat/stream', {
                     method: 'POST',
                     body: formData
                 });
@@ -201,7 +288,7 @@ class ChatInterface {
                 this.clearImagePreviews();
             } else {
                 // Send as JSON for text-only messages
-                response = await fetch('/chat/send', {
+                response = await fetch('/chat/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
@@ -217,7 +304,21 @@ class ChatInterface {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             
-            const data = await response.json();
+            const contentType = response.headers.get('Content-Type') || '';
+            if (response.body && contentType.includes('text/event-stream')) {
+                const done = await this.readResponseStream(response);
+                if (done.awaiting_continuation) {
+                    this.highlightQuickReplies();
+                }
+                return;
+            }
+            
+            let data = await response.json();
+            
+            // Image analyses run in the background - wait for the job to finish
+            if (data.job_id) {
+                data = await this.waitForAnalysisJob(data.status_url);
+            }
             
             // Hide typing indicator
             this.hideTypingIndicator();
@@ -233,6 +334,7 @@ class ChatInterface {
         } catch (error) {
             console.error('Error sending message:', error);
             this.hideTypingIndicator();
+            this.setTypingText('Synthia is thinking...');
             
             // Show error message
             this.addMessage('bot', 'Sorry, I encountered an error while processing your request. Please try again.', null, true);
@@ -241,6 +343,101 @@ class ChatInterface {
         }
     }
     
+    async readResponseStream(response) {
+        // Render Server-Sent Events from /chat/stream as they arrive
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let content = '';
+        let messageDiv = null;
+        let analysisChars = 0;
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            
+            for (const rawEvent of events) {
+                const { event, data } = this.parseStreamEvent(rawEvent);
+                
+                if (event === 'analysis_delta') {
+                    analysisChars += data.text.length;
+                    this.setTypingText(`Synthia is analyzing your image... (${analysisChars} characters)`);
+                } else if (event === 'section') {
+                    if (!messageDiv) {
+                        this.hideTypingIndicator();
+                        messageDiv = this.addMessage('bot', '');
+                    }
+                    content += data.content;
+                    messageDiv.querySelector('.message-content').innerHTML = this.formatMessageContent(content);
+                    this.scrollToBottom();
+                } else if (event === 'done') {
+                    if (messageDiv && data.step_number) {
+                        messageDiv.querySelector('.message-header small')
+                            .insertAdjacentHTML('beforebegin', `<span class="badge bg-info ms-2">Step ${data.step_number}</span>`);
+                    }
+                    this.setTypingText('Synthia is thinking...');
+                    return data;
+                } else if (event === 'error') {
+                    throw new Error(data.error);
+                }
+            }
+        }
+        
+        throw new Error('Response stream ended unexpectedly');
+    }
+    
+    parseStreamEvent(rawEvent) {
+        let event = 'message';
+        let data = '';
+        
+        rawEvent.split('\n').forEach(line => {
+            if (line.startsWith('event: ')) {
+                event = line.slice(7);
+            } else if (line.startsWith('data: ')) {
+                data += line.slice(6);
+            }
+        });
+        
+        return { event, data: data ? JSON.parse(data) : {} };
+    }
+    
+    setTypingText(text) {
+        const content = this.typingIndicator.querySelector('.message-content');
+        if (content) {
+            content.innerHTML = `<i class="fas fa-ellipsis-h"></i> ${text}`;
+        }
+    }
+    
+    // The server fails jobs older than ANALYSIS_JOB_TIMEOUT (240s by default); this is only a backstop
+    async waitForAnalysisJob(statusUrl, intervalMs = 1500, timeoutMs = 300000) {
+        const deadline = Date.now() + timeoutMs;
+        
+        while (Date.now() < deadline) {
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+            
+            const response = await fetch(statusUrl);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            
+            const data = await response.json();
+            if (data.status === 'completed') {
+                return data;
+            }
+            if (data.status === 'failed') {
+                throw new Error(data.error || 'Image analysis failed');
+            }
+        }
+        
+        throw new Error('Image analysis timed out');
+    }
+    
     addMessage(type, content, stepNumber = null, isError = false) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${type}`;
@@ -285,6 +482,8 @@ class ChatInterface {
         });
         
         this.scrollToBottom();
+        
+        return messageDiv;
     }
     
     formatMessageContent(content) {
@@ -0,0 +1,233 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, Any, Optional
+import httpx
+from openai import (OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient,
+                    APIConnectionError, APITimeoutError, APIStatusError, RateLimitError)
+from metrics import openai_tokens
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+# Point at a mock server (see mock_vision_server.py) or a proxy; None uses the SDK default
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+
+# Seconds; a slow upstream fails the analysis instead of hanging the worker
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.environ.get("OPENAI_READ_TIMEOUT", "60"))
+OPENAI_WRITE_TIMEOUT = float(os.environ.get("OPENAI_WRITE_TIMEOUT", "30"))
+OPENAI_POOL_TIMEOUT = float(os.environ.get("OPENAI_POOL_TIMEOUT", "10"))
+
+# Retries after the first attempt, with full-jitter exponential backoff
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
+OPENAI_BACKOFF_BASE = float(os.environ.get("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.environ.get("OPENAI_BACKOFF_MAX", "8"))
+
+# Open a keep-alive connection when the worker boots
+OPENAI_WARMUP = os.environ.get("OPENAI_WARMUP", "0").lower() in ("1", "true", "yes")
+
+KEEPALIVE_EXPIRY = 60
+
+class VisionClient:
+    """OpenAI chat completions with explicit timeouts and bounded, jittered retries
+
+    The SDK's own retries are disabled so every retry goes through one
+    policy and is counted.
+    """
+
+    def __init__(self, client: OpenAI, max_retries: int = OPENAI_MAX_RETRIES,
+                 backoff_base: float = OPENAI_BACKOFF_BASE, backoff_max: float = OPENAI_BACKOFF_MAX):
+        self.client = client
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'retries': 0, 'failures': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def create(self, **request_kwargs) -> Any:
+        """Run a non-streamed chat completion"""
+        response = self._with_retries(lambda: self.client.chat.completions.create(**request_kwargs))
+        self._count_usage(request_kwargs.get('model'), response.usage)
+        return response
+
+    def stream(self, on_delta: Callable[[str], None], **request_kwargs) -> str:
+        """Run a streamed chat completion, forwarding deltas and returning the full content
+
+        Only attempts that fail before the first delta are retried, so the
+        caller never sees output from two different completions.
+        """
+        delivered = []
+
+        def attempt() -> str:
+            content_parts = []
+            stream = self.client.chat.completions.create(stream=True, stream_options={'include_usage': True},
+                                                         **request_kwargs)
+            for chunk in stream:
+                if chunk.usage:
+                    self._count_usage(request_kwargs.get('model'), chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    content_parts.append(delta)
+                    delivered.append(True)
+                    on_delta(delta)
+            return ''.join(content_parts)
+
+        return self._with_retries(attempt, retry_allowed=lambda: not delivered)
+
+    def warmup(self):
+        """Open a pooled connection (DNS, TCP and TLS) before the first analysis"""
+        started = time.perf_counter()
+        try:
+            self.client.with_options(max_retries=0).models.list()
+            logging.info(f"Vision client warmed up in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logging.error(f"Vision client warmup failed: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        """Request/retry/failure and token counters for this process"""
+        with self._lock:
+            return dict(self._counters)
+
+    def _with_retries(self, call: Callable[[], Any], retry_allowed: Callable[[], bool] = lambda: True) -> Any:
+        attempt = 0
+        while True:
+            self._count('requests')
+            try:
+                return call()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e) or not retry_allowed():
+                    self._count('failures')
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self._count('retries')
+                logging.error(f"Vision request failed ({str(e)}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+        # Respect the server's Retry-After on 429s, within the same cap
+        if isinstance(error, RateLimitError):
+            try:
+                retry_after = float(error.response.headers.get('retry-after', 0))
+            except (TypeError, ValueError):
+                retry_after = 0
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _count_usage(self, model: Optional[str], usage: Any):
+        """Add a completion's reported token usage to the counters and the openai_tokens metric"""
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        with self._lock:
+            self._counters['prompt_tokens'] += prompt_tokens
+            self._counters['completion_tokens'] += completion_tokens
+        openai_tokens.inc(prompt_tokens, model=model, kind='prompt')
+        openai_tokens.inc(completion_tokens, model=model, kind='completion')
+
+class AsyncVisionClient(VisionClient):
+    """Async twin of VisionClient over AsyncOpenAI, for the ASGI serving mode
+
+    Same retry policy and counters; waiting on the model holds no thread.
+    """
+
+    async def create(self, **request_kwargs) -> Any:
+        """Run a non-streamed chat completion"""
+        response = await self._with_retries(lambda: self.client.chat.completions.create(**request_kwargs))
+        self._count_usage(request_kwargs.get('model'), response.usage)
+        return response
+
+    async def stream(self, on_delta: Callable[[str], None], **request_kwargs) -> str:
+        """Run a streamed chat completion, forwarding deltas and returning the full content"""
+        delivered = []
+
+        async def attempt() -> str:
+            content_parts = []
+            stream = await self.client.chat.completions.create(stream=True, stream_options={'include_usage': True},
+                                                               **request_kwargs)
+            async for chunk in stream:
+                if chunk.usage:
+                    self._count_usage(request_kwargs.get('model'), chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    content_parts.append(delta)
+                    delivered.append(True)
+                    on_delta(delta)
+            return ''.join(content_parts)
+
+        return await self._with_retries(attempt, retry_allowed=lambda: not delivered)
+
+    async def _with_retries(self, call: Callable[[], Awaitable[Any]], retry_allowed: Callable[[], bool] = lambda: True) -> Any:
+        attempt = 0
+        while True:
+            self._count('requests')
+            try:
+                return await call()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e) or not retry_allowed():
+                    self._count('failures')
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self._count('retries')
+                logging.error(f"Vision request failed ({str(e)}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+def is_retryable(error: Exception) -> bool:
+    """Timeouts, connection errors, 408/409/429 and 5xx are worth retrying"""
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+def client_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        OPENAI_READ_TIMEOUT,
+        connect=OPENAI_CONNECT_TIMEOUT,
+        write=OPENAI_WRITE_TIMEOUT,
+        pool=OPENAI_POOL_TIMEOUT
+    )
+
+def connection_limits(max_connections: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+def create_vision_client(max_connections: int, warmup: bool = OPENAI_WARMUP) -> VisionClient:
+    """Build a client whose connection pool matches the analysis concurrency"""
+    timeout = client_timeout()
+    http_client = DefaultHttpxClient(timeout=timeout, limits=connection_limits(max_connections))
+    client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client,
+                    timeout=timeout, max_retries=0)
+    vision_client = VisionClient(client)
+
+    if warmup:
+        # In the background so a slow upstream never delays worker boot
+        threading.Thread(target=vision_client.warmup, name="vision-warmup", daemon=True).start()
+
+    return vision_client
+
+def create_async_vision_client(max_connections: int) -> AsyncVisionClient:
+    """Async client for the ASGI mode; create it on the event loop that will use it"""
+    timeout = client_timeout()
+    http_client = DefaultAsyncHttpxClient(timeout=timeout, limits=connection_limits(max_connections))
+    client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client,
+                         timeout=timeout, max_retries=0)
+    return AsyncVisionClient(client)